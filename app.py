@@ -1,18 +1,161 @@
-from fastapi import FastAPI, HTTPException
+from asyncio import create_task
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime
+from hashlib import md5
+from itertools import chain, groupby
+from multiprocessing import get_all_start_methods
+from os import cpu_count, environ
+from time import perf_counter
+from typing import AsyncIterator, Awaitable, Callable, NamedTuple
+
+from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
-from starlette.status import HTTP_302_FOUND
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+)
+from numpy import ndarray
+from starlette.status import (
+    HTTP_202_ACCEPTED,
+    HTTP_302_FOUND,
+    HTTP_304_NOT_MODIFIED,
+    HTTP_429_TOO_MANY_REQUESTS,
+)
 from uvicorn import run
 
-from orthomosaics.mosaics import add_to_orthomosaic
-from orthomosaics.utils.azure_blob_storage import AzureStorage
-from orthomosaics.utils.rest_api import Payload, Results, decode_image
+from orthomosaics.coordinates import coordinates_to_metres, gps_coordinates
+from orthomosaics.coverage import (
+    CoverageMap,
+    FrameProjection,
+    project_frame,
+    redundant_frames,
+)
+from orthomosaics.footprints import (
+    FrameIndex,
+    footprint_tile_indices,
+    frame_footprint,
+    recomposite_tiles,
+    tiles_outline,
+)
+from orthomosaics.mosaics import (
+    frame_preparation_pool,
+    orthorectify_and_rotate,
+    orthorectify_and_rotate_all,
+    rotated_orthorectified_footprint,
+    target_metres_per_pixel,
+)
+from orthomosaics.ortho import GeometryCache
+from orthomosaics.tiles import (
+    TiledCanvas,
+    add_rotated_image_to_tiled_orthomosaic,
+    assemble_region,
+    existing_tiles_overlapping,
+    region_pixels,
+    tile_indices_overlapping,
+)
+from orthomosaics.utils.azure_blob_storage import AzureTileStorage
+from orthomosaics.utils.encoding import MEDIA_TYPES, encode_array
+from orthomosaics.utils.ingestion import IngestionQueue, IngestionQueueFull
+from orthomosaics.utils.metrics import (
+    Labels,
+    SamplingProfiler,
+    collect_timings,
+    metrics,
+    stage,
+)
+from orthomosaics.utils.mosaic_cache import CachedMosaic, MosaicCache
+from orthomosaics.utils.rest_api import (
+    BatchPayload,
+    BinaryPayload,
+    Diagnostics,
+    Frame,
+    FrameMetadata,
+    Job,
+    MosaicSettings,
+    NullImage,
+    Payload,
+    Results,
+    decode_image,
+    decode_image_buffer,
+)
+from orthomosaics.utils.schemas import (
+    CompositingPolicy,
+    FrameRecord,
+    ImageEncoding,
+    OrthomosaicMetadata,
+)
+from orthomosaics.utils.tile_storage import LocalTileStorage, TileStorage
+from orthomosaics.utils.worker_pool import WorkerPool, WorkerPoolFull
+
+TILE_ENCODING = ImageEncoding(format="png", png_compression_level=1)
+storage: TileStorage = (
+    LocalTileStorage(
+        directory=environ["ORTHOMOSAICS_TILE_DIRECTORY"], encoding=TILE_ENCODING
+    )
+    if "ORTHOMOSAICS_TILE_DIRECTORY" in environ
+    else AzureTileStorage(
+        container_name="YOUR_CONTAINER_NAME",
+        connection_string="YOUR_AZURE_CONNECTION_STRING",
+        encoding=TILE_ENCODING,
+    )
+)
+FRAME_PREPARATION_WORKERS = int(
+    environ.get("ORTHOMOSAICS_FRAME_PREPARATION_WORKERS", cpu_count() or 1)
+)
+COMPOSITING_WORKERS = cpu_count() or 1
+MAX_CONCURRENT_REQUESTS = 4 * COMPOSITING_WORKERS
+MAX_QUEUED_UPDATES = 4 * MAX_CONCURRENT_REQUESTS
+MOSAIC_CACHE_BYTES = 2 * 1024**3
+MOSAIC_CACHE_FLUSH_INTERVAL_S = 30.0
+MAX_REGION_PIXELS = 4096 * 4096
+COVERAGE_CELL_PIXELS = 32
+QueuedFrame = tuple[ndarray, FrameMetadata, MosaicSettings]
+
+
+class FrameEdit(NamedTuple):
+    frame_id: int
+    replacement: QueuedFrame | None
 
-storage = AzureStorage(
-    container_name="YOUR_CONTAINER_NAME",
-    connection_string="YOUR_AZURE_CONNECTION_STRING",
+
+geometry_cache = GeometryCache(max_size=256, attitude_tolerance_deg=0.01)
+orthomosaics_metadata: dict[int, OrthomosaicMetadata] = {}
+mosaic_cache = MosaicCache(
+    storage=storage,
+    max_bytes=MOSAIC_CACHE_BYTES,
+    flush_interval_s=MOSAIC_CACHE_FLUSH_INTERVAL_S,
+)
+worker_pool = WorkerPool(
+    workers=COMPOSITING_WORKERS, max_requests=MAX_CONCURRENT_REQUESTS
 )
-app = FastAPI(title="Orthomosaics", debug=False, version="1.0.0")
+preparation_pool: ProcessPoolExecutor | None = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Write the cached orthomosaics to storage in the background, and on shutdown,
+    and keep one process pool for preparing frames while the server runs"""
+    global preparation_pool
+    if FRAME_PREPARATION_WORKERS > 1:
+        preparation_pool = frame_preparation_pool(
+            workers=FRAME_PREPARATION_WORKERS,
+            geometry_cache=geometry_cache,
+            start_method=(
+                "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+            ),
+        )
+    flushing = create_task(mosaic_cache.flush_periodically())
+    yield
+    flushing.cancel()
+    await mosaic_cache.flush_all()
+    if preparation_pool is not None:
+        preparation_pool.shutdown(cancel_futures=True)
+        preparation_pool = None
+
+
+app = FastAPI(title="Orthomosaics", debug=False, version="1.0.0", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -22,45 +165,1097 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_request_metrics(
+    request: Request, call_next: Callable[[Request], Awaitable[Response]]
+) -> Response:
+    begin = perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.observe(
+        "orthomosaic_request_seconds",
+        perf_counter() - begin,
+        method=request.method,
+        path=getattr(route, "path", "unmatched"),
+        status=str(response.status_code),
+    )
+    metrics.increment(
+        "orthomosaic_request_bytes_total",
+        int(request.headers.get("content-length", 0)),
+    )
+    return response
+
+
+@app.exception_handler(WorkerPoolFull)
+@app.exception_handler(IngestionQueueFull)
+async def too_many_requests(
+    request: Request, error: WorkerPoolFull | IngestionQueueFull
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=HTTP_429_TOO_MANY_REQUESTS,
+        content=dict(detail=str(error)),
+        headers={"Retry-After": "1"},
+    )
+
+
 @app.get("/")
 async def main() -> RedirectResponse:
     return RedirectResponse(url="/docs", status_code=HTTP_302_FOUND)
 
 
 @app.get(path="/orthomosaic/", description="download an orthomosaic image")
-async def download_orthmosaic_image(orthomosaic_id: int) -> bytes:
-    try:
-        return storage._image_bytes(image_id=orthomosaic_id).get_value()
-    except Exception as error_details:
-        raise HTTPException(status_code=500, detail=str(error_details))
+async def download_orthmosaic_image(
+    orthomosaic_id: int, encoding: ImageEncoding = Depends()
+) -> Response:
+    async with worker_pool.admission():
+        try:
+            await mosaic_cache.flush(orthomosaic_id=orthomosaic_id)
+            tiles = await storage.read_tiles_async(
+                image_id=orthomosaic_id,
+                indices=await storage.list_tiles_async(image_id=orthomosaic_id),
+            )
+            if not tiles:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Orthomosaic {orthomosaic_id} not found",
+                )
+            tile_size, _, _ = next(iter(tiles.values())).shape
+            canvas = TiledCanvas(tile_size=tile_size, tiles=tiles)
+            return Response(
+                content=await worker_pool.run(
+                    encode_array,
+                    image=await worker_pool.run(canvas.to_array),
+                    encoding=encoding,
+                ),
+                media_type=MEDIA_TYPES[encoding.format],
+            )
+        except HTTPException:
+            raise
+        except Exception as error_details:
+            raise HTTPException(status_code=500, detail=str(error_details))
 
 
-@app.post(path="/orthomosaic/", description="add a backdown image to the orthomosaic")
-async def upload_backdown_image(payload: Payload) -> Results:
-    try:
-        new_orthomosaic_image, new_orthomosaic_metadata = add_to_orthomosaic(
-            orthomosaic_image=storage.download_image(
-                metadata=payload.orthomosaic_metadata
-            )
-            if payload.orthomosaic_metadata
-            else None,
-            orthomosaic_metadata=payload.orthomosaic_metadata,
-            backdown_image=decode_image(image_b64=payload.backdown_image_b64),
-            gps_data=payload.gps,
-            backdown_image_metadata=payload.backdown_image_metadata,
-            camera_settings=payload.camera_settings,
-            bottom_crop=payload.bottom_crop_pixels,
-            side_crop=payload.side_crop_pixels,
-        )
-        storage.upload_image(
-            image=new_orthomosaic_image, metadata=new_orthomosaic_metadata
+async def known_orthomosaic_metadata(
+    orthomosaic_id: int,
+) -> OrthomosaicMetadata | None:
+    mosaic = mosaic_cache.mosaics.get(orthomosaic_id)
+    if mosaic is not None:
+        return mosaic.metadata
+    if orthomosaic_id in orthomosaics_metadata:
+        return orthomosaics_metadata[orthomosaic_id]
+    return await storage.read_metadata_async(image_id=orthomosaic_id)
+
+
+def require_projected_axes(
+    orthomosaic_id: int, orthomosaic_metadata: OrthomosaicMetadata | None
+) -> None:
+    """Refuse queries in projected metres on an orthomosaic aligned with a corridor"""
+    if orthomosaic_metadata is not None and orthomosaic_metadata.corridor_heading:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Orthomosaic {orthomosaic_id} is aligned with a corridor (heading {orthomosaic_metadata.corridor_heading:g}), so it cannot be queried in projected metres",
+        )
+
+
+def cacheable_image(image_bytes: bytes, media_type: str, request: Request) -> Response:
+    """Image response that viewers can cache, revalidating with the ETag"""
+    etag = f'"{md5(image_bytes).hexdigest()}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={int(MOSAIC_CACHE_FLUSH_INTERVAL_S)}",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=image_bytes, media_type=media_type, headers=headers)
+
+
+@app.get(
+    path="/orthomosaic/tiles/{orthomosaic_id}/{level}/{column}/{row}",
+    description="download one tile of an orthomosaic at an overview level (0 is full resolution, each level halves it)",
+)
+async def download_orthomosaic_tile(
+    orthomosaic_id: int, level: int, column: int, row: int, request: Request
+) -> Response:
+    async with worker_pool.admission():
+        try:
+            await mosaic_cache.flush(orthomosaic_id=orthomosaic_id)
+            tile_bytes = await storage.read_tile_bytes_async(
+                image_id=orthomosaic_id, index=(row, column), level=level
+            )
+            if tile_bytes is None:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Tile {level}/{column}/{row} of orthomosaic {orthomosaic_id} not found",
+                )
+            return cacheable_image(
+                image_bytes=tile_bytes,
+                media_type=MEDIA_TYPES[storage.encoding.format],
+                request=request,
+            )
+        except HTTPException:
+            raise
+        except Exception as error_details:
+            raise HTTPException(status_code=500, detail=str(error_details))
+
+
+@app.get(
+    path="/orthomosaic/region",
+    description="download the part of an orthomosaic inside a bounding box in metres, at an overview level",
+)
+async def download_orthomosaic_region(
+    orthomosaic_id: int,
+    x_min_m: float,
+    y_min_m: float,
+    x_max_m: float,
+    y_max_m: float,
+    request: Request,
+    level: int = 0,
+    encoding: ImageEncoding = Depends(),
+) -> Response:
+    async with worker_pool.admission():
+        try:
+            orthomosaic_metadata = await known_orthomosaic_metadata(
+                orthomosaic_id=orthomosaic_id
+            )
+            if orthomosaic_metadata is None:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Orthomosaic {orthomosaic_id} not found",
+                )
+            if not 0 <= level <= orthomosaic_metadata.overview_levels:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Orthomosaic {orthomosaic_id} has overview levels 0 to {orthomosaic_metadata.overview_levels}",
+                )
+            require_projected_axes(
+                orthomosaic_id=orthomosaic_id,
+                orthomosaic_metadata=orthomosaic_metadata,
+            )
+            x, y, width, height = region_pixels(
+                orthomosaic_metadata=orthomosaic_metadata,
+                x_min_m=x_min_m,
+                y_min_m=y_min_m,
+                x_max_m=x_max_m,
+                y_max_m=y_max_m,
+                level=level,
+            )
+            if width * height > MAX_REGION_PIXELS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"The region is {width}x{height} pixels at level {level}, use a smaller region or a higher level",
+                )
+            await mosaic_cache.flush(orthomosaic_id=orthomosaic_id)
+            tiles = await storage.read_tiles_async(
+                image_id=orthomosaic_id,
+                indices=tile_indices_overlapping(
+                    tile_size=orthomosaic_metadata.tile_size_pixels,
+                    x=x,
+                    y=y,
+                    width=width,
+                    height=height,
+                ),
+                level=level,
+            )
+            region = await worker_pool.run(
+                assemble_region,
+                tiles=tiles,
+                tile_size=orthomosaic_metadata.tile_size_pixels,
+                x=x,
+                y=y,
+                width=width,
+                height=height,
+            )
+            return cacheable_image(
+                image_bytes=await worker_pool.run(
+                    encode_array, image=region, encoding=encoding
+                ),
+                media_type=MEDIA_TYPES[encoding.format],
+                request=request,
+            )
+        except HTTPException:
+            raise
+        except Exception as error_details:
+            raise HTTPException(status_code=500, detail=str(error_details))
+
+
+def prepare_backdown_images(
+    frames: list[QueuedFrame],
+) -> list[tuple[ndarray, OrthomosaicMetadata, MosaicSettings]]:
+    prepared_frames = []
+    for _, frames_with_settings in groupby(frames, key=lambda frame: id(frame[2])):
+        backdown_images, frames_metadata, settings = zip(*frames_with_settings)
+        prepared_frames.extend(
+            (
+                rotated_orthorectified_image,
+                rotated_orthorectified_image_metadata,
+                settings[0],
+            )
+            for (
+                rotated_orthorectified_image,
+                rotated_orthorectified_image_metadata,
+            ) in orthorectify_and_rotate_all(
+                backdown_images=list(backdown_images),
+                gps_data=[frame.gps for frame in frames_metadata],
+                backdown_images_metadata=[
+                    frame.backdown_image_metadata for frame in frames_metadata
+                ],
+                camera_settings=settings[0].camera_settings,
+                bottom_crop=settings[0].bottom_crop_pixels,
+                side_crop=settings[0].side_crop_pixels,
+                fused_warp=settings[0].fused_warp,
+                geometry_cache=geometry_cache,
+                workers=FRAME_PREPARATION_WORKERS if len(backdown_images) > 1 else 1,
+                metres_per_pixel=settings[0].metres_per_pixel,
+                pool=preparation_pool,
+            )
+        )
+    return prepared_frames
+
+
+def prepare_recorded_frames(
+    orthomosaic_metadata: OrthomosaicMetadata,
+    frames: list[tuple[ndarray, FrameRecord]],
+) -> list[tuple[ndarray, OrthomosaicMetadata, CompositingPolicy]]:
+    return [
+        (
+            *orthorectify_and_rotate(
+                backdown_image=backdown_image,
+                gps_data=frame.gps,
+                backdown_image_metadata=frame.backdown_image_metadata,
+                camera_settings=frame.camera_settings,
+                bottom_crop=frame.bottom_crop,
+                side_crop=frame.side_crop,
+                fused_warp=frame.fused_warp,
+                geometry_cache=geometry_cache,
+                metres_per_pixel=target_metres_per_pixel(
+                    orthomosaic_metadata=orthomosaic_metadata,
+                    metres_per_pixel=frame.metres_per_pixel,
+                ),
+            ),
+            frame.compositing_policy,
+        )
+        for backdown_image, frame in frames
+    ]
+
+
+def frame_record(
+    frame_id: int,
+    frame_metadata: FrameMetadata,
+    settings: MosaicSettings,
+    footprint: list[tuple[float, float]],
+) -> FrameRecord:
+    return FrameRecord(
+        id=frame_id,
+        gps=frame_metadata.gps,
+        backdown_image_metadata=frame_metadata.backdown_image_metadata,
+        camera_settings=settings.camera_settings,
+        bottom_crop=settings.bottom_crop_pixels,
+        side_crop=settings.side_crop_pixels,
+        fused_warp=settings.fused_warp,
+        compositing_policy=settings.compositing_policy,
+        metres_per_pixel=settings.metres_per_pixel,
+        footprint=footprint,
+    )
+
+
+def composite_backdown_images(
+    canvas: TiledCanvas,
+    orthomosaic_metadata: OrthomosaicMetadata,
+    prepared_frames: list[tuple[ndarray, OrthomosaicMetadata, MosaicSettings]],
+) -> tuple[TiledCanvas, OrthomosaicMetadata, list[list[tuple[float, float]]]]:
+    footprints = []
+    for (
+        rotated_orthorectified_image,
+        rotated_orthorectified_image_metadata,
+        settings,
+    ) in prepared_frames:
+        canvas, orthomosaic_metadata = add_rotated_image_to_tiled_orthomosaic(
+            canvas=canvas,
+            orthomosaic_metadata=orthomosaic_metadata,
+            rotated_orthorectified_image=rotated_orthorectified_image,
+            rotated_orthorectified_image_metadata=rotated_orthorectified_image_metadata,
+            compositing_policy=settings.compositing_policy,
         )
+        footprints.append(
+            frame_footprint(
+                orthomosaic_metadata=orthomosaic_metadata,
+                rotated_orthorectified_image=rotated_orthorectified_image,
+                rotated_orthorectified_image_metadata=rotated_orthorectified_image_metadata,
+            )
+        )
+    return canvas, orthomosaic_metadata, footprints
+
+
+def cached_mosaic(
+    orthomosaic_metadata: OrthomosaicMetadata, frames: list[FrameRecord]
+) -> CachedMosaic:
+    return CachedMosaic(
+        canvas=TiledCanvas(tile_size=orthomosaic_metadata.tile_size_pixels),
+        metadata=orthomosaic_metadata,
+        coverage=CoverageMap(
+            tile_size=orthomosaic_metadata.tile_size_pixels,
+            cell_size=COVERAGE_CELL_PIXELS,
+        ),
+        overviews=[
+            TiledCanvas(tile_size=orthomosaic_metadata.tile_size_pixels)
+            for _ in range(orthomosaic_metadata.overview_levels)
+        ],
+        frames=FrameIndex(frames=frames),
+    )
+
+
+async def stored_mosaic(
+    orthomosaic_id: int, orthomosaic_metadata: OrthomosaicMetadata | None = None
+) -> CachedMosaic | None:
+    """The cached orthomosaic, or one restored from its stored metadata and frame records"""
+    mosaic = mosaic_cache.get(orthomosaic_id=orthomosaic_id)
+    if mosaic is not None:
+        return mosaic
+    orthomosaic_metadata = (
+        await known_orthomosaic_metadata(orthomosaic_id=orthomosaic_id)
+        or orthomosaic_metadata
+    )
+    if orthomosaic_metadata is None:
+        return None
+    return cached_mosaic(
+        orthomosaic_metadata=orthomosaic_metadata,
+        frames=await storage.read_frame_records_async(image_id=orthomosaic_id),
+    )
+
+
+def new_orthomosaic_metadata(
+    orthomosaic_id: int, frame: QueuedFrame
+) -> OrthomosaicMetadata:
+    """Metadata of an orthomosaic starting with a backdown image, without warping it"""
+    backdown_image, frame_metadata, settings = frame
+    height, width, _ = backdown_image.shape
+    _, m_per_pixel = rotated_orthorectified_footprint(
+        image_width=width,
+        image_height=height,
+        image_metadata=frame_metadata.backdown_image_metadata,
+        camera_settings=settings.camera_settings,
+        heading=frame_metadata.gps.heading,
+        geometry_cache=geometry_cache,
+        metres_per_pixel=settings.metres_per_pixel,
+    )
+    ((x_m, y_m),) = coordinates_to_metres(
+        coordinates=gps_coordinates(gps_data=[frame_metadata.gps])
+    ).tolist()
+    return OrthomosaicMetadata(
+        x_m=x_m,
+        y_m=y_m,
+        x_m_per_pixel=m_per_pixel,
+        y_m_per_pixel=m_per_pixel,
+        id=orthomosaic_id,
+        tile_size_pixels=settings.tile_size_pixels,
+        overview_levels=settings.overview_levels,
+    )
+
+
+def on_orthomosaic_grid(
+    orthomosaic_metadata: OrthomosaicMetadata, frames: list[QueuedFrame]
+) -> list[QueuedFrame]:
+    """The frames with the ground sample distance of the orthomosaic they are
+    added to, so that they are warped onto its grid"""
+    grid_settings = {}
+    for _, _, settings in frames:
+        if id(settings) not in grid_settings:
+            grid_settings[id(settings)] = settings.model_copy(
+                update=dict(
+                    metres_per_pixel=target_metres_per_pixel(
+                        orthomosaic_metadata=orthomosaic_metadata,
+                        metres_per_pixel=settings.metres_per_pixel,
+                    )
+                )
+            )
+    return [
+        (backdown_image, frame_metadata, grid_settings[id(settings)])
+        for backdown_image, frame_metadata, settings in frames
+    ]
+
+
+def project_backdown_images(
+    orthomosaic_metadata: OrthomosaicMetadata,
+    frames: list[QueuedFrame],
+    cell_size: int,
+) -> list[FrameProjection]:
+    return [
+        project_frame(
+            orthomosaic_metadata=orthomosaic_metadata,
+            image_width=backdown_image.shape[1],
+            image_height=backdown_image.shape[0],
+            gps_data=frame_metadata.gps,
+            image_metadata=frame_metadata.backdown_image_metadata,
+            camera_settings=settings.camera_settings,
+            bottom_crop=settings.bottom_crop_pixels,
+            side_crop=settings.side_crop_pixels,
+            cell_size=cell_size,
+            geometry_cache=geometry_cache,
+            metres_per_pixel=settings.metres_per_pixel,
+        )
+        for backdown_image, frame_metadata, settings in frames
+    ]
+
+
+def find_redundant_frames(
+    mosaic: CachedMosaic,
+    projections: list[FrameProjection],
+    frames: list[QueuedFrame],
+) -> list[bool]:
+    """Compare the projected frames with the coverage of the tiles under them,
+    bringing the coverage of those tiles up to date first"""
+    indices = {
+        index
+        for projection in projections
+        for index in mosaic.coverage.tile_indices(projection=projection)
+    }
+    mosaic.coverage.update(
+        tiles={
+            index: mosaic.canvas.tiles[index]
+            for index in indices
+            if index in mosaic.canvas.tiles and index not in mosaic.coverage.cells
+        }
+    )
+    return redundant_frames(
+        coverage=mosaic.coverage,
+        projections=projections,
+        compositing_policies=[settings.compositing_policy for _, _, settings in frames],
+        min_changed_fractions=[
+            settings.min_changed_fraction for _, _, settings in frames
+        ],
+    )
+
+
+async def skip_redundant_frames(
+    orthomosaic_id: int, mosaic: CachedMosaic, frames: list[QueuedFrame]
+) -> list[QueuedFrame]:
+    """The frames that would change at least their `min_changed_fraction` of
+    their footprint, judged before warping them from their projected footprints
+    and a low resolution alpha coverage of the orthomosaic"""
+    if not any(settings.min_changed_fraction > 0 for _, _, settings in frames):
+        return frames
+    with stage("project"):
+        projections = await worker_pool.run(
+            project_backdown_images,
+            orthomosaic_metadata=mosaic.metadata,
+            frames=frames,
+            cell_size=mosaic.coverage.cell_size,
+        )
+    async with mosaic.lock:
+        await mosaic_cache.load_tiles(
+            orthomosaic_id=orthomosaic_id,
+            mosaic=mosaic,
+            indices=(
+                index
+                for projection in projections
+                for index in mosaic.coverage.tile_indices(projection=projection)
+            ),
+        )
+        redundant = await worker_pool.run(
+            find_redundant_frames,
+            mosaic=mosaic,
+            projections=projections,
+            frames=frames,
+        )
+    return [frame for frame, is_redundant in zip(frames, redundant) if not is_redundant]
+
+
+async def add_backdown_images(
+    orthomosaic_id: int, frames: list[QueuedFrame]
+) -> Results:
+    """One composite cycle for the frames, on the cached canvas of the orthomosaic,
+    fetching only the affected tiles that are not in memory yet"""
+    mosaic = await stored_mosaic(
+        orthomosaic_id=orthomosaic_id,
+        orthomosaic_metadata=next(
+            (
+                settings.orthomosaic_metadata
+                for _, _, settings in frames
+                if settings.orthomosaic_metadata is not None
+            ),
+            None,
+        ),
+    )
+    if mosaic is None:
+        mosaic = cached_mosaic(
+            orthomosaic_metadata=new_orthomosaic_metadata(
+                orthomosaic_id=orthomosaic_id, frame=frames[0]
+            ),
+            frames=[],
+        )
+    frames = on_orthomosaic_grid(orthomosaic_metadata=mosaic.metadata, frames=frames)
+    kept_frames = await skip_redundant_frames(
+        orthomosaic_id=orthomosaic_id, mosaic=mosaic, frames=frames
+    )
+    skipped_frames = len(frames) - len(kept_frames)
+    if not kept_frames:
+        if mosaic.frames.frames:
+            await mosaic_cache.put(orthomosaic_id=orthomosaic_id, mosaic=mosaic)
         return Results(
-            message=f"Updated orthomosaic uploaded to Azure Storage Blob: {storage.container}/orthomosaic_{new_orthomosaic_metadata.id}.png",
-            orthomosaic_metadata=new_orthomosaic_metadata,
+            message=f"{skipped_frames} redundant backdown images skipped",
+            orthomosaic_metadata=mosaic.metadata,
+            skipped_frames=skipped_frames,
         )
-    except Exception as error_details:
-        raise HTTPException(status_code=500, detail=str(error_details))
+    frames = kept_frames
+    with stage("prepare"):
+        prepared_frames = await worker_pool.run(prepare_backdown_images, frames=frames)
+    frame_ids = list(
+        range(mosaic.frames.next_id(), mosaic.frames.next_id() + len(frames))
+    )
+    await storage.write_frames_async(
+        image_id=orthomosaic_id,
+        frames={
+            frame_id: backdown_image
+            for frame_id, (backdown_image, _, _) in zip(frame_ids, frames)
+        },
+    )
+    async with mosaic.lock:
+        await mosaic_cache.load_tiles(
+            orthomosaic_id=orthomosaic_id,
+            mosaic=mosaic,
+            indices=(
+                index
+                for (
+                    rotated_orthorectified_image,
+                    rotated_orthorectified_image_metadata,
+                    _,
+                ) in prepared_frames
+                for index in existing_tiles_overlapping(
+                    orthomosaic_metadata=mosaic.metadata,
+                    rotated_orthorectified_image=rotated_orthorectified_image,
+                    rotated_orthorectified_image_metadata=rotated_orthorectified_image_metadata,
+                )
+            ),
+        )
+        mosaic.canvas, mosaic.metadata, footprints = await worker_pool.run(
+            composite_backdown_images,
+            canvas=mosaic.canvas,
+            orthomosaic_metadata=mosaic.metadata,
+            prepared_frames=prepared_frames,
+        )
+        mosaic.coverage.discard(indices=mosaic.canvas.dirty)
+        for frame_id, (_, frame_metadata, settings), footprint in zip(
+            frame_ids, frames, footprints
+        ):
+            mosaic.frames.add(
+                frame=frame_record(
+                    frame_id=frame_id,
+                    frame_metadata=frame_metadata,
+                    settings=settings,
+                    footprint=footprint,
+                )
+            )
+    orthomosaics_metadata[orthomosaic_id] = mosaic.metadata
+    await mosaic_cache.put(orthomosaic_id=orthomosaic_id, mosaic=mosaic)
+    return Results(
+        message=f"{len(frames)} backdown images added as frames {frame_ids[0]} to {frame_ids[-1]}{f' ({skipped_frames} redundant ones skipped)' if skipped_frames else ''}, {len(mosaic.canvas.dirty)} updated orthomosaic tiles waiting to be written to {storage.location(image_id=orthomosaic_id)}",
+        orthomosaic_metadata=mosaic.metadata,
+        skipped_frames=skipped_frames,
+    )
+
+
+async def edit_frame(orthomosaic_id: int, edit: FrameEdit) -> Results:
+    """Replace or remove a frame, compositing again only the tiles it overlaps
+    from the frames that overlap them"""
+    mosaic = await stored_mosaic(orthomosaic_id=orthomosaic_id)
+    if mosaic is None:
+        raise ValueError(f"Orthomosaic {orthomosaic_id} not found")
+    if edit.frame_id not in mosaic.frames.frames:
+        raise ValueError(
+            f"Frame {edit.frame_id} of orthomosaic {orthomosaic_id} not found"
+        )
+    frames = mosaic.frames.copy()
+    indices = set(
+        footprint_tile_indices(
+            orthomosaic_metadata=mosaic.metadata,
+            footprint=frames.remove(frame_id=edit.frame_id).footprint,
+        )
+    )
+    backdown_images = {}
+    if edit.replacement is not None:
+        [replacement] = on_orthomosaic_grid(
+            orthomosaic_metadata=mosaic.metadata, frames=[edit.replacement]
+        )
+        backdown_image, frame_metadata, settings = replacement
+        [
+            (rotated_orthorectified_image, rotated_orthorectified_image_metadata, _)
+        ] = await worker_pool.run(prepare_backdown_images, frames=[replacement])
+        frame = frame_record(
+            frame_id=edit.frame_id,
+            frame_metadata=frame_metadata,
+            settings=settings,
+            footprint=frame_footprint(
+                orthomosaic_metadata=mosaic.metadata,
+                rotated_orthorectified_image=rotated_orthorectified_image,
+                rotated_orthorectified_image_metadata=rotated_orthorectified_image_metadata,
+            ),
+        )
+        frames = mosaic.frames.copy()
+        frames.add(frame=frame)
+        indices.update(
+            footprint_tile_indices(
+                orthomosaic_metadata=mosaic.metadata, footprint=frame.footprint
+            )
+        )
+        backdown_images[edit.frame_id] = backdown_image
+    indices = sorted(indices)
+    overlapping_frames = frames.overlapping(
+        geometry=tiles_outline(orthomosaic_metadata=mosaic.metadata, indices=indices)
+    )
+    backdown_images.update(
+        await storage.read_frames_async(
+            image_id=orthomosaic_id,
+            frame_ids=[
+                frame.id
+                for frame in overlapping_frames
+                if frame.id not in backdown_images
+            ],
+        )
+    )
+    missing_frames = [
+        frame.id for frame in overlapping_frames if frame.id not in backdown_images
+    ]
+    if missing_frames:
+        raise ValueError(
+            f"The backdown images of frames {missing_frames} of orthomosaic {orthomosaic_id} are not stored"
+        )
+    with stage("recomposite"):
+        tiles = await worker_pool.run(
+            recomposite_tiles,
+            orthomosaic_metadata=mosaic.metadata,
+            indices=indices,
+            prepared_frames=await worker_pool.run(
+                prepare_recorded_frames,
+                orthomosaic_metadata=mosaic.metadata,
+                frames=[
+                    (backdown_images[frame.id], frame) for frame in overlapping_frames
+                ],
+            ),
+        )
+    if edit.replacement is not None:
+        await storage.write_frames_async(
+            image_id=orthomosaic_id,
+            frames={edit.frame_id: backdown_images[edit.frame_id]},
+        )
+    async with mosaic.lock:
+        mosaic.canvas.tiles.update(tiles)
+        mosaic.canvas.dirty.update(tiles)
+        mosaic.coverage.discard(indices=set(tiles))
+        mosaic.frames = frames
+        mosaic.metadata = mosaic.metadata.model_copy(
+            update=dict(
+                tile_indices=sorted(set(mosaic.metadata.tile_indices) | set(tiles))
+            )
+        )
+    orthomosaics_metadata[orthomosaic_id] = mosaic.metadata
+    await mosaic_cache.put(orthomosaic_id=orthomosaic_id, mosaic=mosaic)
+    return Results(
+        message=f"Frame {edit.frame_id} {'removed' if edit.replacement is None else 'replaced'}, {len(tiles)} orthomosaic tiles composited again",
+        orthomosaic_metadata=mosaic.metadata,
+    )
+
+
+async def apply_queued_updates(
+    orthomosaic_id: int, updates: list[list[QueuedFrame] | FrameEdit]
+) -> Results:
+    """Apply the updates queued for an orthomosaic in order, adding the frames
+    queued one after another in a single cycle"""
+    results = []
+    with collect_timings() as timings:
+        for is_edit, consecutive_updates in groupby(
+            updates, key=lambda update: isinstance(update, FrameEdit)
+        ):
+            if is_edit:
+                for edit in consecutive_updates:
+                    results.append(
+                        await edit_frame(orthomosaic_id=orthomosaic_id, edit=edit)
+                    )
+            else:
+                results.append(
+                    await add_backdown_images(
+                        orthomosaic_id=orthomosaic_id,
+                        frames=list(chain.from_iterable(consecutive_updates)),
+                    )
+                )
+    return Results(
+        message=", ".join(result.message for result in results),
+        orthomosaic_metadata=results[-1].orthomosaic_metadata,
+        skipped_frames=sum(result.skipped_frames for result in results),
+        timings=timings.seconds,
+    )
+
+
+ingestion_queue: IngestionQueue[list[QueuedFrame] | FrameEdit] = IngestionQueue(
+    flush=apply_queued_updates, max_queued_updates=MAX_QUEUED_UPDATES
+)
+
+
+async def require_orthomosaic_grid(
+    orthomosaic_id: int, settings: MosaicSettings
+) -> None:
+    """Refuse frames at another ground sample distance than their orthomosaic"""
+    try:
+        target_metres_per_pixel(
+            orthomosaic_metadata=await known_orthomosaic_metadata(
+                orthomosaic_id=orthomosaic_id
+            )
+            or settings.orthomosaic_metadata,
+            metres_per_pixel=settings.metres_per_pixel,
+        )
+    except ValueError as error_details:
+        raise HTTPException(status_code=400, detail=str(error_details))
+
+
+async def queue_backdown_images(
+    backdown_images: list[ndarray],
+    frames_metadata: list[FrameMetadata],
+    settings: MosaicSettings,
+) -> Job:
+    if settings.orthomosaic_metadata is None:
+        orthomosaic_id = hash(datetime.now())
+    else:
+        orthomosaic_id = settings.orthomosaic_metadata.id
+        await require_orthomosaic_grid(orthomosaic_id=orthomosaic_id, settings=settings)
+    return ingestion_queue.submit(
+        orthomosaic_id=orthomosaic_id,
+        update=[
+            (backdown_image, frame_metadata, settings)
+            for backdown_image, frame_metadata in zip(backdown_images, frames_metadata)
+        ],
+    )
+
+
+async def job_results(job: Job) -> Results:
+    job = await ingestion_queue.wait(job_id=job.id)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.detail)
+    return job.results
+
+
+def sampling_profiler(diagnostics: Diagnostics) -> SamplingProfiler | nullcontext:
+    return SamplingProfiler() if diagnostics.profile else nullcontext()
+
+
+def diagnosed_results(
+    results: Results, diagnostics: Diagnostics, profiler: SamplingProfiler | None
+) -> Results:
+    """The results with the stage timings and the profile of the request, if asked for"""
+    return results.model_copy(
+        update=dict(
+            timings=results.timings if diagnostics.timings else None,
+            profile=None if profiler is None else profiler.collapsed(),
+        )
+    )
+
+
+@app.post(path="/orthomosaic/", description="add a backdown image to the orthomosaic")
+async def upload_backdown_image(
+    payload: Payload, diagnostics: Diagnostics = Depends()
+) -> Results:
+    async with worker_pool.admission():
+        try:
+            with sampling_profiler(diagnostics=diagnostics) as profiler:
+                results = await job_results(
+                    job=await queue_backdown_images(
+                        backdown_images=[
+                            await worker_pool.run(
+                                decode_image, image_b64=payload.backdown_image_b64
+                            )
+                        ],
+                        frames_metadata=[payload],
+                        settings=payload,
+                    )
+                )
+            return diagnosed_results(
+                results=results, diagnostics=diagnostics, profiler=profiler
+            )
+        except (HTTPException, IngestionQueueFull):
+            raise
+        except Exception as error_details:
+            raise HTTPException(status_code=500, detail=str(error_details))
+
+
+@app.post(
+    path="/orthomosaic/upload",
+    description="add a backdown image sent as a binary file (jpeg/png, or raw uint8 pixels with image_shape) to the orthomosaic",
+)
+async def upload_backdown_image_file(
+    backdown_image: UploadFile = File(...),
+    payload: str = Form(..., description="BinaryPayload as json"),
+    image_shape: str | None = Form(None, description="height,width,channels"),
+    diagnostics: Diagnostics = Depends(),
+) -> Results:
+    async with worker_pool.admission():
+        try:
+            binary_payload = BinaryPayload.model_validate_json(payload)
+            with sampling_profiler(diagnostics=diagnostics) as profiler:
+                results = await job_results(
+                    job=await queue_backdown_images(
+                        backdown_images=[
+                            await worker_pool.run(
+                                decode_image_buffer,
+                                image_buffer=await backdown_image.read(),
+                                image_shape=None
+                                if image_shape is None
+                                else tuple(
+                                    int(length) for length in image_shape.split(",")
+                                ),
+                            )
+                        ],
+                        frames_metadata=[binary_payload],
+                        settings=binary_payload,
+                    )
+                )
+            return diagnosed_results(
+                results=results, diagnostics=diagnostics, profiler=profiler
+            )
+        except (HTTPException, IngestionQueueFull):
+            raise
+        except NullImage as error_details:
+            raise HTTPException(status_code=400, detail=str(error_details))
+        except Exception as error_details:
+            raise HTTPException(status_code=500, detail=str(error_details))
+
+
+def decode_images(frames: list[Frame]) -> list[ndarray]:
+    return [decode_image(image_b64=frame.backdown_image_b64) for frame in frames]
+
+
+@app.post(
+    path="/orthomosaic/batch",
+    description="add many backdown images to the orthomosaic in one pass",
+)
+async def upload_backdown_images(
+    payload: BatchPayload, diagnostics: Diagnostics = Depends()
+) -> Results:
+    async with worker_pool.admission():
+        try:
+            with sampling_profiler(diagnostics=diagnostics) as profiler:
+                results = await job_results(
+                    job=await queue_backdown_images(
+                        backdown_images=await worker_pool.run(
+                            decode_images, frames=payload.frames
+                        ),
+                        frames_metadata=payload.frames,
+                        settings=payload,
+                    )
+                )
+            return diagnosed_results(
+                results=results, diagnostics=diagnostics, profiler=profiler
+            )
+        except (HTTPException, IngestionQueueFull):
+            raise
+        except Exception as error_details:
+            raise HTTPException(status_code=500, detail=str(error_details))
+
+
+@app.post(
+    path="/orthomosaic/jobs",
+    description="queue a backdown image for the orthomosaic, returning a job to poll",
+    status_code=HTTP_202_ACCEPTED,
+)
+async def queue_backdown_image(payload: Payload) -> Job:
+    async with worker_pool.admission():
+        try:
+            return await queue_backdown_images(
+                backdown_images=[
+                    await worker_pool.run(
+                        decode_image, image_b64=payload.backdown_image_b64
+                    )
+                ],
+                frames_metadata=[payload],
+                settings=payload,
+            )
+        except (HTTPException, IngestionQueueFull):
+            raise
+        except Exception as error_details:
+            raise HTTPException(status_code=500, detail=str(error_details))
+
+
+@app.get(path="/orthomosaic/jobs/{job_id}", description="status of a queued job")
+async def queued_job(job_id: str) -> Job:
+    if job_id not in ingestion_queue.jobs:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return ingestion_queue.jobs[job_id]
+
+
+async def known_frame_index(orthomosaic_id: int) -> FrameIndex:
+    mosaic = mosaic_cache.mosaics.get(orthomosaic_id)
+    if mosaic is not None:
+        return mosaic.frames
+    return FrameIndex(
+        frames=await storage.read_frame_records_async(image_id=orthomosaic_id)
+    )
+
+
+@app.get(
+    path="/orthomosaic/frames",
+    description="the frames of an orthomosaic covering a point in metres",
+)
+async def frames_covering_point(
+    orthomosaic_id: int, x_m: float, y_m: float
+) -> list[FrameRecord]:
+    async with worker_pool.admission():
+        try:
+            require_projected_axes(
+                orthomosaic_id=orthomosaic_id,
+                orthomosaic_metadata=await known_orthomosaic_metadata(
+                    orthomosaic_id=orthomosaic_id
+                ),
+            )
+            frames = await known_frame_index(orthomosaic_id=orthomosaic_id)
+            return frames.covering_point(x_m=x_m, y_m=y_m)
+        except HTTPException:
+            raise
+        except Exception as error_details:
+            raise HTTPException(status_code=500, detail=str(error_details))
+
+
+@app.get(
+    path="/orthomosaic/frames/box",
+    description="the frames of an orthomosaic overlapping a bounding box in metres",
+)
+async def frames_overlapping_box(
+    orthomosaic_id: int, x_min_m: float, y_min_m: float, x_max_m: float, y_max_m: float
+) -> list[FrameRecord]:
+    async with worker_pool.admission():
+        try:
+            require_projected_axes(
+                orthomosaic_id=orthomosaic_id,
+                orthomosaic_metadata=await known_orthomosaic_metadata(
+                    orthomosaic_id=orthomosaic_id
+                ),
+            )
+            frames = await known_frame_index(orthomosaic_id=orthomosaic_id)
+            return frames.overlapping_box(
+                x_min_m=x_min_m, y_min_m=y_min_m, x_max_m=x_max_m, y_max_m=y_max_m
+            )
+        except HTTPException:
+            raise
+        except Exception as error_details:
+            raise HTTPException(status_code=500, detail=str(error_details))
+
+
+@app.put(
+    path="/orthomosaic/frames/{frame_id}",
+    description="replace a frame of an orthomosaic (e.g. with a corrected attitude), compositing again only the tiles it overlaps",
+)
+async def replace_frame(
+    orthomosaic_id: int, frame_id: int, payload: Payload
+) -> Results:
+    async with worker_pool.admission():
+        try:
+            await require_orthomosaic_grid(
+                orthomosaic_id=orthomosaic_id, settings=payload
+            )
+            return await job_results(
+                job=ingestion_queue.submit(
+                    orthomosaic_id=orthomosaic_id,
+                    update=FrameEdit(
+                        frame_id=frame_id,
+                        replacement=(
+                            await worker_pool.run(
+                                decode_image, image_b64=payload.backdown_image_b64
+                            ),
+                            payload,
+                            payload,
+                        ),
+                    ),
+                )
+            )
+        except (HTTPException, IngestionQueueFull):
+            raise
+        except Exception as error_details:
+            raise HTTPException(status_code=500, detail=str(error_details))
+
+
+@app.delete(
+    path="/orthomosaic/frames/{frame_id}",
+    description="remove a frame from an orthomosaic, compositing again only the tiles it overlapped",
+)
+async def remove_frame(orthomosaic_id: int, frame_id: int) -> Results:
+    async with worker_pool.admission():
+        try:
+            return await job_results(
+                job=ingestion_queue.submit(
+                    orthomosaic_id=orthomosaic_id,
+                    update=FrameEdit(frame_id=frame_id, replacement=None),
+                )
+            )
+        except (HTTPException, IngestionQueueFull):
+            raise
+        except Exception as error_details:
+            raise HTTPException(status_code=500, detail=str(error_details))
+
+
+def mosaic_dimensions(orthomosaic_metadata: OrthomosaicMetadata) -> tuple[int, int]:
+    """Width and height in pixels of the tiles of an orthomosaic"""
+    if not orthomosaic_metadata.tile_indices:
+        return 0, 0
+    rows = [row for row, _ in orthomosaic_metadata.tile_indices]
+    columns = [column for _, column in orthomosaic_metadata.tile_indices]
+    return (
+        (max(columns) - min(columns) + 1) * orthomosaic_metadata.tile_size_pixels,
+        (max(rows) - min(rows) + 1) * orthomosaic_metadata.tile_size_pixels,
+    )
+
+
+@app.get(
+    path="/metrics",
+    description="Prometheus metrics: latency of each pipeline stage and request, bytes moved, array allocations, caches and the orthomosaics in memory",
+)
+async def prometheus_metrics() -> PlainTextResponse:
+    dimensions: dict[str, dict[Labels, float]] = dict(
+        orthomosaic_width_pixels={}, orthomosaic_height_pixels={}, orthomosaic_tiles={}
+    )
+    for orthomosaic_id, mosaic in list(mosaic_cache.mosaics.items()):
+        labels = (("orthomosaic_id", str(orthomosaic_id)),)
+        width, height = mosaic_dimensions(orthomosaic_metadata=mosaic.metadata)
+        dimensions["orthomosaic_width_pixels"][labels] = width
+        dimensions["orthomosaic_height_pixels"][labels] = height
+        dimensions["orthomosaic_tiles"][labels] = len(mosaic.metadata.tile_indices)
+    return PlainTextResponse(
+        content=metrics.render(
+            gauges={
+                **{
+                    f"orthomosaic_cache_{name}": {(): value}
+                    for name, value in mosaic_cache.statistics().items()
+                },
+                **{
+                    f"orthomosaic_geometry_cache_{name}": {(): value}
+                    for name, value in geometry_cache.statistics().items()
+                },
+                "orthomosaic_queued_updates": {(): ingestion_queue.queued_updates()},
+                "orthomosaic_requests_in_progress": {(): worker_pool.requests},
+                **dimensions,
+            }
+        ),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@app.post(
+    path="/orthomosaic/finalise",
+    description="write an orthomosaic to storage and release its memory once all frames are added",
+)
+async def finalise_orthomosaic(orthomosaic_id: int) -> Results:
+    async with worker_pool.admission():
+        try:
+            orthomosaic_metadata = await mosaic_cache.finalise(
+                orthomosaic_id=orthomosaic_id
+            )
+            return Results(
+                message=f"Orthomosaic {orthomosaic_id} written to {storage.location(image_id=orthomosaic_id)}",
+                orthomosaic_metadata=orthomosaic_metadata
+                or orthomosaics_metadata.get(orthomosaic_id),
+            )
+        except Exception as error_details:
+            raise HTTPException(status_code=500, detail=str(error_details))
+
+
+@app.get(path="/orthomosaic/cache", description="hit rate and memory of the cache")
+async def mosaic_cache_statistics() -> dict[str, float]:
+    return mosaic_cache.statistics()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+"""Microbenchmark of the alpha compositing kernel (`update_roi`)
+
+Compares the in-place `copyto(where=...)` kernel against the previous
+implementation (two copies of the inputs, four per-channel multiplies per
+copy and a sum) on a synthetic frame-sized region of interest.
+
+    python -m benchmarks.compositing --height 3000 --width 3000 --repeats 10
+"""
+from argparse import ArgumentParser
+from time import perf_counter
+from tracemalloc import get_traced_memory, reset_peak, start, stop
+
+from numpy import ndarray
+from numpy.random import default_rng
+
+from orthomosaics.mosaics import COMPOSITING_POLICIES, update_roi
+
+
+def previous_update_roi(tile: ndarray, x: int, y: int, image: ndarray) -> None:
+    height, width, _ = image.shape
+    roi = tile[y : y + height, x : x + width, :].copy()
+    image = image.copy()
+    alpha_roi = roi[:, :, 3]
+    alpha_image = image[:, :, 3]
+    pixel_weights_new = alpha_image > alpha_roi
+    pixel_weights_old = alpha_image <= alpha_roi
+    for channel in range(4):
+        image[:, :, channel] *= pixel_weights_new
+        roi[:, :, channel] *= pixel_weights_old
+    tile[y : y + height, x : x + width, :] = roi + image
+
+
+def measure(function, repeats: int, **kwargs) -> tuple[float, int]:
+    start()
+    durations = []
+    for _ in range(repeats):
+        reset_peak()
+        begin = perf_counter()
+        function(**kwargs)
+        durations.append(perf_counter() - begin)
+    _, peak_bytes = get_traced_memory()
+    stop()
+    return min(durations), peak_bytes
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--height", type=int, default=2000)
+    parser.add_argument("--width", type=int, default=2000)
+    parser.add_argument("--repeats", type=int, default=5)
+    arguments = parser.parse_args()
+
+    generator = default_rng(seed=0)
+    shape = (arguments.height, arguments.width, 4)
+    tile = generator.integers(0, 256, size=shape, dtype="uint8")
+    image = generator.integers(0, 256, size=shape, dtype="uint8")
+
+    benchmarks = {"previous": (previous_update_roi, {})} | {
+        policy: (update_roi, dict(policy=policy)) for policy in COMPOSITING_POLICIES
+    }
+    print(f"{'kernel':<16}{'time [ms]':>12}{'peak allocation [MB]':>24}")
+    for name, (function, kwargs) in benchmarks.items():
+        duration, peak_bytes = measure(
+            function,
+            repeats=arguments.repeats,
+            tile=tile.copy(),
+            x=0,
+            y=0,
+            image=image,
+            **kwargs,
+        )
+        print(f"{name:<16}{duration * 1000:>12.2f}{peak_bytes / 1e6:>24.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark of the tile encodings: encode and decode time against size
+
+Cuts RGBA tiles out of backdown images (synthetic road-like images unless
+image paths are given), with the left quarter of each tile transparent as
+at the edges of an orthomosaic, and encodes them with every encoding.
+
+    python -m benchmarks.encoding --images imgs/0.png imgs/1.png --tile-size 1024
+"""
+from argparse import ArgumentParser
+from time import perf_counter
+
+from numpy import dstack, full, linspace, ndarray, uint8
+from numpy.random import default_rng
+
+from orthomosaics.utils.encoding import decode_array, encode_array
+from orthomosaics.utils.rest_api import read_image
+from orthomosaics.utils.schemas import ImageEncoding
+
+ENCODINGS = {
+    "png level 0": ImageEncoding(format="png", png_compression_level=0),
+    "png level 1": ImageEncoding(format="png", png_compression_level=1),
+    "png level 6": ImageEncoding(format="png", png_compression_level=6),
+    "png level 9": ImageEncoding(format="png", png_compression_level=9),
+    "webp method 0": ImageEncoding(format="webp", webp_method=0),
+    "webp method 4": ImageEncoding(format="webp", webp_method=4),
+    "npy": ImageEncoding(format="npy"),
+    "npy zlib 1": ImageEncoding(format="npy_zlib", zlib_level=1),
+}
+
+
+def synthetic_road_image(height: int, width: int) -> ndarray:
+    """Smooth asphalt-like shading with sensor noise and painted lines"""
+    generator = default_rng(seed=0)
+    shading = linspace(60, 140, width)[None, :] + linspace(0, 40, height)[:, None]
+    image = shading[:, :, None] + generator.normal(0, 12, size=(height, width, 3))
+    image[:, width // 3 : width // 3 + width // 40] = 230
+    return image.clip(0, 255).astype(uint8)
+
+
+def rgba_tiles(images: list[ndarray], tile_size: int) -> list[ndarray]:
+    tiles = []
+    for image in images:
+        height, width, _ = image.shape
+        for y in range(0, height - tile_size + 1, tile_size):
+            for x in range(0, width - tile_size + 1, tile_size):
+                alpha = full((tile_size, tile_size), 255, dtype=uint8)
+                alpha[:, : tile_size // 4] = 0
+                tiles.append(
+                    dstack((image[y : y + tile_size, x : x + tile_size], alpha))
+                )
+    return tiles
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", nargs="*", default=[])
+    parser.add_argument("--tile-size", type=int, default=1024)
+    arguments = parser.parse_args()
+
+    images = [read_image(image_path=image_path) for image_path in arguments.images]
+    tiles = rgba_tiles(
+        images=images or [synthetic_road_image(height=2048, width=4096)],
+        tile_size=arguments.tile_size,
+    )
+    raw_bytes = sum(tile.nbytes for tile in tiles)
+    print(f"{len(tiles)} tiles of {arguments.tile_size} pixels")
+    print(
+        f"{'encoding':<16}{'encode [ms/tile]':>18}{'decode [ms/tile]':>18}"
+        f"{'size [kB/tile]':>16}{'of raw':>8}"
+    )
+    for name, encoding in ENCODINGS.items():
+        begin = perf_counter()
+        encoded = [encode_array(image=tile, encoding=encoding) for tile in tiles]
+        encode_duration = perf_counter() - begin
+        begin = perf_counter()
+        for tile_bytes in encoded:
+            decode_array(image_bytes=tile_bytes)
+        decode_duration = perf_counter() - begin
+        encoded_bytes = sum(len(tile_bytes) for tile_bytes in encoded)
+        print(
+            f"{name:<16}{encode_duration * 1000 / len(tiles):>18.1f}"
+            f"{decode_duration * 1000 / len(tiles):>18.1f}"
+            f"{encoded_bytes / 1000 / len(tiles):>16.0f}"
+            f"{encoded_bytes / raw_bytes:>8.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
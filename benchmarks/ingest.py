@@ -0,0 +1,323 @@
+"""Benchmark of the ingest pipeline on synthetic surveys
+
+Generates backdown frames with GPS and attitude tracks along parallel lanes,
+times each stage of adding a frame (decode_image, orthorectify_image,
+add_alpha_channel_and_rotate, update_roi and array_to_bytes) and then the
+end-to-end POST of whole surveys of increasing length to the app, with tiles
+in a temporary directory instead of Azure. Each survey runs in a fresh
+process so that its peak RSS is its own. The results are written as json,
+and compared with the results of a previous version when given.
+
+    python -m benchmarks.ingest --frames 10 100 1000 10000 --output ingest.json
+    python -m benchmarks.ingest --frames 10 100 --baseline ingest.json
+"""
+from argparse import ArgumentParser
+from base64 import b64encode
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from json import dump, load
+from math import ceil
+from multiprocessing import get_context
+from os import environ
+from platform import platform, python_version
+from resource import RUSAGE_SELF, getrusage
+from subprocess import CalledProcessError, check_output
+from sys import platform as system
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Callable, Iterator
+
+from numpy import ndarray, percentile
+from numpy.random import default_rng
+
+from benchmarks.encoding import synthetic_road_image
+from orthomosaics.mosaics import (
+    add_alpha_channel_and_rotate,
+    allocate_image,
+    update_roi,
+)
+from orthomosaics.ortho import orthorectify_image
+from orthomosaics.utils.rest_api import array_to_bytes, decode_image, mx9_camera
+from orthomosaics.utils.schemas import GPS, ImageMetadata
+
+STAGES = [
+    "decode_image",
+    "orthorectify_image",
+    "add_alpha_channel_and_rotate",
+    "update_roi",
+    "array_to_bytes",
+]
+
+
+def synthetic_survey(
+    frames: int,
+    lanes: int,
+    track_length_m: float,
+    lane_spacing_m: float,
+    width: int,
+    height: int,
+    pitch_deg: float,
+    seed: int = 0,
+) -> Iterator[tuple[ndarray, GPS, ImageMetadata]]:
+    """Frames spread evenly along lanes driven in alternate directions
+
+    The images are crops of one synthetic road image, and the heading, roll and
+    pitch jitter around the lane direction and `pitch_deg` as on a real vehicle.
+    Surveys of more frames over the same track are denser rather than longer,
+    so that the orthomosaic keeps the same extent."""
+    generator = default_rng(seed=seed)
+    road = synthetic_road_image(height=2 * height, width=2 * width)
+    frames_per_lane = ceil(frames / lanes)
+    spacing_m = track_length_m / max(frames_per_lane - 1, 1)
+    for frame in range(frames):
+        lane, position = divmod(frame, frames_per_lane)
+        forwards = lane % 2 == 0
+        row, column = generator.integers(0, height), generator.integers(0, width)
+        yield (
+            road[row : row + height, column : column + width].copy(),
+            GPS(
+                x=572_700.0 + lane * lane_spacing_m,
+                y=273_900.0
+                + (position if forwards else frames_per_lane - 1 - position)
+                * spacing_m,
+                heading=(0.0 if forwards else 180.0) + generator.normal(0, 1),
+            ),
+            ImageMetadata(
+                roll_deg=generator.normal(0, 0.5),
+                pitch_deg=pitch_deg + generator.normal(0, 0.5),
+            ),
+        )
+
+
+def timed(durations: list[float], function: Callable[..., Any], **kwargs) -> Any:
+    begin = perf_counter()
+    result = function(**kwargs)
+    durations.append(perf_counter() - begin)
+    return result
+
+
+def summarise(durations: list[float]) -> dict[str, float]:
+    return dict(
+        mean_ms=sum(durations) * 1000 / len(durations),
+        p50_ms=float(percentile(durations, 50)) * 1000,
+        p95_ms=float(percentile(durations, 95)) * 1000,
+    )
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process (ru_maxrss is in kB on Linux)"""
+    return getrusage(RUSAGE_SELF).ru_maxrss / (1e6 if system == "darwin" else 1e3)
+
+
+def time_stages(
+    survey: Iterator[tuple[ndarray, GPS, ImageMetadata]],
+    bottom_crop: int,
+    side_crop: int,
+    tile_size: int,
+) -> dict[str, dict[str, float]]:
+    """Time each stage of adding a frame, compositing every frame over the previous one"""
+    durations = defaultdict(list)
+    previous = None
+    for backdown_image, gps, backdown_image_metadata in survey:
+        image_b64 = b64encode(array_to_bytes(image=backdown_image)).decode()
+        image = timed(durations["decode_image"], decode_image, image_b64=image_b64)
+        orthorectified_image, _ = timed(
+            durations["orthorectify_image"],
+            orthorectify_image,
+            image=image,
+            image_metadata=backdown_image_metadata,
+            camera_settings=mx9_camera,
+        )
+        rotated_orthorectified_image = timed(
+            durations["add_alpha_channel_and_rotate"],
+            add_alpha_channel_and_rotate,
+            image=orthorectified_image,
+            heading=gps.heading,
+            bottom_crop=bottom_crop,
+            side_crop=side_crop,
+            display=False,
+        )
+        height, width, _ = rotated_orthorectified_image.shape
+        composite = allocate_image(height=height, width=width)
+        if previous is not None:
+            overlap_height = min(height, previous.shape[0])
+            overlap_width = min(width, previous.shape[1])
+            composite[:overlap_height, :overlap_width] = previous[
+                :overlap_height, :overlap_width
+            ]
+        timed(
+            durations["update_roi"],
+            update_roi,
+            tile=composite,
+            x=0,
+            y=0,
+            image=rotated_orthorectified_image,
+        )
+        timed(
+            durations["array_to_bytes"],
+            array_to_bytes,
+            image=composite[:tile_size, :tile_size].copy(),
+        )
+        previous = composite
+    return {stage: summarise(durations[stage]) for stage in STAGES}
+
+
+def post_survey(frames: int, settings: dict[str, Any]) -> dict[str, Any]:
+    """POST every frame of a survey to the app one after another, then finalise it"""
+    with TemporaryDirectory() as tile_directory:
+        environ["ORTHOMOSAICS_TILE_DIRECTORY"] = tile_directory
+        # the storage of the app is chosen when it is imported
+        from fastapi.testclient import TestClient
+
+        from app import app
+
+        durations = []
+        orthomosaic_metadata = None
+        with TestClient(app) as client:
+            begin = perf_counter()
+            for backdown_image, gps, backdown_image_metadata in synthetic_survey(
+                frames=frames,
+                lanes=settings["lanes"],
+                track_length_m=settings["track_length_m"],
+                lane_spacing_m=settings["lane_spacing_m"],
+                width=settings["width"],
+                height=settings["height"],
+                pitch_deg=settings["pitch_deg"],
+                seed=settings["seed"],
+            ):
+                payload = dict(
+                    backdown_image_b64=b64encode(
+                        array_to_bytes(image=backdown_image)
+                    ).decode(),
+                    gps=gps.model_dump(),
+                    backdown_image_metadata=backdown_image_metadata.model_dump(),
+                    side_crop_pixels=settings["side_crop"],
+                    bottom_crop_pixels=settings["bottom_crop"],
+                    tile_size_pixels=settings["tile_size"],
+                    orthomosaic_metadata=orthomosaic_metadata,
+                )
+                response = timed(
+                    durations, client.post, url="/orthomosaic/", json=payload
+                )
+                response.raise_for_status()
+                orthomosaic_metadata = response.json()["orthomosaic_metadata"]
+            finalise_begin = perf_counter()
+            client.post(
+                url="/orthomosaic/finalise",
+                params=dict(orthomosaic_id=orthomosaic_metadata["id"]),
+            ).raise_for_status()
+            end = perf_counter()
+        return dict(
+            frames=frames,
+            seconds=end - begin,
+            post_seconds=sum(durations),
+            frames_per_second=frames / sum(durations),
+            post=summarise(durations),
+            finalise_seconds=end - finalise_begin,
+            tiles=len(orthomosaic_metadata["tile_indices"]),
+            peak_rss_mb=peak_rss_mb(),
+        )
+
+
+def commit() -> str | None:
+    try:
+        return check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (CalledProcessError, OSError):
+        return None
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any]) -> None:
+    print(f"\ncompared with {baseline['environment']['commit']} (ratio of times)")
+    for stage, timing in results["stages"].items():
+        if stage in baseline["stages"]:
+            ratio = timing["mean_ms"] / baseline["stages"][stage]["mean_ms"]
+            print(f"{stage:<32}{ratio:>8.2f}")
+    baseline_scaling = {point["frames"]: point for point in baseline["scaling"]}
+    for point in results["scaling"]:
+        if point["frames"] in baseline_scaling:
+            ratio = point["seconds"] / baseline_scaling[point["frames"]]["seconds"]
+            name = f"{point['frames']} frames end to end"
+            print(f"{name:<32}{ratio:>8.2f}")
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--frames", type=int, nargs="+", default=[10, 100, 1000, 10_000]
+    )
+    parser.add_argument("--stage-frames", type=int, default=20)
+    parser.add_argument("--lanes", type=int, default=2)
+    parser.add_argument("--track-length-m", type=float, default=200.0)
+    parser.add_argument("--lane-spacing-m", type=float, default=3.5)
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--height", type=int, default=384)
+    parser.add_argument("--pitch-deg", type=float, default=-60.0)
+    parser.add_argument("--side-crop", type=int, default=50)
+    parser.add_argument("--bottom-crop", type=int, default=0)
+    parser.add_argument("--tile-size", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="json file for the results")
+    parser.add_argument("--baseline", help="json results of a previous version")
+    arguments = parser.parse_args()
+    settings = {
+        name: value
+        for name, value in vars(arguments).items()
+        if name not in ("output", "baseline")
+    }
+
+    stages = time_stages(
+        survey=synthetic_survey(
+            frames=arguments.stage_frames,
+            lanes=arguments.lanes,
+            track_length_m=arguments.track_length_m,
+            lane_spacing_m=arguments.lane_spacing_m,
+            width=arguments.width,
+            height=arguments.height,
+            pitch_deg=arguments.pitch_deg,
+            seed=arguments.seed,
+        ),
+        bottom_crop=arguments.bottom_crop,
+        side_crop=arguments.side_crop,
+        tile_size=arguments.tile_size,
+    )
+    print(f"{'stage':<32}{'mean [ms]':>12}{'p50 [ms]':>12}{'p95 [ms]':>12}")
+    for stage, timing in stages.items():
+        print(
+            f"{stage:<32}{timing['mean_ms']:>12.1f}{timing['p50_ms']:>12.1f}"
+            f"{timing['p95_ms']:>12.1f}"
+        )
+
+    scaling = []
+    print(
+        f"\n{'frames':>8}{'total [s]':>12}{'frames/s':>10}{'POST p50 [ms]':>15}"
+        f"{'POST p95 [ms]':>15}{'finalise [s]':>14}{'peak RSS [MB]':>15}"
+    )
+    for frames in arguments.frames:
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=get_context("spawn")
+        ) as executor:
+            point = executor.submit(post_survey, frames, settings).result()
+        scaling.append(point)
+        print(
+            f"{frames:>8}{point['seconds']:>12.1f}{point['frames_per_second']:>10.1f}"
+            f"{point['post']['p50_ms']:>15.1f}{point['post']['p95_ms']:>15.1f}"
+            f"{point['finalise_seconds']:>14.1f}{point['peak_rss_mb']:>15.0f}"
+        )
+
+    results = dict(
+        environment=dict(commit=commit(), python=python_version(), platform=platform()),
+        settings=settings,
+        stages=stages,
+        stages_peak_rss_mb=peak_rss_mb(),
+        scaling=scaling,
+    )
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            dump(results, output, indent=2)
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline:
+            compare(results=results, baseline=load(baseline))
+
+
+if __name__ == "__main__":
+    main()
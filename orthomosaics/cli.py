@@ -0,0 +1,242 @@
+"""Build an orthomosaic locally, straight from a survey csv
+
+    python -m orthomosaics.cli samples.csv --output orthomosaic.png
+    python -m orthomosaics.cli samples.csv --tiles-directory orthomosaics/
+
+The csv needs the columns image_path, roll[deg], pitch[deg], heading[deg],
+projectedX[m] and projectedY[m]. Images are read from disk by a background
+thread into a bounded prefetch queue while the mosaic is being built. With
+--canvas-directory the tiles are memory mapped files in an empty directory,
+for mosaics larger than RAM. A tile store also gets the downsampled overview
+levels used by the tile and region endpoints of the server.
+"""
+from argparse import ArgumentParser, Namespace
+from csv import DictReader
+from itertools import chain
+from pathlib import Path
+from queue import Queue
+from sys import stderr
+from threading import Thread
+from time import perf_counter
+from typing import Iterator, get_args
+
+from numpy import ndarray
+
+from orthomosaics.corridors import dominant_heading
+from orthomosaics.mosaics import (
+    orthorectify_and_rotate_all,
+    rotated_orthorectified_footprint,
+)
+from orthomosaics.ortho import GeometryCache
+from orthomosaics.tiles import (
+    TiledCanvas,
+    add_rotated_image_to_tiled_orthomosaic,
+    build_overviews,
+    tiled_orthomosaic_to_array,
+)
+from orthomosaics.utils.rest_api import mx9_camera, read_image, save_image
+from orthomosaics.utils.schemas import (
+    GPS,
+    CompositingPolicy,
+    ImageEncoding,
+    ImageFormat,
+    ImageMetadata,
+    OrthomosaicMetadata,
+)
+from orthomosaics.utils.tile_storage import LocalTileStorage
+
+
+def read_survey(csv_path: str) -> list[dict[str, str]]:
+    with open(csv_path, newline="") as csv_file:
+        return list(DictReader(csv_file))
+
+
+def prefetch_images(image_paths: list[str], prefetch: int) -> Iterator[ndarray]:
+    """Read images in a background thread, keeping at most `prefetch` in memory"""
+    queue: Queue[ndarray | Exception | None] = Queue(maxsize=prefetch)
+
+    def read_images() -> None:
+        try:
+            for image_path in image_paths:
+                queue.put(read_image(image_path=image_path))
+            queue.put(None)
+        except Exception as error_details:
+            queue.put(error_details)
+
+    Thread(target=read_images, daemon=True).start()
+    while (image := queue.get()) is not None:
+        if isinstance(image, Exception):
+            raise image
+        yield image
+
+
+def build_orthomosaic(
+    arguments: Namespace,
+) -> tuple[TiledCanvas, OrthomosaicMetadata]:
+    survey = read_survey(csv_path=arguments.csv_path)
+    if not survey:
+        raise SystemExit(f"The survey {arguments.csv_path} has no frames")
+    if arguments.canvas_directory is not None and any(
+        Path(arguments.canvas_directory).glob("*")
+    ):
+        # its tiles would be composited onto as if they were part of this mosaic
+        raise SystemExit(
+            f"The canvas directory {arguments.canvas_directory} is not empty"
+        )
+    canvas = TiledCanvas(
+        tile_size=arguments.tile_size, directory=arguments.canvas_directory
+    )
+    orthomosaic_metadata = None
+    corridor_heading = (
+        dominant_heading(float(row["heading[deg]"]) for row in survey)
+        if arguments.corridor
+        else 0.0
+    )
+    backdown_images_metadata = [
+        ImageMetadata(
+            roll_deg=float(row["roll[deg]"]),
+            pitch_deg=float(row["pitch[deg]"]),
+        )
+        for row in survey
+    ]
+    geometry_cache = GeometryCache()
+    backdown_images = prefetch_images(
+        image_paths=[row["image_path"] for row in survey],
+        prefetch=arguments.prefetch,
+    )
+    metres_per_pixel = arguments.metres_per_pixel
+    if metres_per_pixel is None:
+        # every frame is warped at the ground sample distance of the first one
+        first_image = next(backdown_images)
+        backdown_images = chain([first_image], backdown_images)
+        _, metres_per_pixel = rotated_orthorectified_footprint(
+            image_width=first_image.shape[1],
+            image_height=first_image.shape[0],
+            image_metadata=backdown_images_metadata[0],
+            camera_settings=mx9_camera,
+            heading=float(survey[0]["heading[deg]"]),
+            geometry_cache=geometry_cache,
+        )
+    start = perf_counter()
+    for index, (
+        rotated_orthorectified_image,
+        rotated_orthorectified_image_metadata,
+    ) in enumerate(
+        orthorectify_and_rotate_all(
+            backdown_images=backdown_images,
+            gps_data=[
+                GPS(
+                    x=float(row["projectedX[m]"]),
+                    y=float(row["projectedY[m]"]),
+                    heading=float(row["heading[deg]"]),
+                )
+                for row in survey
+            ],
+            backdown_images_metadata=backdown_images_metadata,
+            camera_settings=mx9_camera,
+            bottom_crop=arguments.bottom_crop,
+            side_crop=arguments.side_crop,
+            fused_warp=arguments.fused_warp,
+            geometry_cache=geometry_cache,
+            workers=arguments.workers,
+            metres_per_pixel=metres_per_pixel,
+            corridor_heading=corridor_heading,
+        ),
+        start=1,
+    ):
+        canvas, orthomosaic_metadata = add_rotated_image_to_tiled_orthomosaic(
+            canvas=canvas,
+            orthomosaic_metadata=orthomosaic_metadata,
+            rotated_orthorectified_image=rotated_orthorectified_image,
+            rotated_orthorectified_image_metadata=rotated_orthorectified_image_metadata,
+            tile_size=arguments.tile_size,
+            compositing_policy=arguments.compositing_policy,
+        )
+        if index % arguments.progress_every == 0 or index == len(survey):
+            print(
+                f"{index}/{len(survey)} frames ({index / (perf_counter() - start):.2f} frames/s)",
+                file=stderr,
+            )
+    return canvas, orthomosaic_metadata
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Build an orthomosaic from a survey csv")
+    parser.add_argument("csv_path")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--output", help="png file to save the orthomosaic to")
+    output.add_argument("--tiles-directory", help="local tile store to save to")
+    parser.add_argument("--tile-format", choices=get_args(ImageFormat), default="png")
+    parser.add_argument("--png-compression-level", type=int, default=6)
+    parser.add_argument("--webp-method", type=int, default=4)
+    parser.add_argument("--side-crop", type=int, default=1000)
+    parser.add_argument("--bottom-crop", type=int, default=0)
+    parser.add_argument("--tile-size", type=int, default=1024)
+    parser.add_argument(
+        "--overview-levels",
+        type=int,
+        default=5,
+        help="downsampled levels to add to the tile store, each half the resolution of the last",
+    )
+    parser.add_argument("--fused-warp", action="store_true")
+    parser.add_argument(
+        "--metres-per-pixel",
+        type=float,
+        help="ground sample distance of the orthomosaic (frames are downscaled to it before warping)",
+    )
+    parser.add_argument(
+        "--corridor",
+        action="store_true",
+        help="align the orthomosaic with the dominant heading of the survey rather than north",
+    )
+    parser.add_argument(
+        "--compositing-policy",
+        choices=get_args(CompositingPolicy),
+        default="dominant_alpha",
+    )
+    parser.add_argument(
+        "--canvas-directory",
+        help="empty directory to memory map the tiles to .npy files in, to build mosaics larger than RAM",
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--prefetch", type=int, default=8)
+    parser.add_argument("--progress-every", type=int, default=10)
+    arguments = parser.parse_args()
+
+    canvas, orthomosaic_metadata = build_orthomosaic(arguments=arguments)
+    if arguments.output is not None:
+        orthomosaic_image, orthomosaic_metadata = tiled_orthomosaic_to_array(
+            canvas=canvas,
+            orthomosaic_metadata=orthomosaic_metadata,
+            path=None
+            if arguments.canvas_directory is None
+            else str(Path(arguments.canvas_directory) / "orthomosaic.npy"),
+        )
+        save_image(image=orthomosaic_image, image_path=arguments.output)
+    else:
+        orthomosaic_metadata = orthomosaic_metadata.model_copy(
+            update=dict(overview_levels=arguments.overview_levels)
+        )
+        storage = LocalTileStorage(
+            directory=arguments.tiles_directory,
+            encoding=ImageEncoding(
+                format=arguments.tile_format,
+                png_compression_level=arguments.png_compression_level,
+                webp_method=arguments.webp_method,
+            ),
+        )
+        storage.write_tiles(
+            image_id=orthomosaic_metadata.id, tiles=canvas.dirty_tiles()
+        )
+        for level, overview in enumerate(
+            build_overviews(canvas=canvas, levels=arguments.overview_levels), start=1
+        ):
+            storage.write_tiles(
+                image_id=orthomosaic_metadata.id, tiles=overview.tiles, level=level
+            )
+        storage.write_metadata(metadata=orthomosaic_metadata)
+    print(orthomosaic_metadata.model_dump_json())
+
+
+if __name__ == "__main__":
+    main()
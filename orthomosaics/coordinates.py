@@ -0,0 +1,76 @@
+from functools import lru_cache
+from typing import Iterable
+
+from numpy import asarray, cos, floor, int64, ndarray, radians, sin, stack
+from pyproj import Transformer
+
+from orthomosaics.utils.schemas import GPS
+
+
+@lru_cache(maxsize=16)
+def cached_transformer(source_crs: str, target_crs: str) -> Transformer:
+    """Transformer between two coordinate reference systems, built once per pair
+
+    Axes are always in x/y (longitude/latitude, easting/northing) order."""
+    return Transformer.from_crs(source_crs, target_crs, always_xy=True)
+
+
+def gps_coordinates(gps_data: Iterable[GPS]) -> ndarray:
+    """Positions of many GPS fixes as an (n, 2) array of x and y"""
+    return asarray([(gps.x, gps.y) for gps in gps_data], dtype=float).reshape(-1, 2)
+
+
+def coordinates_to_metres(
+    coordinates: ndarray,
+    source_crs: str | None = None,
+    target_crs: str | None = None,
+) -> ndarray:
+    """Project an (n, 2) array of x and y into metres
+
+    Without a `source_crs` and `target_crs` (e.g. "EPSG:4326" and a UTM zone)
+    the coordinates are taken to already be in metres and are returned as is."""
+    coordinates = asarray(coordinates, dtype=float).reshape(-1, 2)
+    if source_crs is None or target_crs is None or source_crs == target_crs:
+        return coordinates
+    x_m, y_m = cached_transformer(
+        source_crs=source_crs, target_crs=target_crs
+    ).transform(coordinates[:, 0], coordinates[:, 1])
+    return stack((x_m, y_m), axis=1)
+
+
+def metres_to_corridor(coordinates_m: ndarray, corridor_heading: float) -> ndarray:
+    """Rotate an (n, 2) array of metres into a corridor frame, whose y axis
+    points along `corridor_heading` (degrees clockwise from north)
+
+    A heading of 0 leaves the coordinates as they are."""
+    coordinates_m = asarray(coordinates_m, dtype=float).reshape(-1, 2)
+    if corridor_heading == 0:
+        return coordinates_m
+    angle = radians(corridor_heading)
+    x_m, y_m = coordinates_m[:, 0], coordinates_m[:, 1]
+    return stack(
+        (
+            x_m * cos(angle) - y_m * sin(angle),
+            x_m * sin(angle) + y_m * cos(angle),
+        ),
+        axis=1,
+    )
+
+
+def corridor_to_metres(coordinates: ndarray, corridor_heading: float) -> ndarray:
+    """Rotate an (n, 2) array of corridor frame coordinates back into metres"""
+    return metres_to_corridor(
+        coordinates_m=coordinates, corridor_heading=-corridor_heading
+    )
+
+
+def metres_to_pixels(
+    coordinates_m: ndarray,
+    origin_m: tuple[float, float],
+    m_per_pixel: tuple[float, float],
+) -> ndarray:
+    """Pixel offsets (rounded down) from an origin of an (n, 2) array of metres"""
+    return floor(
+        (asarray(coordinates_m, dtype=float) - asarray(origin_m, dtype=float))
+        / asarray(m_per_pixel, dtype=float)
+    ).astype(int64)
@@ -0,0 +1,148 @@
+from typing import Iterable, NamedTuple
+
+from numpy import arctan2, asarray, cos, degrees, ndarray, radians, sin
+
+from orthomosaics.coordinates import corridor_to_metres
+from orthomosaics.mosaics import add_batch_to_orthomosaic
+from orthomosaics.ortho import GeometryCache
+from orthomosaics.utils.schemas import (
+    GPS,
+    Camera,
+    CompositingPolicy,
+    ImageMetadata,
+    OrthomosaicMetadata,
+)
+
+
+class CorridorSegment(NamedTuple):
+    """Frames `start` to `stop` (exclusive) of a survey, along `heading`"""
+
+    start: int
+    stop: int
+    heading: float
+
+
+def dominant_heading(headings: Iterable[float]) -> float:
+    """Axis most frames point along, in degrees clockwise from north in [0, 180)
+
+    Headings are averaged as axes (by doubling the angles), so lanes driven in
+    opposite directions along the same road agree."""
+    angles = 2 * radians(asarray(list(headings), dtype=float))
+    return axial_mean(
+        sin_sum=float(sin(angles).sum()), cos_sum=float(cos(angles).sum())
+    )
+
+
+def axial_mean(sin_sum: float, cos_sum: float) -> float:
+    """Heading in [0, 180) of summed doubled angles
+
+    Rounded to a nanodegree before wrapping, so that headings straddling north
+    (whose sum of sines cancels to about -1e-16) give 0 rather than 180."""
+    return round(float(degrees(arctan2(sin_sum, cos_sum))) / 2, 9) % 180
+
+
+def axis_difference(first: float, second: float) -> float:
+    """Angle in degrees (0 to 90) between the axes of two headings"""
+    difference = abs(first - second) % 180
+    return min(difference, 180 - difference)
+
+
+def corridor_segments(
+    gps_data: list[GPS], max_turn_deg: float = 20.0
+) -> list[CorridorSegment]:
+    """Split a survey where the road turns
+
+    A frame starts a new segment when its heading is more than `max_turn_deg`
+    off the dominant heading of the segment so far."""
+    segments = []
+    start = 0
+    sin_sum = cos_sum = 0.0
+    for index, gps in enumerate(gps_data):
+        angle = 2 * radians(gps.heading)
+        if index > start:
+            heading = axial_mean(sin_sum=sin_sum, cos_sum=cos_sum)
+            if axis_difference(gps.heading, heading) > max_turn_deg:
+                segments.append(
+                    CorridorSegment(start=start, stop=index, heading=heading)
+                )
+                start = index
+                sin_sum = cos_sum = 0.0
+        sin_sum += float(sin(angle))
+        cos_sum += float(cos(angle))
+    if gps_data:
+        segments.append(
+            CorridorSegment(
+                start=start,
+                stop=len(gps_data),
+                heading=axial_mean(sin_sum=sin_sum, cos_sum=cos_sum),
+            )
+        )
+    return segments
+
+
+def corridor_outline(
+    orthomosaic_metadata: OrthomosaicMetadata, width: int, height: int
+) -> ndarray:
+    """Corners in metres of an orthomosaic of `width` x `height` pixels, from
+    its origin anticlockwise (a rotated rectangle for a corridor-aligned one)"""
+    x_min, y_min = orthomosaic_metadata.x_m, orthomosaic_metadata.y_m
+    x_max = x_min + width * orthomosaic_metadata.x_m_per_pixel
+    y_max = y_min + height * orthomosaic_metadata.y_m_per_pixel
+    return corridor_to_metres(
+        coordinates=[(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max)],
+        corridor_heading=orthomosaic_metadata.corridor_heading,
+    )
+
+
+def corridor_orthomosaics(
+    backdown_images: list[ndarray],
+    gps_data: list[GPS],
+    backdown_images_metadata: list[ImageMetadata],
+    camera_settings: Camera,
+    bottom_crop: int,
+    side_crop: int,
+    max_turn_deg: float | None = None,
+    fused_warp: bool = False,
+    geometry_cache: GeometryCache | None = None,
+    compositing_policy: CompositingPolicy = "dominant_alpha",
+    workers: int = 1,
+    metres_per_pixel: float | None = None,
+) -> list[tuple[ndarray, OrthomosaicMetadata]]:
+    """Orthomosaics of a survey aligned with the road rather than north
+
+    Roads running diagonally leave most of a north-aligned orthomosaic empty.
+    Here the survey is rotated to its dominant heading, or with `max_turn_deg`
+    split into segments between turns (see `corridor_segments`) that each get
+    their own orthomosaic, sized from the frame footprints along that heading."""
+    segments = (
+        [
+            CorridorSegment(
+                start=0,
+                stop=len(gps_data),
+                heading=dominant_heading(gps.heading for gps in gps_data),
+            )
+        ]
+        if max_turn_deg is None
+        else corridor_segments(gps_data=gps_data, max_turn_deg=max_turn_deg)
+    )
+    return [
+        add_batch_to_orthomosaic(
+            orthomosaic_image=None,
+            orthomosaic_metadata=None,
+            backdown_images=backdown_images[segment.start : segment.stop],
+            gps_data=gps_data[segment.start : segment.stop],
+            backdown_images_metadata=backdown_images_metadata[
+                segment.start : segment.stop
+            ],
+            camera_settings=camera_settings,
+            bottom_crop=bottom_crop,
+            side_crop=side_crop,
+            fused_warp=fused_warp,
+            geometry_cache=geometry_cache,
+            compositing_policy=compositing_policy,
+            workers=workers,
+            metres_per_pixel=metres_per_pixel,
+            corridor_heading=segment.heading,
+        )
+        for segment in segments
+    ]
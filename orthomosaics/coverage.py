@@ -0,0 +1,278 @@
+from math import gcd
+from typing import NamedTuple
+
+from cv2 import perspectiveTransform
+from numpy import (
+    arange,
+    broadcast_to,
+    clip,
+    float32,
+    linalg,
+    maximum,
+    meshgrid,
+    ndarray,
+    stack,
+    where,
+    zeros,
+)
+from shapely import Polygon, contains_xy
+
+from orthomosaics.coordinates import coordinates_to_metres, metres_to_pixels
+from orthomosaics.mosaics import COMPOSITING_POLICIES, alpha_channel, scaled_crop
+from orthomosaics.ortho import (
+    GeometryCache,
+    cached_orthorectification_geometry,
+    corner_points,
+    heading_rotation_matrix,
+)
+from orthomosaics.tiles import TileIndex, tile_indices_overlapping
+from orthomosaics.utils.schemas import (
+    GPS,
+    Camera,
+    CompositingPolicy,
+    ImageMetadata,
+    OrthomosaicMetadata,
+)
+
+
+class FrameProjection(NamedTuple):
+    """Lowest alpha a frame would have within each coverage cell of an
+    orthomosaic, from cell (row, column) onwards"""
+
+    row: int
+    column: int
+    alpha: ndarray
+
+
+class CoverageMap:
+    """Low resolution alpha coverage of an orthomosaic: the lowest alpha of the
+    tiles over square cells of `cell_size` pixels (a divisor of the tile size)
+
+    Cells of tiles that have not been added are uncovered (alpha 0)."""
+
+    def __init__(self, tile_size: int, cell_size: int = 32) -> None:
+        self.tile_size = tile_size
+        self.cell_size = gcd(tile_size, cell_size)
+        self.cells_per_tile = tile_size // self.cell_size
+        self.cells: dict[TileIndex, ndarray] = {}
+
+    def update(self, tiles: dict[TileIndex, ndarray]) -> None:
+        for index, tile in tiles.items():
+            self.cells[index] = (
+                tile[:, :, 3]
+                .reshape(
+                    self.cells_per_tile,
+                    self.cell_size,
+                    self.cells_per_tile,
+                    self.cell_size,
+                )
+                .min(axis=(1, 3))
+            )
+
+    def discard(self, indices: set[TileIndex]) -> None:
+        for index in indices:
+            self.cells.pop(index, None)
+
+    def copy(self) -> "CoverageMap":
+        coverage = CoverageMap(tile_size=self.tile_size, cell_size=self.cell_size)
+        coverage.cells = {index: cells.copy() for index, cells in self.cells.items()}
+        return coverage
+
+    def tile_indices(self, projection: FrameProjection) -> list[TileIndex]:
+        height, width = projection.alpha.shape
+        return tile_indices_overlapping(
+            tile_size=self.cells_per_tile,
+            x=projection.column,
+            y=projection.row,
+            width=width,
+            height=height,
+        )
+
+    def alpha(self, projection: FrameProjection) -> ndarray:
+        """Coverage of the cells under a frame projection"""
+        alpha = zeros(projection.alpha.shape, dtype="uint8")
+        for index, cells, section in self._sections(projection=projection):
+            if index in self.cells:
+                alpha[section] = self.cells[index][cells]
+        return alpha
+
+    def cover(self, projection: FrameProjection) -> None:
+        """Raise the coverage to the lowest alpha of a frame composited over it"""
+        for index, cells, section in self._sections(projection=projection):
+            tile_cells = self.cells.setdefault(
+                index,
+                zeros((self.cells_per_tile, self.cells_per_tile), dtype="uint8"),
+            )
+            tile_cells[cells] = maximum(tile_cells[cells], projection.alpha[section])
+
+    def _sections(
+        self, projection: FrameProjection
+    ) -> list[tuple[TileIndex, tuple[slice, slice], tuple[slice, slice]]]:
+        """Cells of each tile under a frame projection, and where they are in it"""
+        height, width = projection.alpha.shape
+        sections = []
+        for row, column in self.tile_indices(projection=projection):
+            first_row = row * self.cells_per_tile
+            first_column = column * self.cells_per_tile
+            rows = range(
+                max(projection.row, first_row),
+                min(projection.row + height, first_row + self.cells_per_tile),
+            )
+            columns = range(
+                max(projection.column, first_column),
+                min(projection.column + width, first_column + self.cells_per_tile),
+            )
+            sections.append(
+                (
+                    (row, column),
+                    (
+                        slice(rows.start - first_row, rows.stop - first_row),
+                        slice(
+                            columns.start - first_column, columns.stop - first_column
+                        ),
+                    ),
+                    (
+                        slice(rows.start - projection.row, rows.stop - projection.row),
+                        slice(
+                            columns.start - projection.column,
+                            columns.stop - projection.column,
+                        ),
+                    ),
+                )
+            )
+        return sections
+
+
+def project_frame(
+    orthomosaic_metadata: OrthomosaicMetadata,
+    image_width: int,
+    image_height: int,
+    gps_data: GPS,
+    image_metadata: ImageMetadata,
+    camera_settings: Camera,
+    bottom_crop: int,
+    side_crop: int,
+    cell_size: int,
+    geometry_cache: GeometryCache | None = None,
+    metres_per_pixel: float | None = None,
+) -> FrameProjection:
+    """Where and with what alpha a backdown image would be composited, without warping it
+
+    The corners of the image are projected with its homography and the alpha
+    of the orthorectified image is sampled every half cell of the orthomosaic
+    inside that outline (through the heading rotation)."""
+    geometry = cached_orthorectification_geometry(
+        image_width=image_width,
+        image_height=image_height,
+        image_metadata=image_metadata,
+        camera_settings=camera_settings,
+        geometry_cache=geometry_cache,
+        metres_per_pixel=metres_per_pixel,
+    )
+    orthorectified_width, orthorectified_height = geometry.new_size
+    rotation, (rotated_width, rotated_height) = heading_rotation_matrix(
+        image_width=orthorectified_width,
+        image_height=orthorectified_height,
+        heading=gps_data.heading,
+    )
+    ((x, y),) = metres_to_pixels(
+        coordinates_m=coordinates_to_metres(coordinates=[(gps_data.x, gps_data.y)]),
+        origin_m=(orthomosaic_metadata.x_m, orthomosaic_metadata.y_m),
+        m_per_pixel=(
+            orthomosaic_metadata.x_m_per_pixel,
+            orthomosaic_metadata.y_m_per_pixel,
+        ),
+    ).tolist()
+    row, column = y // cell_size, x // cell_size
+    rows = (y + rotated_height - 1) // cell_size - row + 1
+    columns = (x + rotated_width - 1) // cell_size - column + 1
+    x_axis, y_axis = meshgrid(
+        column * cell_size - x + arange(2 * columns + 1) * cell_size / 2,
+        row * cell_size - y + arange(2 * rows + 1) * cell_size / 2,
+    )
+    orthorectified_points = perspectiveTransform(
+        stack((x_axis.ravel(), y_axis.ravel()), axis=1)[None].astype(float32),
+        linalg.inv(rotation),
+    )[0]
+    outline = Polygon(
+        perspectiveTransform(
+            corner_points(
+                image_width=geometry.image_size[0], image_height=geometry.image_size[1]
+            ),
+            geometry.homography,
+        )[0][[0, 1, 3, 2]]
+    )
+    orthorectified_x = orthorectified_points[:, 0]
+    orthorectified_y = orthorectified_points[:, 1]
+    alpha = alpha_channel(
+        image_height=orthorectified_height,
+        image_width=orthorectified_width,
+        bottom_crop=scaled_crop(crop=bottom_crop, scale=geometry.scale),
+        side_crop=scaled_crop(crop=side_crop, scale=geometry.scale),
+    )
+    samples = where(
+        contains_xy(outline, orthorectified_x, orthorectified_y),
+        alpha[
+            clip(orthorectified_y.astype(int), 0, orthorectified_height - 1),
+            clip(orthorectified_x.astype(int), 0, orthorectified_width - 1),
+        ],
+        0,
+    ).reshape(2 * rows + 1, 2 * columns + 1)
+    cell_samples = stack(
+        [
+            samples[
+                row_offset : row_offset + 2 * rows : 2,
+                column_offset : column_offset + 2 * columns : 2,
+            ]
+            for row_offset in range(3)
+            for column_offset in range(3)
+        ]
+    )
+    return FrameProjection(row=row, column=column, alpha=cell_samples.min(axis=0))
+
+
+def changed_fraction(
+    coverage: CoverageMap,
+    projection: FrameProjection,
+    compositing_policy: CompositingPolicy = "dominant_alpha",
+) -> float:
+    """Estimated fraction of a frame's footprint that compositing it would change
+
+    Only the cells entirely inside the footprint are compared, with the same
+    statistic (the lowest alpha) on both sides, so that a frame composited
+    again over itself changes nothing."""
+    footprint = projection.alpha > 0
+    if not footprint.any():
+        return 0.0
+    shape = (*footprint.shape, 4)
+    changed = COMPOSITING_POLICIES[compositing_policy](
+        roi=broadcast_to(coverage.alpha(projection=projection)[:, :, None], shape),
+        image=broadcast_to(projection.alpha[:, :, None], shape),
+    )
+    return float((changed & footprint).sum() / footprint.sum())
+
+
+def redundant_frames(
+    coverage: CoverageMap,
+    projections: list[FrameProjection],
+    compositing_policies: list[CompositingPolicy],
+    min_changed_fractions: list[float],
+) -> list[bool]:
+    """Which frames, composited in order, would change less than their minimum
+    fraction of their footprint (frames that are kept cover the coverage copy)"""
+    coverage = coverage.copy()
+    redundant = []
+    for projection, compositing_policy, min_changed_fraction in zip(
+        projections, compositing_policies, min_changed_fractions, strict=True
+    ):
+        redundant.append(
+            changed_fraction(
+                coverage=coverage,
+                projection=projection,
+                compositing_policy=compositing_policy,
+            )
+            < min_changed_fraction
+        )
+        if not redundant[-1]:
+            coverage.cover(projection=projection)
+    return redundant
@@ -0,0 +1,202 @@
+from typing import Iterable
+
+from numpy import argmax, concatenate, flatnonzero, ndarray, stack
+from shapely import MultiPoint, Point, Polygon, STRtree, box, union_all
+from shapely.geometry.base import BaseGeometry
+
+from orthomosaics.mosaics import allocate_image
+from orthomosaics.tiles import (
+    TiledCanvas,
+    TileIndex,
+    rotated_image_position,
+    tile_indices_overlapping,
+)
+from orthomosaics.utils.schemas import (
+    CompositingPolicy,
+    FrameRecord,
+    OrthomosaicMetadata,
+)
+
+
+def frame_footprint(
+    orthomosaic_metadata: OrthomosaicMetadata,
+    rotated_orthorectified_image: ndarray,
+    rotated_orthorectified_image_metadata: OrthomosaicMetadata,
+) -> list[tuple[float, float]]:
+    """Outline in metres (convex hull) of the opaque pixels of a rotated orthorectified image
+
+    The outline follows the orthomosaic pixel grid, so it matches where the
+    pixels are composited rather than the frame's own scale."""
+    opaque = rotated_orthorectified_image[:, :, 3] > 0
+    rows = flatnonzero(opaque.any(axis=1))
+    if not len(rows):
+        return []
+    first_columns = argmax(opaque[rows], axis=1)
+    last_columns = opaque.shape[1] - argmax(opaque[rows, ::-1], axis=1)
+    x, y = rotated_image_position(
+        orthomosaic_metadata=orthomosaic_metadata,
+        rotated_orthorectified_image_metadata=rotated_orthorectified_image_metadata,
+    )
+    pixel_edges = concatenate(
+        [
+            stack((columns, frame_rows), axis=1)
+            for columns in (first_columns, last_columns)
+            for frame_rows in (rows, rows + 1)
+        ]
+    )
+    hull = MultiPoint(
+        [
+            (
+                orthomosaic_metadata.x_m
+                + (x + column) * orthomosaic_metadata.x_m_per_pixel,
+                orthomosaic_metadata.y_m
+                + (y + row) * orthomosaic_metadata.y_m_per_pixel,
+            )
+            for column, row in pixel_edges.tolist()
+        ]
+    ).convex_hull.simplify(orthomosaic_metadata.x_m_per_pixel)
+    return list(hull.exterior.coords)[:-1]
+
+
+def tiles_outline(
+    orthomosaic_metadata: OrthomosaicMetadata, indices: Iterable[TileIndex]
+) -> BaseGeometry:
+    """Area in metres covered by tiles of the orthomosaic"""
+    tile_width_m = (
+        orthomosaic_metadata.tile_size_pixels * orthomosaic_metadata.x_m_per_pixel
+    )
+    tile_height_m = (
+        orthomosaic_metadata.tile_size_pixels * orthomosaic_metadata.y_m_per_pixel
+    )
+    return union_all(
+        [
+            box(
+                orthomosaic_metadata.x_m + column * tile_width_m,
+                orthomosaic_metadata.y_m + row * tile_height_m,
+                orthomosaic_metadata.x_m + (column + 1) * tile_width_m,
+                orthomosaic_metadata.y_m + (row + 1) * tile_height_m,
+            )
+            for row, column in indices
+        ]
+    )
+
+
+def footprint_tile_indices(
+    orthomosaic_metadata: OrthomosaicMetadata, footprint: list[tuple[float, float]]
+) -> list[TileIndex]:
+    """Tiles of the orthomosaic that a footprint overlaps"""
+    if not footprint:
+        return []
+    outline = Polygon(footprint)
+    x_min_m, y_min_m, x_max_m, y_max_m = outline.bounds
+    x = int((x_min_m - orthomosaic_metadata.x_m) // orthomosaic_metadata.x_m_per_pixel)
+    y = int((y_min_m - orthomosaic_metadata.y_m) // orthomosaic_metadata.y_m_per_pixel)
+    return [
+        index
+        for index in tile_indices_overlapping(
+            tile_size=orthomosaic_metadata.tile_size_pixels,
+            x=x,
+            y=y,
+            width=int((x_max_m - x_min_m) // orthomosaic_metadata.x_m_per_pixel) + 2,
+            height=int((y_max_m - y_min_m) // orthomosaic_metadata.y_m_per_pixel) + 2,
+        )
+        if outline.intersects(
+            tiles_outline(orthomosaic_metadata=orthomosaic_metadata, indices=[index])
+        )
+    ]
+
+
+class FrameIndex:
+    """Footprints of the frames added to an orthomosaic, in the order they were added
+
+    Point and box queries go through an STRtree, rebuilt on the first query
+    after frames are added, replaced or removed."""
+
+    def __init__(self, frames: list[FrameRecord] | None = None) -> None:
+        self.frames: dict[int, FrameRecord] = {
+            frame.id: frame for frame in frames or []
+        }
+        self._tree: STRtree | None = None
+        self._tree_ids: list[int] = []
+
+    def next_id(self) -> int:
+        return max(self.frames, default=-1) + 1
+
+    def add(self, frame: FrameRecord) -> None:
+        """Add a frame, or replace the frame with the same id keeping its place in the order"""
+        self.frames[frame.id] = frame
+        self._tree = None
+
+    def remove(self, frame_id: int) -> FrameRecord:
+        self._tree = None
+        return self.frames.pop(frame_id)
+
+    def copy(self) -> "FrameIndex":
+        return FrameIndex(frames=list(self.frames.values()))
+
+    def overlapping(self, geometry: BaseGeometry) -> list[FrameRecord]:
+        if self._tree is None:
+            self._tree_ids = list(self.frames)
+            self._tree = STRtree(
+                [
+                    Polygon(self.frames[frame_id].footprint)
+                    for frame_id in self._tree_ids
+                ]
+            )
+        return [
+            self.frames[self._tree_ids[position]]
+            for position in sorted(self._tree.query(geometry, predicate="intersects"))
+        ]
+
+    def covering_point(self, x_m: float, y_m: float) -> list[FrameRecord]:
+        return self.overlapping(geometry=Point(x_m, y_m))
+
+    def overlapping_box(
+        self, x_min_m: float, y_min_m: float, x_max_m: float, y_max_m: float
+    ) -> list[FrameRecord]:
+        return self.overlapping(geometry=box(x_min_m, y_min_m, x_max_m, y_max_m))
+
+
+def recomposite_tiles(
+    orthomosaic_metadata: OrthomosaicMetadata,
+    indices: list[TileIndex],
+    prepared_frames: Iterable[tuple[ndarray, OrthomosaicMetadata, CompositingPolicy]],
+) -> dict[TileIndex, ndarray]:
+    """Composite frames again from scratch, only into the given tiles
+
+    `prepared_frames` must be every frame overlapping the tiles, in the order
+    they were added."""
+    tile_size = orthomosaic_metadata.tile_size_pixels
+    canvas = TiledCanvas(tile_size=tile_size)
+    x_min = min(column for _, column in indices) * tile_size
+    y_min = min(row for row, _ in indices) * tile_size
+    x_max = (max(column for _, column in indices) + 1) * tile_size
+    y_max = (max(row for row, _ in indices) + 1) * tile_size
+    for (
+        rotated_orthorectified_image,
+        rotated_orthorectified_image_metadata,
+        compositing_policy,
+    ) in prepared_frames:
+        x, y = rotated_image_position(
+            orthomosaic_metadata=orthomosaic_metadata,
+            rotated_orthorectified_image_metadata=rotated_orthorectified_image_metadata,
+        )
+        height, width, _ = rotated_orthorectified_image.shape
+        x_start, x_end = max(x, x_min), min(x + width, x_max)
+        y_start, y_end = max(y, y_min), min(y + height, y_max)
+        if x_start >= x_end or y_start >= y_end:
+            continue
+        canvas.add_image(
+            image=rotated_orthorectified_image[
+                y_start - y : y_end - y, x_start - x : x_end - x
+            ],
+            x=x_start,
+            y=y_start,
+            policy=compositing_policy,
+        )
+    return {
+        index: canvas.tiles[index]
+        if index in canvas.tiles
+        else allocate_image(height=tile_size, width=tile_size)
+        for index in indices
+    }
@@ -1,63 +1,130 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
-
-from cv2 import COLOR_RGB2RGBA, cvtColor
-from geopandas import GeoDataFrame
+from functools import lru_cache
+from math import ceil, cos, floor, isclose, radians, sin
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Iterable, Iterator
+
+from cv2 import (
+    COLOR_RGB2RGBA,
+    INTER_LINEAR,
+    WARP_INVERSE_MAP,
+    cvtColor,
+    warpPerspective,
+)
 from matplotlib.pyplot import show, subplots
-from numpy import ndarray, ogrid, sqrt, zeros
+from numpy import asarray, concatenate, copyto, int64, ndarray, ogrid, sqrt, zeros
+from numpy.lib.format import open_memmap
 from scipy.ndimage import rotate
 from shapely.geometry import Point
 
-from orthomosaics.ortho import orthorectify_image
+from orthomosaics.coordinates import (
+    coordinates_to_metres,
+    gps_coordinates,
+    metres_to_corridor,
+    metres_to_pixels,
+)
+from orthomosaics.ortho import (
+    GeometryCache,
+    cached_orthorectification_geometry,
+    heading_rotation_matrix,
+    orthorectify_image,
+    resize_to_geometry,
+)
+from orthomosaics.utils.metrics import record_allocation, stage
 from orthomosaics.utils.schemas import (
     GPS,
     Camera,
+    CompositingPolicy,
     ImageMetadata,
     OrthomosaicMetadata,
     OrthorectificationMetadata,
 )
+from orthomosaics.utils.shared_memory import (
+    SharedArray,
+    array_from_shared_memory,
+    array_to_shared_memory,
+)
 
+_worker_geometry_cache: GeometryCache | None = None
 
-def update_roi(tile: ndarray, x: int, y: int, image: ndarray) -> None:
-    height, width, _ = image.shape
-    tile[y : y + height, x : x + width, :] = update_roi_by_dominant_alpha_channel(
-        roi=tile[y : y + height, x : x + width, :].copy(), image=image.copy()
-    )
+
+def dominant_alpha(roi: ndarray, image: ndarray) -> ndarray:
+    return image[:, :, 3] > roi[:, :, 3]
+
+
+def max_alpha(roi: ndarray, image: ndarray) -> ndarray:
+    """Like dominant alpha but ties between non-transparent pixels go to the newer image"""
+    return (image[:, :, 3] >= roi[:, :, 3]) & image[:, :, 3].astype(bool)
 
 
-def update_roi_by_dominant_alpha_channel(roi: ndarray, image: ndarray) -> None:
-    alpha_roi = roi[:, :, 3]
-    alpha_image = image[:, :, 3]
-    roi_new = roi_masked(roi=image, pixel_weights=alpha_image > alpha_roi)
-    roi_old = roi_masked(roi=roi, pixel_weights=alpha_image <= alpha_roi)
-    return roi_old + roi_new
+def first_wins(roi: ndarray, image: ndarray) -> ndarray:
+    return ~roi[:, :, 3].astype(bool) & image[:, :, 3].astype(bool)
 
 
-def roi_masked(roi: ndarray, pixel_weights: ndarray) -> ndarray:
-    roi[:, :, 0] *= pixel_weights
-    roi[:, :, 1] *= pixel_weights
-    roi[:, :, 2] *= pixel_weights
-    roi[:, :, 3] *= pixel_weights
-    return roi
+COMPOSITING_POLICIES: dict[CompositingPolicy, Callable[[ndarray, ndarray], ndarray]] = {
+    "dominant_alpha": dominant_alpha,
+    "max_alpha": max_alpha,
+    "first_wins": first_wins,
+}
+
+
+def update_roi(
+    tile: ndarray,
+    x: int,
+    y: int,
+    image: ndarray,
+    policy: CompositingPolicy = "dominant_alpha",
+) -> None:
+    """Write the winning pixels of image directly into the tile (in place)"""
+    height, width, _ = image.shape
+    roi = tile[y : y + height, x : x + width, :]
+    copyto(
+        roi,
+        image,
+        where=COMPOSITING_POLICIES[policy](roi=roi, image=image)[:, :, None],
+    )
+
+
+def allocate_image(height: int, width: int, path: str | None = None) -> ndarray:
+    """Blank RGBA image, memory mapped to an .npy file when a path is given so
+    that it can be larger than RAM (pages are only resident while in use)"""
+    record_allocation(nbytes=height * width * 4)
+    if path is None:
+        return zeros(shape=(height, width, 4), dtype="uint8")
+    return open_memmap(path, mode="w+", dtype="uint8", shape=(height, width, 4))
 
 
 def convert_gps_degrees_to_metres(
     coordinates: list[Point],
+    source_crs: str | None = None,
+    target_crs: str | None = None,
 ) -> list[tuple[float, float]]:
-    data = GeoDataFrame(coordinates, columns=["geometry"])
-    return list(zip(data.geometry.x, data.geometry.y))
+    return [
+        (x_m, y_m)
+        for x_m, y_m in coordinates_to_metres(
+            coordinates=[(point.x, point.y) for point in coordinates],
+            source_crs=source_crs,
+            target_crs=target_crs,
+        ).tolist()
+    ]
 
 
 def convert_m_to_pixels(m: float, m_per_pixel: float) -> int:
-    return int(m / m_per_pixel)
+    return floor(m / m_per_pixel)
 
 
 def convert_coordinates_to_pixels(
     coordinates: list[tuple[float, float]], metadata: list[OrthorectificationMetadata]
 ) -> list[tuple[int, int]]:
-    return [
-        (int(x / meta.metres_per_pixel), int(y / meta.metres_per_pixel))
-        for (x, y), meta in zip(coordinates, metadata)
-    ]
+    metres_per_pixel = asarray([meta.metres_per_pixel for meta in metadata])
+    pixels = (asarray(coordinates, dtype=float) / metres_per_pixel[:, None]).astype(
+        int64
+    )
+    return [(x, y) for x, y in pixels.tolist()]
 
 
 def intensity_gradient_from_focal_point(
@@ -69,6 +136,34 @@ def intensity_gradient_from_focal_point(
     return 1 - inverse_matrix_normalised
 
 
+@lru_cache(maxsize=32)
+def alpha_channel(
+    image_height: int, image_width: int, bottom_crop: int, side_crop: int
+) -> ndarray:
+    """Alpha weights for an orthorectified image (memoised and read-only as they
+    only depend on the image shape and crops, which are constant for a survey)"""
+    alpha = (
+        intensity_gradient_from_focal_point(
+            image_width=image_width,
+            image_height=image_height,
+            focal_point_x=image_width // 2,
+            focal_point_y=image_height,
+        )
+        * 255
+    ).astype("uint8")
+    alpha[:, :side_crop] = 0
+    alpha[:, image_width - side_crop :] = 0
+    alpha[image_height - bottom_crop :, :] = 255 // 2
+    alpha.flags.writeable = False
+    return alpha
+
+
+def scaled_crop(crop: int, scale: float) -> int:
+    """Crop (in orthorectified pixels at the image's own resolution) at another
+    scale, keeping at least one pixel of a crop that is not 0"""
+    return max(round(crop * scale), 1) if crop else 0
+
+
 def add_alpha_channel_and_rotate(
     image: ndarray,
     heading: float,
@@ -77,20 +172,13 @@ def add_alpha_channel_and_rotate(
     display: bool,
 ) -> ndarray:
     height, width, _ = image.shape
-    alpha = (
-        intensity_gradient_from_focal_point(
-            image_width=width,
-            image_height=height,
-            focal_point_x=width // 2,
-            focal_point_y=height,
-        )
-        * 255
-    )
-    alpha[:, :side_crop] = 0
-    alpha[:, -side_crop:] = 0
-    alpha[height - bottom_crop :, :] = 255 // 2
     image_rgba = cvtColor(image, COLOR_RGB2RGBA)
-    image_rgba[:, :, 3] = alpha
+    image_rgba[:, :, 3] = alpha_channel(
+        image_height=height,
+        image_width=width,
+        bottom_crop=bottom_crop,
+        side_crop=side_crop,
+    )
     image_rgba_rotated = rotate(image_rgba, -heading, reshape=True, order=0)
     image_rgba_rotated[:, :, 3] = (
         image_rgba_rotated[:, :, :3].sum(axis=-1).astype(bool)
@@ -104,38 +192,419 @@ def add_alpha_channel_and_rotate(
     return image_rgba_rotated[::-1, :, :]
 
 
-def add_to_orthomosaic(
-    orthomosaic_image: ndarray | None,
-    orthomosaic_metadata: OrthomosaicMetadata | None,
+def orthorectify_and_rotate_in_one_warp(
+    image: ndarray,
+    image_metadata: ImageMetadata,
+    camera_settings: Camera,
+    heading: float,
+    bottom_crop: int,
+    side_crop: int,
+    geometry_cache: GeometryCache | None = None,
+    metres_per_pixel: float | None = None,
+) -> tuple[ndarray, OrthorectificationMetadata]:
+    """Equivalent to `orthorectify_image` followed by `add_alpha_channel_and_rotate`
+    but with the heading rotation and vertical flip folded into the homography
+    so the image is only resampled once
+
+    The pixels are resampled by a single RGBA `warpPerspective` into the
+    rotated frame. The alpha channel is defined on the orthorectified grid, so
+    it is first warped back onto the (small) backdown image, a one channel warp
+    of the input size rather than a second pass over the rotated frame, and
+    then resampled with the RGB channels. The mosaic offset is not folded in: the
+    frame is warped into its own buffer because the compositing policies blend
+    it with the tiles it overlaps (see `TiledCanvas.add_image`)."""
+    height, width, _ = image.shape
+    geometry = cached_orthorectification_geometry(
+        image_width=width,
+        image_height=height,
+        image_metadata=image_metadata,
+        camera_settings=camera_settings,
+        geometry_cache=geometry_cache,
+        metres_per_pixel=metres_per_pixel,
+    )
+    image = resize_to_geometry(image=image, geometry=geometry)
+    width, height = geometry.image_size
+    orthorectified_width, orthorectified_height = geometry.new_size
+    rotation, rotated_size = heading_rotation_matrix(
+        image_width=orthorectified_width,
+        image_height=orthorectified_height,
+        heading=heading,
+    )
+    alpha = alpha_channel(
+        image_height=orthorectified_height,
+        image_width=orthorectified_width,
+        bottom_crop=scaled_crop(crop=bottom_crop, scale=geometry.scale),
+        side_crop=scaled_crop(crop=side_crop, scale=geometry.scale),
+    )
+    image_rgba = cvtColor(image, COLOR_RGB2RGBA)
+    image_rgba[:, :, 3] = warpPerspective(
+        alpha,
+        geometry.homography,
+        (width, height),
+        flags=INTER_LINEAR | WARP_INVERSE_MAP,
+    )
+    image_rgba_rotated = warpPerspective(
+        image_rgba, rotation @ geometry.homography, rotated_size
+    )
+    image_rgba_rotated[:, :, 3] *= image_rgba_rotated[:, :, :3].any(axis=-1)
+    orthorectification_metadata = OrthorectificationMetadata(
+        metres_per_pixel=geometry.metres_per_pixel, scale=geometry.scale
+    )
+    return image_rgba_rotated, orthorectification_metadata
+
+
+def rotated_orthorectified_footprint(
+    image_width: int,
+    image_height: int,
+    image_metadata: ImageMetadata,
+    camera_settings: Camera,
+    heading: float,
+    geometry_cache: GeometryCache | None = None,
+    metres_per_pixel: float | None = None,
+) -> tuple[tuple[int, int], float]:
+    """Size (width, height) and metres per pixel of a rotated orthorectified image without warping it"""
+    geometry = cached_orthorectification_geometry(
+        image_width=image_width,
+        image_height=image_height,
+        image_metadata=image_metadata,
+        camera_settings=camera_settings,
+        geometry_cache=geometry_cache,
+        metres_per_pixel=metres_per_pixel,
+    )
+    orthorectified_width, orthorectified_height = geometry.new_size
+    _, rotated_size = heading_rotation_matrix(
+        image_width=orthorectified_width,
+        image_height=orthorectified_height,
+        heading=heading,
+    )
+    return rotated_size, geometry.metres_per_pixel
+
+
+def corridor_positions(
+    frames_m: ndarray,
+    north_sizes: list[tuple[int, int]],
+    corridor_sizes: list[tuple[int, int]],
+    m_per_pixel: list[float],
+    corridor_heading: float,
+) -> ndarray:
+    """Corners in a corridor frame of rotated orthorectified images whose
+    corners on north-aligned axes are at `frames_m` (an (n, 2) array of metres)
+
+    The images are rotated less in the corridor frame, so each corner moves to
+    keep the centre of its image where it would be in a north-aligned orthomosaic."""
+    m_per_pixel = asarray(m_per_pixel, dtype=float)[:, None]
+    return (
+        metres_to_corridor(
+            coordinates_m=frames_m
+            + asarray(north_sizes, dtype=float) * m_per_pixel / 2,
+            corridor_heading=corridor_heading,
+        )
+        - asarray(corridor_sizes, dtype=float) * m_per_pixel / 2
+    )
+
+
+def target_metres_per_pixel(
+    orthomosaic_metadata: OrthomosaicMetadata | None, metres_per_pixel: float | None
+) -> float | None:
+    """The ground sample distance to warp frames at so that they land on the grid
+    of the orthomosaic: its own once it exists, refusing a different one"""
+    if orthomosaic_metadata is None:
+        return metres_per_pixel
+    if metres_per_pixel is not None and not isclose(
+        metres_per_pixel, orthomosaic_metadata.x_m_per_pixel
+    ):
+        raise ValueError(
+            f"Orthomosaic {orthomosaic_metadata.id} is at {orthomosaic_metadata.x_m_per_pixel:g} m/pixel, frames cannot be added at {metres_per_pixel:g} m/pixel"
+        )
+    return orthomosaic_metadata.x_m_per_pixel
+
+
+def orthorectify_and_rotate(
     backdown_image: ndarray,
     gps_data: GPS,
     backdown_image_metadata: ImageMetadata,
     camera_settings: Camera,
     bottom_crop: int,
     side_crop: int,
+    fused_warp: bool = False,
+    geometry_cache: GeometryCache | None = None,
+    metres_per_pixel: float | None = None,
+    corridor_heading: float = 0.0,
 ) -> tuple[ndarray, OrthomosaicMetadata]:
-    """Add another backdown image to the orthomosaic"""
-    orthorectified_image, orthorectification_metadata = orthorectify_image(
-        image=backdown_image,
-        image_metadata=backdown_image_metadata,
-        camera_settings=camera_settings,
-    )
-    rotated_orthorectified_image = add_alpha_channel_and_rotate(
-        image=orthorectified_image,
-        heading=gps_data.heading,
-        bottom_crop=bottom_crop,
-        side_crop=side_crop,
-        display=False,
-    )
-    x_m, y_m = convert_gps_degrees_to_metres(
-        coordinates=[Point((gps_data.x, gps_data.y))]
-    )[0]
+    """Orthorectify a backdown image and rotate it onto the orthomosaic axes
+
+    With `metres_per_pixel` the image is downscaled before the warp to that
+    ground sample distance rather than keeping its own (finer) resolution.
+    With a `corridor_heading` the orthomosaic axes are those of a corridor
+    frame with its y axis along that heading rather than north."""
+    if fused_warp:
+        with stage("warp"):
+            (
+                rotated_orthorectified_image,
+                orthorectification_metadata,
+            ) = orthorectify_and_rotate_in_one_warp(
+                image=backdown_image,
+                image_metadata=backdown_image_metadata,
+                camera_settings=camera_settings,
+                heading=gps_data.heading - corridor_heading,
+                bottom_crop=bottom_crop,
+                side_crop=side_crop,
+                geometry_cache=geometry_cache,
+                metres_per_pixel=metres_per_pixel,
+            )
+    else:
+        with stage("orthorectify"):
+            orthorectified_image, orthorectification_metadata = orthorectify_image(
+                image=backdown_image,
+                image_metadata=backdown_image_metadata,
+                camera_settings=camera_settings,
+                geometry_cache=geometry_cache,
+                metres_per_pixel=metres_per_pixel,
+            )
+        with stage("rotate"):
+            rotated_orthorectified_image = add_alpha_channel_and_rotate(
+                image=orthorectified_image,
+                heading=gps_data.heading - corridor_heading,
+                bottom_crop=scaled_crop(
+                    crop=bottom_crop, scale=orthorectification_metadata.scale
+                ),
+                side_crop=scaled_crop(
+                    crop=side_crop, scale=orthorectification_metadata.scale
+                ),
+                display=False,
+            )
+    frame_m = coordinates_to_metres(coordinates=gps_coordinates(gps_data=[gps_data]))
+    if corridor_heading != 0:
+        height, width, _ = backdown_image.shape
+        north_size, _ = rotated_orthorectified_footprint(
+            image_width=width,
+            image_height=height,
+            image_metadata=backdown_image_metadata,
+            camera_settings=camera_settings,
+            heading=gps_data.heading,
+            geometry_cache=geometry_cache,
+            metres_per_pixel=metres_per_pixel,
+        )
+        rotated_height, rotated_width, _ = rotated_orthorectified_image.shape
+        frame_m = corridor_positions(
+            frames_m=frame_m,
+            north_sizes=[north_size],
+            corridor_sizes=[(rotated_width, rotated_height)],
+            m_per_pixel=[orthorectification_metadata.metres_per_pixel],
+            corridor_heading=corridor_heading,
+        )
+    ((x_m, y_m),) = frame_m.tolist()
     rotated_orthorectified_image_metadata = OrthomosaicMetadata(
         x_m=x_m,
         y_m=y_m,
         x_m_per_pixel=orthorectification_metadata.metres_per_pixel,
         y_m_per_pixel=orthorectification_metadata.metres_per_pixel,
         id=hash(datetime.now()),
+        corridor_heading=corridor_heading,
+    )
+    return rotated_orthorectified_image, rotated_orthorectified_image_metadata
+
+
+def _initialise_worker(geometry_cache: GeometryCache | None) -> None:
+    global _worker_geometry_cache
+    _worker_geometry_cache = geometry_cache
+
+
+def frame_preparation_pool(
+    workers: int,
+    geometry_cache: GeometryCache | None = None,
+    start_method: str | None = None,
+) -> ProcessPoolExecutor:
+    """Process pool for `orthorectify_and_rotate_all`, each worker with its own
+    copy of the geometry cache, to be kept for many batches of frames"""
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=None if start_method is None else get_context(start_method),
+        initializer=_initialise_worker,
+        initargs=(geometry_cache,),
+    )
+
+
+def _orthorectify_and_rotate_in_shared_memory(
+    shared_backdown_image: SharedArray,
+    gps_data: GPS,
+    backdown_image_metadata: ImageMetadata,
+    camera_settings: Camera,
+    bottom_crop: int,
+    side_crop: int,
+    fused_warp: bool,
+    metres_per_pixel: float | None,
+    corridor_heading: float,
+) -> tuple[SharedArray, OrthomosaicMetadata]:
+    memory = SharedMemory(name=shared_backdown_image.name)
+    backdown_image = ndarray(
+        shape=shared_backdown_image.shape,
+        dtype=shared_backdown_image.dtype,
+        buffer=memory.buf,
+    )
+    (
+        rotated_orthorectified_image,
+        rotated_orthorectified_image_metadata,
+    ) = orthorectify_and_rotate(
+        backdown_image=backdown_image,
+        gps_data=gps_data,
+        backdown_image_metadata=backdown_image_metadata,
+        camera_settings=camera_settings,
+        bottom_crop=bottom_crop,
+        side_crop=side_crop,
+        fused_warp=fused_warp,
+        geometry_cache=_worker_geometry_cache,
+        metres_per_pixel=metres_per_pixel,
+        corridor_heading=corridor_heading,
+    )
+    del backdown_image
+    memory.close()
+    output_memory, shared_rotated_orthorectified_image = array_to_shared_memory(
+        array=rotated_orthorectified_image
+    )
+    output_memory.close()
+    return shared_rotated_orthorectified_image, rotated_orthorectified_image_metadata
+
+
+def orthorectify_and_rotate_all(
+    backdown_images: Iterable[ndarray],
+    gps_data: Iterable[GPS],
+    backdown_images_metadata: Iterable[ImageMetadata],
+    camera_settings: Camera,
+    bottom_crop: int,
+    side_crop: int,
+    fused_warp: bool = False,
+    geometry_cache: GeometryCache | None = None,
+    workers: int = 1,
+    metres_per_pixel: float | None = None,
+    corridor_heading: float = 0.0,
+    pool: ProcessPoolExecutor | None = None,
+) -> Iterator[tuple[ndarray, OrthomosaicMetadata]]:
+    """Prepare backdown images for the orthomosaic (yielded in their original order)
+
+    With more than one worker the frames are prepared in a process pool and
+    exchanged through shared memory rather than pickled. At most two frames
+    per worker are in flight at once, so memory stays bounded. The pool is
+    `pool` when given (see `frame_preparation_pool`) and is left running,
+    otherwise one is started for these frames only."""
+    frames = zip(backdown_images, gps_data, backdown_images_metadata, strict=True)
+    if workers <= 1:
+        for backdown_image, gps, backdown_image_metadata in frames:
+            yield orthorectify_and_rotate(
+                backdown_image=backdown_image,
+                gps_data=gps,
+                backdown_image_metadata=backdown_image_metadata,
+                camera_settings=camera_settings,
+                bottom_crop=bottom_crop,
+                side_crop=side_crop,
+                fused_warp=fused_warp,
+                geometry_cache=geometry_cache,
+                metres_per_pixel=metres_per_pixel,
+                corridor_heading=corridor_heading,
+            )
+        return
+
+    pending = deque()
+    try:
+        with (
+            nullcontext(pool)
+            if pool is not None
+            else frame_preparation_pool(workers=workers, geometry_cache=geometry_cache)
+        ) as pool:
+            for backdown_image, gps, backdown_image_metadata in frames:
+                input_memory, shared_backdown_image = array_to_shared_memory(
+                    array=backdown_image
+                )
+                pending.append(
+                    (
+                        input_memory,
+                        pool.submit(
+                            _orthorectify_and_rotate_in_shared_memory,
+                            shared_backdown_image=shared_backdown_image,
+                            gps_data=gps,
+                            backdown_image_metadata=backdown_image_metadata,
+                            camera_settings=camera_settings,
+                            bottom_crop=bottom_crop,
+                            side_crop=side_crop,
+                            fused_warp=fused_warp,
+                            metres_per_pixel=metres_per_pixel,
+                            corridor_heading=corridor_heading,
+                        ),
+                    )
+                )
+                while len(pending) >= 2 * workers:
+                    yield _collect_prepared_frame(*pending.popleft())
+            while pending:
+                yield _collect_prepared_frame(*pending.popleft())
+    finally:
+        for input_memory, prepared_frame in pending:
+            input_memory.close()
+            input_memory.unlink()
+            if prepared_frame.exception() is None:
+                shared_rotated_orthorectified_image, _ = prepared_frame.result()
+                array_from_shared_memory(
+                    shared_array=shared_rotated_orthorectified_image
+                )
+
+
+def _collect_prepared_frame(
+    input_memory: SharedMemory, prepared_frame: Future
+) -> tuple[ndarray, OrthomosaicMetadata]:
+    try:
+        (
+            shared_rotated_orthorectified_image,
+            rotated_orthorectified_image_metadata,
+        ) = prepared_frame.result()
+    finally:
+        input_memory.close()
+        input_memory.unlink()
+    return (
+        array_from_shared_memory(shared_array=shared_rotated_orthorectified_image),
+        rotated_orthorectified_image_metadata,
+    )
+
+
+def add_to_orthomosaic(
+    orthomosaic_image: ndarray | None,
+    orthomosaic_metadata: OrthomosaicMetadata | None,
+    backdown_image: ndarray,
+    gps_data: GPS,
+    backdown_image_metadata: ImageMetadata,
+    camera_settings: Camera,
+    bottom_crop: int,
+    side_crop: int,
+    fused_warp: bool = False,
+    geometry_cache: GeometryCache | None = None,
+    compositing_policy: CompositingPolicy = "dominant_alpha",
+    metres_per_pixel: float | None = None,
+    corridor_heading: float = 0.0,
+) -> tuple[ndarray, OrthomosaicMetadata]:
+    """Add another backdown image to the orthomosaic
+
+    With `metres_per_pixel` every frame is warped at that ground sample
+    distance, so the orthomosaic keeps one fixed grid. With a
+    `corridor_heading` the orthomosaic is aligned with the road rather than
+    north (keep both the same for every frame of an orthomosaic). Frames added
+    to an existing orthomosaic are warped at its ground sample distance."""
+    if orthomosaic_image is not None:
+        metres_per_pixel = target_metres_per_pixel(
+            orthomosaic_metadata=orthomosaic_metadata,
+            metres_per_pixel=metres_per_pixel,
+        )
+    (
+        rotated_orthorectified_image,
+        rotated_orthorectified_image_metadata,
+    ) = orthorectify_and_rotate(
+        backdown_image=backdown_image,
+        gps_data=gps_data,
+        backdown_image_metadata=backdown_image_metadata,
+        camera_settings=camera_settings,
+        bottom_crop=bottom_crop,
+        side_crop=side_crop,
+        fused_warp=fused_warp,
+        geometry_cache=geometry_cache,
+        metres_per_pixel=metres_per_pixel,
+        corridor_heading=corridor_heading,
     )
     if orthomosaic_image is None:
         return rotated_orthorectified_image, rotated_orthorectified_image_metadata
@@ -153,13 +622,10 @@ def add_to_orthomosaic(
     updated_orthomosaic_metadata = OrthomosaicMetadata(
         x_m=updated_x_min,
         y_m=updated_y_min,
-        x_m_per_pixel=orthomosaic_metadata.x_m_per_pixel
-        if updated_x_min == orthomosaic_metadata.x_m
-        else rotated_orthorectified_image_metadata.x_m_per_pixel,
-        y_m_per_pixel=orthomosaic_metadata.y_m_per_pixel
-        if updated_y_min == orthomosaic_metadata.y_m
-        else rotated_orthorectified_image_metadata.y_m_per_pixel,
+        x_m_per_pixel=orthomosaic_metadata.x_m_per_pixel,
+        y_m_per_pixel=orthomosaic_metadata.y_m_per_pixel,
         id=orthomosaic_metadata.id,
+        corridor_heading=orthomosaic_metadata.corridor_heading,
     )
 
     # Get relative position (in pixels) of new image to add
@@ -174,11 +640,11 @@ def add_to_orthomosaic(
     rotated_height_pixels, rotated_width_pixels, _ = rotated_orthorectified_image.shape
     rotated_x_min_pixels = convert_m_to_pixels(
         m=rotated_x_relative,
-        m_per_pixel=rotated_orthorectified_image_metadata.x_m_per_pixel,
+        m_per_pixel=updated_orthomosaic_metadata.x_m_per_pixel,
     )
     rotated_y_min_pixels = convert_m_to_pixels(
         m=rotated_y_relative,
-        m_per_pixel=rotated_orthorectified_image_metadata.y_m_per_pixel,
+        m_per_pixel=updated_orthomosaic_metadata.y_m_per_pixel,
     )
     rotated_x_max_pixels = rotated_x_min_pixels + rotated_width_pixels
     rotated_y_max_pixels = rotated_y_min_pixels + rotated_height_pixels
@@ -208,21 +674,346 @@ def add_to_orthomosaic(
     updated_width = updated_x_max_pixels - updated_x_min_pixels
     updated_height = updated_y_max_pixels - updated_y_min_pixels
 
-    updated_orthomosaic_image = zeros(
-        shape=(updated_height, updated_width, 4), dtype="uint8"
+    updated_orthomosaic_image = allocate_image(
+        height=updated_height, width=updated_width
     )
 
-    update_roi(
-        tile=updated_orthomosaic_image,
-        image=orthomosaic_image,
-        x=ortho_x_min_pixels,
-        y=ortho_y_min_pixels,
+    with stage("composite"):
+        update_roi(
+            tile=updated_orthomosaic_image,
+            image=orthomosaic_image,
+            x=ortho_x_min_pixels,
+            y=ortho_y_min_pixels,
+        )
+        update_roi(
+            tile=updated_orthomosaic_image,
+            image=rotated_orthorectified_image,
+            x=rotated_x_min_pixels,
+            y=rotated_y_min_pixels,
+            policy=compositing_policy,
+        )
+
+    return updated_orthomosaic_image, updated_orthomosaic_metadata
+
+
+def add_batch_to_orthomosaic(
+    orthomosaic_image: ndarray | None,
+    orthomosaic_metadata: OrthomosaicMetadata | None,
+    backdown_images: list[ndarray],
+    gps_data: list[GPS],
+    backdown_images_metadata: list[ImageMetadata],
+    camera_settings: Camera,
+    bottom_crop: int,
+    side_crop: int,
+    fused_warp: bool = False,
+    geometry_cache: GeometryCache | None = None,
+    compositing_policy: CompositingPolicy = "dominant_alpha",
+    workers: int = 1,
+    orthomosaic_path: str | None = None,
+    metres_per_pixel: float | None = None,
+    corridor_heading: float = 0.0,
+) -> tuple[ndarray, OrthomosaicMetadata]:
+    """Add many backdown images to the orthomosaic in one pass
+
+    The final extent is computed up front from every frame's footprint so the
+    orthomosaic is only allocated once (on the grid of the existing orthomosaic,
+    or of the first frame for a new one). Frames are prepared across `workers`
+    processes and composited in order. With an `orthomosaic_path` the
+    orthomosaic is memory mapped to that .npy file rather than held in RAM.
+    With `metres_per_pixel` the frames are downscaled to that ground sample
+    distance before they are warped, and with a `corridor_heading` the
+    orthomosaic is aligned with the road (see `orthomosaics.corridors`). All the
+    frames are warped at the ground sample distance of the orthomosaic, or of
+    the first frame for a new one."""
+    metres_per_pixel = target_metres_per_pixel(
+        orthomosaic_metadata=orthomosaic_metadata, metres_per_pixel=metres_per_pixel
     )
-    update_roi(
-        tile=updated_orthomosaic_image,
-        image=rotated_orthorectified_image,
-        x=rotated_x_min_pixels,
-        y=rotated_y_min_pixels,
+    if metres_per_pixel is None:
+        _, metres_per_pixel = rotated_orthorectified_footprint(
+            image_width=backdown_images[0].shape[1],
+            image_height=backdown_images[0].shape[0],
+            image_metadata=backdown_images_metadata[0],
+            camera_settings=camera_settings,
+            heading=gps_data[0].heading,
+            geometry_cache=geometry_cache,
+        )
+    frames_m = coordinates_to_metres(coordinates=gps_coordinates(gps_data=gps_data))
+    footprints = [
+        rotated_orthorectified_footprint(
+            image_width=backdown_image.shape[1],
+            image_height=backdown_image.shape[0],
+            image_metadata=backdown_image_metadata,
+            camera_settings=camera_settings,
+            heading=gps.heading - corridor_heading,
+            geometry_cache=geometry_cache,
+            metres_per_pixel=metres_per_pixel,
+        )
+        for backdown_image, gps, backdown_image_metadata in zip(
+            backdown_images, gps_data, backdown_images_metadata, strict=True
+        )
+    ]
+    sizes = [size for size, _ in footprints]
+    if corridor_heading != 0:
+        frames_m = corridor_positions(
+            frames_m=frames_m,
+            north_sizes=[
+                rotated_orthorectified_footprint(
+                    image_width=backdown_image.shape[1],
+                    image_height=backdown_image.shape[0],
+                    image_metadata=backdown_image_metadata,
+                    camera_settings=camera_settings,
+                    heading=gps.heading,
+                    geometry_cache=geometry_cache,
+                    metres_per_pixel=metres_per_pixel,
+                )[0]
+                for backdown_image, gps, backdown_image_metadata in zip(
+                    backdown_images, gps_data, backdown_images_metadata
+                )
+            ],
+            corridor_sizes=sizes,
+            m_per_pixel=[m_per_pixel for _, m_per_pixel in footprints],
+            corridor_heading=corridor_heading,
+        )
+    x_m_per_pixel = y_m_per_pixel = metres_per_pixel
+    if orthomosaic_image is not None:
+        assert orthomosaic_metadata is not None
+        ortho_height_pixels, ortho_width_pixels, _ = orthomosaic_image.shape
+        frames_m = concatenate(
+            (frames_m, [(orthomosaic_metadata.x_m, orthomosaic_metadata.y_m)])
+        )
+        sizes.append((ortho_width_pixels, ortho_height_pixels))
+
+    x_min_m, y_min_m = frames_m.min(axis=0).tolist()
+    updated_orthomosaic_metadata = OrthomosaicMetadata(
+        x_m=x_min_m,
+        y_m=y_min_m,
+        x_m_per_pixel=x_m_per_pixel,
+        y_m_per_pixel=y_m_per_pixel,
+        id=hash(datetime.now())
+        if orthomosaic_metadata is None
+        else orthomosaic_metadata.id,
+        corridor_heading=corridor_heading,
+    )
+    positions = [
+        (x, y)
+        for x, y in metres_to_pixels(
+            coordinates_m=frames_m,
+            origin_m=(x_min_m, y_min_m),
+            m_per_pixel=(x_m_per_pixel, y_m_per_pixel),
+        ).tolist()
+    ]
+    updated_width = max(x + width for (x, _), (width, _) in zip(positions, sizes))
+    updated_height = max(y + height for (_, y), (_, height) in zip(positions, sizes))
+    updated_orthomosaic_image = allocate_image(
+        height=updated_height, width=updated_width, path=orthomosaic_path
     )
 
+    if orthomosaic_image is not None:
+        ortho_x_min_pixels, ortho_y_min_pixels = positions.pop()
+        update_roi(
+            tile=updated_orthomosaic_image,
+            image=orthomosaic_image,
+            x=ortho_x_min_pixels,
+            y=ortho_y_min_pixels,
+        )
+    for (rotated_orthorectified_image, _), (x, y) in zip(
+        orthorectify_and_rotate_all(
+            backdown_images=backdown_images,
+            gps_data=gps_data,
+            backdown_images_metadata=backdown_images_metadata,
+            camera_settings=camera_settings,
+            bottom_crop=bottom_crop,
+            side_crop=side_crop,
+            fused_warp=fused_warp,
+            geometry_cache=geometry_cache,
+            workers=workers,
+            metres_per_pixel=metres_per_pixel,
+            corridor_heading=corridor_heading,
+        ),
+        positions,
+    ):
+        with stage("composite"):
+            update_roi(
+                tile=updated_orthomosaic_image,
+                image=rotated_orthorectified_image,
+                x=x,
+                y=y,
+                policy=compositing_policy,
+            )
+
     return updated_orthomosaic_image, updated_orthomosaic_metadata
+
+
+class MosaicSession:
+    """An orthomosaic kept in memory while backdown images are added one at a time
+
+    `add_to_orthomosaic` reallocates the orthomosaic to the exact extent of
+    every new frame. Here the canvas has spare capacity instead. When a frame
+    does not fit, each axis it overflows grows by `growth_factor`, with the
+    extra room placed mostly ahead of the vehicle (from the frame's heading,
+    clockwise from north). The first frame only gets room along the axis the
+    vehicle is heading along. Pixels keep their place on a grid anchored at the
+    first frame, and `origin` is where the canvas starts on that grid. Adding a
+    frame then costs about its own footprint, and `finalise` crops the canvas
+    to the frames added. With a `corridor_heading` the grid is aligned with
+    the road (see `orthomosaics.corridors`)."""
+
+    def __init__(
+        self,
+        camera_settings: Camera,
+        bottom_crop: int,
+        side_crop: int,
+        fused_warp: bool = False,
+        geometry_cache: GeometryCache | None = None,
+        compositing_policy: CompositingPolicy = "dominant_alpha",
+        metres_per_pixel: float | None = None,
+        corridor_heading: float = 0.0,
+        growth_factor: float = 2.0,
+    ) -> None:
+        self.camera_settings = camera_settings
+        self.bottom_crop = bottom_crop
+        self.side_crop = side_crop
+        self.fused_warp = fused_warp
+        self.geometry_cache = geometry_cache
+        self.compositing_policy = compositing_policy
+        self.metres_per_pixel = metres_per_pixel
+        self.corridor_heading = corridor_heading
+        self.growth_factor = growth_factor
+        self.canvas: ndarray | None = None
+        self.grid: OrthomosaicMetadata | None = None
+        self.origin = (0, 0)
+        self.bounds: tuple[int, int, int, int] | None = None
+        self.allocations = 0
+
+    def add(
+        self,
+        backdown_image: ndarray,
+        gps_data: GPS,
+        backdown_image_metadata: ImageMetadata,
+    ) -> None:
+        """Add another backdown image to the orthomosaic, at the ground sample
+        distance of the first one unless the session has a `metres_per_pixel`"""
+        (
+            rotated_orthorectified_image,
+            rotated_orthorectified_image_metadata,
+        ) = orthorectify_and_rotate(
+            backdown_image=backdown_image,
+            gps_data=gps_data,
+            backdown_image_metadata=backdown_image_metadata,
+            camera_settings=self.camera_settings,
+            bottom_crop=self.bottom_crop,
+            side_crop=self.side_crop,
+            fused_warp=self.fused_warp,
+            geometry_cache=self.geometry_cache,
+            metres_per_pixel=target_metres_per_pixel(
+                orthomosaic_metadata=self.grid, metres_per_pixel=self.metres_per_pixel
+            ),
+            corridor_heading=self.corridor_heading,
+        )
+        self.add_rotated_image(
+            rotated_orthorectified_image=rotated_orthorectified_image,
+            rotated_orthorectified_image_metadata=rotated_orthorectified_image_metadata,
+            heading=gps_data.heading,
+        )
+
+    def add_rotated_image(
+        self,
+        rotated_orthorectified_image: ndarray,
+        rotated_orthorectified_image_metadata: OrthomosaicMetadata,
+        heading: float,
+    ) -> None:
+        """Add a frame already orthorectified and rotated (e.g. by `orthorectify_and_rotate_all`)"""
+        target_metres_per_pixel(
+            orthomosaic_metadata=self.grid,
+            metres_per_pixel=rotated_orthorectified_image_metadata.x_m_per_pixel,
+        )
+        if self.grid is None:
+            self.grid = rotated_orthorectified_image_metadata
+        ((x, y),) = metres_to_pixels(
+            coordinates_m=[
+                (
+                    rotated_orthorectified_image_metadata.x_m,
+                    rotated_orthorectified_image_metadata.y_m,
+                )
+            ],
+            origin_m=(self.grid.x_m, self.grid.y_m),
+            m_per_pixel=(self.grid.x_m_per_pixel, self.grid.y_m_per_pixel),
+        ).tolist()
+        height, width, _ = rotated_orthorectified_image.shape
+        frame = (x, y, x + width, y + height)
+        self.bounds = frame if self.bounds is None else _union(self.bounds, frame)
+        self._reserve(frame=frame, heading=heading - self.corridor_heading)
+        origin_x, origin_y = self.origin
+        with stage("composite"):
+            update_roi(
+                tile=self.canvas,
+                image=rotated_orthorectified_image,
+                x=x - origin_x,
+                y=y - origin_y,
+                policy=self.compositing_policy,
+            )
+
+    def finalise(self) -> tuple[ndarray, OrthomosaicMetadata]:
+        """The orthomosaic cropped to the frames added, as a copy so that the
+        canvas and its spare capacity can be released with the session"""
+        if self.canvas is None:
+            raise ValueError("No backdown images have been added to the session")
+        x_min, y_min, x_max, y_max = self.bounds
+        origin_x, origin_y = self.origin
+        orthomosaic_image = self.canvas[
+            y_min - origin_y : y_max - origin_y, x_min - origin_x : x_max - origin_x
+        ].copy()
+        return orthomosaic_image, self.grid.model_copy(
+            update=dict(
+                x_m=self.grid.x_m + x_min * self.grid.x_m_per_pixel,
+                y_m=self.grid.y_m + y_min * self.grid.y_m_per_pixel,
+            )
+        )
+
+    def _reserve(self, frame: tuple[int, int, int, int], heading: float) -> None:
+        """Grow the canvas, if needed, so that it holds a frame"""
+        if self.canvas is None:
+            extent = frame
+        else:
+            height, width, _ = self.canvas.shape
+            origin_x, origin_y = self.origin
+            extent = (origin_x, origin_y, origin_x + width, origin_y + height)
+            if _union(extent, frame) == extent:
+                return
+        needed = _union(extent, frame)
+        grown = list(needed)
+        directions = (sin(radians(heading)), cos(radians(heading)))
+        for axis, direction in enumerate(directions):
+            low, high = needed[axis], needed[axis + 2]
+            if self.canvas is None:
+                # the first frame: only make room along the direction of travel
+                if abs(direction) < max(map(abs, directions)):
+                    continue
+            elif (low, high) == (extent[axis], extent[axis + 2]):
+                continue
+            headroom = ceil((high - low) * (self.growth_factor - 1))
+            ahead = round(headroom * (1 + direction) / 2)
+            grown[axis], grown[axis + 2] = low - (headroom - ahead), high + ahead
+        x_min, y_min, x_max, y_max = grown
+        canvas = allocate_image(height=y_max - y_min, width=x_max - x_min)
+        if self.canvas is not None:
+            height, width, _ = self.canvas.shape
+            origin_x, origin_y = self.origin
+            canvas[
+                origin_y - y_min : origin_y - y_min + height,
+                origin_x - x_min : origin_x - x_min + width,
+            ] = self.canvas
+        self.canvas = canvas
+        self.origin = (x_min, y_min)
+        self.allocations += 1
+
+
+def _union(
+    first: tuple[int, int, int, int], second: tuple[int, int, int, int]
+) -> tuple[int, int, int, int]:
+    return (
+        min(first[0], second[0]),
+        min(first[1], second[1]),
+        max(first[2], second[2]),
+        max(first[3], second[3]),
+    )
@@ -1,5 +1,30 @@
-from cv2 import perspectiveTransform, warpPerspective
-from numpy import array, cos, linalg, matrix, ndarray, pi, radians, sin, sqrt
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from cv2 import (
+    CV_16SC2,
+    INTER_AREA,
+    INTER_LINEAR,
+    convertMaps,
+    perspectiveTransform,
+    remap,
+    resize,
+    warpPerspective,
+)
+from numpy import (
+    array,
+    cos,
+    diag,
+    float32,
+    indices,
+    linalg,
+    matrix,
+    ndarray,
+    pi,
+    radians,
+    sin,
+    sqrt,
+)
 
 from orthomosaics.utils.schemas import Camera, ImageMetadata, OrthorectificationMetadata
 
@@ -131,6 +156,30 @@ def homography_matrix(
     return homography, new_size
 
 
+def heading_rotation_matrix(
+    image_width: int, image_height: int, heading: float
+) -> tuple[ndarray, tuple[int, int]]:
+    """Rotate by -heading about the image centre (expanding the canvas to fit) then flip vertically"""
+    angle = radians(-heading)
+    new_width = int(
+        abs(image_width * cos(angle)) + abs(image_height * sin(angle)) + 0.5
+    )
+    new_height = int(
+        abs(image_width * sin(angle)) + abs(image_height * cos(angle)) + 0.5
+    )
+    centre_to_origin = array(
+        ((1, 0, -(image_width - 1) / 2), (0, 1, -(image_height - 1) / 2), (0, 0, 1))
+    )
+    rotate = array(
+        ((cos(angle), sin(angle), 0), (-sin(angle), cos(angle), 0), (0, 0, 1))
+    )
+    origin_to_centre = array(
+        ((1, 0, (new_width - 1) / 2), (0, 1, (new_height - 1) / 2), (0, 0, 1))
+    )
+    flip = array(((1, 0, 0), (0, -1, new_height - 1), (0, 0, 1)))
+    return flip @ origin_to_centre @ rotate @ centre_to_origin, (new_width, new_height)
+
+
 def metres_per_pixel_y_axis(
     image_width: int,
     image_height: int,
@@ -165,26 +214,231 @@ def metres_per_pixel_y_axis(
     )
 
 
+@dataclass
+class OrthorectificationGeometry:
+    """How to warp an image of `image_size` (width, height) to an orthorectified
+    image of `new_size`, scaled by `scale` from its own resolution"""
+
+    homography: ndarray
+    new_size: tuple[int, int]
+    metres_per_pixel: float
+    image_size: tuple[int, int]
+    scale: float = 1.0
+    remap_maps: tuple[ndarray, ndarray] | None = None
+
+
+def scale_homography(
+    homography: ndarray,
+    new_size: tuple[int, int],
+    image_width: int,
+    image_height: int,
+    scale: float,
+) -> tuple[ndarray, tuple[int, int], tuple[int, int]]:
+    """Homography and orthorectified size for an image downscaled (never upscaled)
+    by `scale` before warping, and the orthorectified image scaled by `scale`
+
+    Returns the homography, the orthorectified size and the downscaled image size."""
+    image_scale = min(scale, 1.0)
+    image_size = (
+        max(round(image_width * image_scale), 1),
+        max(round(image_height * image_scale), 1),
+    )
+    downscale = diag((image_size[0] / image_width, image_size[1] / image_height, 1.0))
+    new_width, new_height = new_size
+    return (
+        diag((scale, scale, 1.0)) @ homography @ linalg.inv(downscale),
+        (max(int(new_width * scale), 1), max(int(new_height * scale), 1)),
+        image_size,
+    )
+
+
+def orthorectification_geometry(
+    image_width: int,
+    image_height: int,
+    image_metadata: ImageMetadata,
+    camera_settings: Camera,
+    precompute_remap: bool = False,
+    metres_per_pixel: float | None = None,
+) -> OrthorectificationGeometry:
+    """Geometry of the orthorectification of an image, at its own resolution or
+    at a target ground sample distance of `metres_per_pixel`"""
+    homography, new_size = homography_matrix(
+        image_width=image_width,
+        image_height=image_height,
+        image_metadata=image_metadata,
+        camera_settings=camera_settings,
+    )
+    image_metres_per_pixel = metres_per_pixel_y_axis(
+        image_width=image_width,
+        image_height=image_height,
+        homography=homography,
+        image_metadata=image_metadata,
+        camera_settings=camera_settings,
+    )
+    image_size = (image_width, image_height)
+    scale = 1.0
+    if metres_per_pixel is None:
+        metres_per_pixel = image_metres_per_pixel
+    else:
+        scale = image_metres_per_pixel / metres_per_pixel
+        homography, new_size, image_size = scale_homography(
+            homography=homography,
+            new_size=new_size,
+            image_width=image_width,
+            image_height=image_height,
+            scale=scale,
+        )
+    return OrthorectificationGeometry(
+        homography=homography,
+        new_size=new_size,
+        metres_per_pixel=metres_per_pixel,
+        image_size=image_size,
+        scale=scale,
+        remap_maps=remap_maps(homography=homography, new_size=new_size)
+        if precompute_remap
+        else None,
+    )
+
+
+def resize_to_geometry(image: ndarray, geometry: OrthorectificationGeometry) -> ndarray:
+    """Downscale an image to the size its orthorectification geometry warps from"""
+    height, width = image.shape[:2]
+    if (width, height) == geometry.image_size:
+        return image
+    return resize(image, geometry.image_size, interpolation=INTER_AREA)
+
+
+def remap_maps(
+    homography: ndarray, new_size: tuple[int, int]
+) -> tuple[ndarray, ndarray]:
+    """Fixed-point `cv2.remap` tables equivalent to `warpPerspective(image, homography, new_size)`"""
+    width, height = new_size
+    y_axis, x_axis = indices((height, width), dtype=float32)
+    points = array((x_axis.ravel(), y_axis.ravel()), dtype=float32).T[None]
+    source_points = perspectiveTransform(points, linalg.inv(homography))[0]
+    map_x = source_points[:, 0].reshape(height, width)
+    map_y = source_points[:, 1].reshape(height, width)
+    return convertMaps(map_x, map_y, CV_16SC2)
+
+
+class GeometryCache:
+    """LRU cache of orthorectification geometry keyed by camera, image shape,
+    target metres per pixel and roll/pitch quantised to `attitude_tolerance_deg`"""
+
+    def __init__(
+        self,
+        max_size: int = 128,
+        attitude_tolerance_deg: float = 0.01,
+        precompute_remap: bool = False,
+    ) -> None:
+        self.max_size = max_size
+        self.attitude_tolerance_deg = attitude_tolerance_deg
+        self.precompute_remap = precompute_remap
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[tuple, OrthorectificationGeometry] = OrderedDict()
+
+    def geometry(
+        self,
+        image_width: int,
+        image_height: int,
+        image_metadata: ImageMetadata,
+        camera_settings: Camera,
+        metres_per_pixel: float | None = None,
+    ) -> OrthorectificationGeometry:
+        roll_step = round(image_metadata.roll_deg / self.attitude_tolerance_deg)
+        pitch_step = round(image_metadata.pitch_deg / self.attitude_tolerance_deg)
+        key = (
+            tuple(camera_settings.model_dump().items()),
+            image_width,
+            image_height,
+            metres_per_pixel,
+            roll_step,
+            pitch_step,
+        )
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self.misses += 1
+        geometry = orthorectification_geometry(
+            image_width=image_width,
+            image_height=image_height,
+            image_metadata=ImageMetadata(
+                roll_deg=roll_step * self.attitude_tolerance_deg,
+                pitch_deg=pitch_step * self.attitude_tolerance_deg,
+            ),
+            camera_settings=camera_settings,
+            precompute_remap=self.precompute_remap,
+            metres_per_pixel=metres_per_pixel,
+        )
+        self._cache[key] = geometry
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return geometry
+
+    def statistics(self) -> dict[str, float]:
+        requests = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self._cache),
+            hit_rate=self.hits / requests if requests else 0.0,
+        )
+
+
+def cached_orthorectification_geometry(
+    image_width: int,
+    image_height: int,
+    image_metadata: ImageMetadata,
+    camera_settings: Camera,
+    geometry_cache: GeometryCache | None,
+    metres_per_pixel: float | None = None,
+) -> OrthorectificationGeometry:
+    if geometry_cache is None:
+        return orthorectification_geometry(
+            image_width=image_width,
+            image_height=image_height,
+            image_metadata=image_metadata,
+            camera_settings=camera_settings,
+            metres_per_pixel=metres_per_pixel,
+        )
+    return geometry_cache.geometry(
+        image_width=image_width,
+        image_height=image_height,
+        image_metadata=image_metadata,
+        camera_settings=camera_settings,
+        metres_per_pixel=metres_per_pixel,
+    )
+
+
 def orthorectify_image(
     image: ndarray,
     image_metadata: ImageMetadata,
     camera_settings: Camera,
+    geometry_cache: GeometryCache | None = None,
+    metres_per_pixel: float | None = None,
 ) -> tuple[ndarray, OrthorectificationMetadata]:
+    """Warp an image onto the ground plane, at its own resolution or (downscaled
+    before the warp) at a target ground sample distance of `metres_per_pixel`"""
     height, width, _ = image.shape
-    homography, new_size = homography_matrix(
+    geometry = cached_orthorectification_geometry(
         image_width=width,
         image_height=height,
         image_metadata=image_metadata,
         camera_settings=camera_settings,
+        geometry_cache=geometry_cache,
+        metres_per_pixel=metres_per_pixel,
     )
-    orthorectified_image = warpPerspective(image, homography, new_size)
+    image = resize_to_geometry(image=image, geometry=geometry)
+    if geometry.remap_maps is None:
+        orthorectified_image = warpPerspective(
+            image, geometry.homography, geometry.new_size
+        )
+    else:
+        orthorectified_image = remap(image, *geometry.remap_maps, INTER_LINEAR)
     orthorectification_metadata = OrthorectificationMetadata(
-        metres_per_pixel=metres_per_pixel_y_axis(
-            image_width=width,
-            image_height=height,
-            homography=homography,
-            image_metadata=image_metadata,
-            camera_settings=camera_settings,
-        ),
+        metres_per_pixel=geometry.metres_per_pixel,
+        scale=geometry.scale,
     )
     return orthorectified_image, orthorectification_metadata
@@ -0,0 +1,421 @@
+from pathlib import Path
+from typing import Callable
+
+from cv2 import INTER_AREA, resize
+from numpy import ndarray, zeros
+from numpy.lib.format import open_memmap
+
+from orthomosaics.mosaics import (
+    allocate_image,
+    convert_m_to_pixels,
+    orthorectify_and_rotate,
+    orthorectify_and_rotate_all,
+    rotated_orthorectified_footprint,
+    target_metres_per_pixel,
+    update_roi,
+)
+from orthomosaics.ortho import GeometryCache
+from orthomosaics.utils.metrics import stage
+from orthomosaics.utils.schemas import (
+    GPS,
+    Camera,
+    CompositingPolicy,
+    ImageMetadata,
+    OrthomosaicMetadata,
+)
+
+TileIndex = tuple[int, int]
+
+
+def tile_indices_overlapping(
+    tile_size: int, x: int, y: int, width: int, height: int
+) -> list[TileIndex]:
+    return [
+        (row, column)
+        for row in range(y // tile_size, (y + height - 1) // tile_size + 1)
+        for column in range(x // tile_size, (x + width - 1) // tile_size + 1)
+    ]
+
+
+class TiledCanvas:
+    """Sparse RGBA canvas made of fixed-size tiles keyed by (row, column)
+
+    Tile (0, 0) starts at the orthomosaic origin (`OrthomosaicMetadata.x_m/y_m`)
+    and indices may be negative for content added before the origin.
+    Tiles missing from memory are requested from `loader` (e.g. a tile storage)
+    the first time they are touched, and new blank tiles are created otherwise.
+    With a `directory`, tiles are memory mapped .npy files in that directory
+    (reopened if they already exist) so the canvas can be larger than RAM.
+    """
+
+    def __init__(
+        self,
+        tile_size: int,
+        tiles: dict[TileIndex, ndarray] | None = None,
+        loader: Callable[[TileIndex], ndarray | None] | None = None,
+        directory: str | None = None,
+    ) -> None:
+        self.tile_size = tile_size
+        self.tiles = {} if tiles is None else tiles
+        self.loader = loader
+        self.directory = None if directory is None else Path(directory)
+        self.dirty: set[TileIndex] = set()
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            for path in self.directory.glob("tile_*.npy"):
+                _, row, column = path.stem.split("_")
+                self.tiles[int(row), int(column)] = open_memmap(path, mode="r+")
+
+    def tile(self, index: TileIndex) -> ndarray:
+        if index not in self.tiles and self.loader is not None:
+            tile = self.loader(index)
+            if tile is not None:
+                self.tiles[index] = tile
+        if index not in self.tiles:
+            row, column = index
+            self.tiles[index] = allocate_image(
+                height=self.tile_size,
+                width=self.tile_size,
+                path=None
+                if self.directory is None
+                else str(self.directory / f"tile_{row}_{column}.npy"),
+            )
+        return self.tiles[index]
+
+    def tile_indices_overlapping(
+        self, x: int, y: int, width: int, height: int
+    ) -> list[TileIndex]:
+        return tile_indices_overlapping(
+            tile_size=self.tile_size, x=x, y=y, width=width, height=height
+        )
+
+    def add_image(
+        self,
+        image: ndarray,
+        x: int,
+        y: int,
+        policy: CompositingPolicy = "dominant_alpha",
+    ) -> list[TileIndex]:
+        """Composite an RGBA image whose top left pixel lies at (x, y)"""
+        height, width, _ = image.shape
+        updated = []
+        with stage("composite"):
+            for row, column in self.tile_indices_overlapping(
+                x=x, y=y, width=width, height=height
+            ):
+                tile_x, tile_y = column * self.tile_size, row * self.tile_size
+                x_min, x_max = max(x, tile_x), min(x + width, tile_x + self.tile_size)
+                y_min, y_max = max(y, tile_y), min(y + height, tile_y + self.tile_size)
+                image_section = image[y_min - y : y_max - y, x_min - x : x_max - x]
+                if not image_section[:, :, 3].any():
+                    continue
+                update_roi(
+                    tile=self.tile(index=(row, column)),
+                    image=image_section,
+                    x=x_min - tile_x,
+                    y=y_min - tile_y,
+                    policy=policy,
+                )
+                updated.append((row, column))
+        self.dirty.update(updated)
+        return updated
+
+    def bounds(self) -> tuple[int, int, int, int]:
+        """Pixel extent (x_min, y_min, x_max, y_max) covered by the tiles"""
+        rows = [row for row, _ in self.tiles]
+        columns = [column for _, column in self.tiles]
+        return (
+            min(columns) * self.tile_size,
+            min(rows) * self.tile_size,
+            (max(columns) + 1) * self.tile_size,
+            (max(rows) + 1) * self.tile_size,
+        )
+
+    def dirty_tiles(self) -> dict[TileIndex, ndarray]:
+        return {index: self.tiles[index] for index in sorted(self.dirty)}
+
+    def to_array(self, path: str | None = None) -> ndarray:
+        x_min, y_min, x_max, y_max = self.bounds()
+        image = allocate_image(height=y_max - y_min, width=x_max - x_min, path=path)
+        for (row, column), tile in self.tiles.items():
+            x, y = column * self.tile_size - x_min, row * self.tile_size - y_min
+            image[y : y + self.tile_size, x : x + self.tile_size] = tile
+        return image
+
+
+def tiled_orthomosaic_to_array(
+    canvas: TiledCanvas,
+    orthomosaic_metadata: OrthomosaicMetadata,
+    path: str | None = None,
+) -> tuple[ndarray, OrthomosaicMetadata]:
+    """Assemble the tiles into a single orthomosaic image (memory mapped to path if given)"""
+    x_min, y_min, _, _ = canvas.bounds()
+    return canvas.to_array(path=path), orthomosaic_metadata.model_copy(
+        update=dict(
+            x_m=orthomosaic_metadata.x_m + x_min * orthomosaic_metadata.x_m_per_pixel,
+            y_m=orthomosaic_metadata.y_m + y_min * orthomosaic_metadata.y_m_per_pixel,
+            tile_size_pixels=None,
+            tile_indices=[],
+            overview_levels=0,
+        )
+    )
+
+
+def update_overview(
+    overview: TiledCanvas, tiles: dict[TileIndex, ndarray]
+) -> dict[TileIndex, ndarray]:
+    """Downsample tiles into their quadrant of the tiles of the next (half resolution) level
+
+    Only the quadrants of the given tiles change, so an overview can be kept up to date
+    by passing it just the updated tiles. Returns the updated overview tiles."""
+    half = overview.tile_size // 2
+    updated = set()
+    for (row, column), tile in tiles.items():
+        parent_index = (row // 2, column // 2)
+        quadrant_x, quadrant_y = (column % 2) * half, (row % 2) * half
+        overview.tile(index=parent_index)[
+            quadrant_y : quadrant_y + half, quadrant_x : quadrant_x + half
+        ] = resize(tile, (half, half), interpolation=INTER_AREA)
+        updated.add(parent_index)
+    overview.dirty.update(updated)
+    return {index: overview.tiles[index] for index in sorted(updated)}
+
+
+def build_overviews(canvas: TiledCanvas, levels: int) -> list[TiledCanvas]:
+    """Overview levels 1 to `levels` of a canvas, each half the resolution of the last"""
+    overviews = []
+    tiles = canvas.tiles
+    for _ in range(levels):
+        overview = TiledCanvas(tile_size=canvas.tile_size)
+        tiles = update_overview(overview=overview, tiles=tiles)
+        overviews.append(overview)
+    return overviews
+
+
+def region_pixels(
+    orthomosaic_metadata: OrthomosaicMetadata,
+    x_min_m: float,
+    y_min_m: float,
+    x_max_m: float,
+    y_max_m: float,
+    level: int = 0,
+) -> tuple[int, int, int, int]:
+    """Pixel window (x, y, width, height) of a bounding box in metres at an overview level"""
+    x_m_per_pixel = orthomosaic_metadata.x_m_per_pixel * 2**level
+    y_m_per_pixel = orthomosaic_metadata.y_m_per_pixel * 2**level
+    x = convert_m_to_pixels(
+        m=x_min_m - orthomosaic_metadata.x_m, m_per_pixel=x_m_per_pixel
+    )
+    y = convert_m_to_pixels(
+        m=y_min_m - orthomosaic_metadata.y_m, m_per_pixel=y_m_per_pixel
+    )
+    x_max = convert_m_to_pixels(
+        m=x_max_m - orthomosaic_metadata.x_m, m_per_pixel=x_m_per_pixel
+    )
+    y_max = convert_m_to_pixels(
+        m=y_max_m - orthomosaic_metadata.y_m, m_per_pixel=y_m_per_pixel
+    )
+    return x, y, max(x_max - x, 1), max(y_max - y, 1)
+
+
+def assemble_region(
+    tiles: dict[TileIndex, ndarray],
+    tile_size: int,
+    x: int,
+    y: int,
+    width: int,
+    height: int,
+) -> ndarray:
+    """Crop a pixel window out of tiles, leaving missing tiles transparent"""
+    region = zeros((height, width, 4), dtype="uint8")
+    for row, column in tile_indices_overlapping(
+        tile_size=tile_size, x=x, y=y, width=width, height=height
+    ):
+        if (row, column) not in tiles:
+            continue
+        tile_x, tile_y = column * tile_size, row * tile_size
+        x_min, x_max = max(x, tile_x), min(x + width, tile_x + tile_size)
+        y_min, y_max = max(y, tile_y), min(y + height, tile_y + tile_size)
+        region[y_min - y : y_max - y, x_min - x : x_max - x] = tiles[row, column][
+            y_min - tile_y : y_max - tile_y, x_min - tile_x : x_max - tile_x
+        ]
+    return region
+
+
+def rotated_image_position(
+    orthomosaic_metadata: OrthomosaicMetadata,
+    rotated_orthorectified_image_metadata: OrthomosaicMetadata,
+) -> tuple[int, int]:
+    """Pixel position of a rotated orthorectified image relative to the tile grid origin"""
+    return (
+        convert_m_to_pixels(
+            m=rotated_orthorectified_image_metadata.x_m - orthomosaic_metadata.x_m,
+            m_per_pixel=orthomosaic_metadata.x_m_per_pixel,
+        ),
+        convert_m_to_pixels(
+            m=rotated_orthorectified_image_metadata.y_m - orthomosaic_metadata.y_m,
+            m_per_pixel=orthomosaic_metadata.y_m_per_pixel,
+        ),
+    )
+
+
+def existing_tiles_overlapping(
+    orthomosaic_metadata: OrthomosaicMetadata,
+    rotated_orthorectified_image: ndarray,
+    rotated_orthorectified_image_metadata: OrthomosaicMetadata,
+) -> list[TileIndex]:
+    """Tiles of the orthomosaic that a rotated orthorectified image could update"""
+    x, y = rotated_image_position(
+        orthomosaic_metadata=orthomosaic_metadata,
+        rotated_orthorectified_image_metadata=rotated_orthorectified_image_metadata,
+    )
+    height, width, _ = rotated_orthorectified_image.shape
+    existing_tiles = set(orthomosaic_metadata.tile_indices)
+    return [
+        index
+        for index in tile_indices_overlapping(
+            tile_size=orthomosaic_metadata.tile_size_pixels,
+            x=x,
+            y=y,
+            width=width,
+            height=height,
+        )
+        if index in existing_tiles
+    ]
+
+
+def add_to_tiled_orthomosaic(
+    canvas: TiledCanvas | None,
+    orthomosaic_metadata: OrthomosaicMetadata | None,
+    backdown_image: ndarray,
+    gps_data: GPS,
+    backdown_image_metadata: ImageMetadata,
+    camera_settings: Camera,
+    bottom_crop: int,
+    side_crop: int,
+    tile_size: int = 1024,
+    fused_warp: bool = False,
+    geometry_cache: GeometryCache | None = None,
+    compositing_policy: CompositingPolicy = "dominant_alpha",
+    metres_per_pixel: float | None = None,
+    corridor_heading: float = 0.0,
+) -> tuple[TiledCanvas, OrthomosaicMetadata]:
+    """Add another backdown image to a tiled orthomosaic (only overlapping tiles are touched)"""
+    (
+        rotated_orthorectified_image,
+        rotated_orthorectified_image_metadata,
+    ) = orthorectify_and_rotate(
+        backdown_image=backdown_image,
+        gps_data=gps_data,
+        backdown_image_metadata=backdown_image_metadata,
+        camera_settings=camera_settings,
+        bottom_crop=bottom_crop,
+        side_crop=side_crop,
+        fused_warp=fused_warp,
+        geometry_cache=geometry_cache,
+        metres_per_pixel=target_metres_per_pixel(
+            orthomosaic_metadata=orthomosaic_metadata,
+            metres_per_pixel=metres_per_pixel,
+        ),
+        corridor_heading=corridor_heading,
+    )
+    return add_rotated_image_to_tiled_orthomosaic(
+        canvas=canvas,
+        orthomosaic_metadata=orthomosaic_metadata,
+        rotated_orthorectified_image=rotated_orthorectified_image,
+        rotated_orthorectified_image_metadata=rotated_orthorectified_image_metadata,
+        tile_size=tile_size,
+        compositing_policy=compositing_policy,
+    )
+
+
+def add_rotated_image_to_tiled_orthomosaic(
+    canvas: TiledCanvas | None,
+    orthomosaic_metadata: OrthomosaicMetadata | None,
+    rotated_orthorectified_image: ndarray,
+    rotated_orthorectified_image_metadata: OrthomosaicMetadata,
+    tile_size: int = 1024,
+    compositing_policy: CompositingPolicy = "dominant_alpha",
+) -> tuple[TiledCanvas, OrthomosaicMetadata]:
+    if canvas is None:
+        canvas = TiledCanvas(tile_size=tile_size)
+    if orthomosaic_metadata is None:
+        orthomosaic_metadata = rotated_orthorectified_image_metadata.model_copy(
+            update=dict(tile_size_pixels=canvas.tile_size)
+        )
+    target_metres_per_pixel(
+        orthomosaic_metadata=orthomosaic_metadata,
+        metres_per_pixel=rotated_orthorectified_image_metadata.x_m_per_pixel,
+    )
+
+    x, y = rotated_image_position(
+        orthomosaic_metadata=orthomosaic_metadata,
+        rotated_orthorectified_image_metadata=rotated_orthorectified_image_metadata,
+    )
+    canvas.add_image(
+        image=rotated_orthorectified_image, x=x, y=y, policy=compositing_policy
+    )
+    return canvas, orthomosaic_metadata.model_copy(
+        update=dict(
+            tile_indices=sorted(
+                set(orthomosaic_metadata.tile_indices) | set(canvas.tiles)
+            )
+        )
+    )
+
+
+def add_batch_to_tiled_orthomosaic(
+    canvas: TiledCanvas | None,
+    orthomosaic_metadata: OrthomosaicMetadata | None,
+    backdown_images: list[ndarray],
+    gps_data: list[GPS],
+    backdown_images_metadata: list[ImageMetadata],
+    camera_settings: Camera,
+    bottom_crop: int,
+    side_crop: int,
+    tile_size: int = 1024,
+    fused_warp: bool = False,
+    geometry_cache: GeometryCache | None = None,
+    compositing_policy: CompositingPolicy = "dominant_alpha",
+    workers: int = 1,
+    metres_per_pixel: float | None = None,
+    corridor_heading: float = 0.0,
+) -> tuple[TiledCanvas, OrthomosaicMetadata]:
+    """Add many backdown images to a tiled orthomosaic (each tile is loaded and dirtied at most once)"""
+    metres_per_pixel = target_metres_per_pixel(
+        orthomosaic_metadata=orthomosaic_metadata, metres_per_pixel=metres_per_pixel
+    )
+    if metres_per_pixel is None and backdown_images:
+        _, metres_per_pixel = rotated_orthorectified_footprint(
+            image_width=backdown_images[0].shape[1],
+            image_height=backdown_images[0].shape[0],
+            image_metadata=backdown_images_metadata[0],
+            camera_settings=camera_settings,
+            heading=gps_data[0].heading,
+            geometry_cache=geometry_cache,
+        )
+    for (
+        rotated_orthorectified_image,
+        rotated_orthorectified_image_metadata,
+    ) in orthorectify_and_rotate_all(
+        backdown_images=backdown_images,
+        gps_data=gps_data,
+        backdown_images_metadata=backdown_images_metadata,
+        camera_settings=camera_settings,
+        bottom_crop=bottom_crop,
+        side_crop=side_crop,
+        fused_warp=fused_warp,
+        geometry_cache=geometry_cache,
+        workers=workers,
+        metres_per_pixel=metres_per_pixel,
+        corridor_heading=corridor_heading,
+    ):
+        canvas, orthomosaic_metadata = add_rotated_image_to_tiled_orthomosaic(
+            canvas=canvas,
+            orthomosaic_metadata=orthomosaic_metadata,
+            rotated_orthorectified_image=rotated_orthorectified_image,
+            rotated_orthorectified_image_metadata=rotated_orthorectified_image_metadata,
+            tile_size=tile_size,
+            compositing_policy=compositing_policy,
+        )
+    return canvas, orthomosaic_metadata
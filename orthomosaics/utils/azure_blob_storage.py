@@ -2,10 +2,12 @@ from io import BytesIO
 
 from azure.core.exceptions import ResourceNotFoundError
 from azure.storage.blob import BlobServiceClient
+from azure.storage.blob.aio import ContainerClient as AsyncContainerClient
 from numpy import ndarray
 
 from orthomosaics.utils.rest_api import array_to_bytes, bytes_to_array
-from orthomosaics.utils.schemas import OrthomosaicMetadata
+from orthomosaics.utils.schemas import ImageEncoding, OrthomosaicMetadata
+from orthomosaics.utils.tile_storage import TileStorage
 
 
 class AzureStorage:
@@ -32,3 +34,62 @@ class AzureStorage:
             image_bytes
         )
         return image_bytes
+
+
+class AzureTileStorage(TileStorage):
+    """Tiles in an Azure blob container. The asynchronous methods share one
+    aiohttp session (and so its pooled connections) across requests"""
+
+    def __init__(
+        self,
+        connection_string: str,
+        container_name: str,
+        encoding: ImageEncoding = ImageEncoding(),
+    ) -> None:
+        client = BlobServiceClient.from_connection_string(connection_string)
+        self.container = client.get_container_client(container_name)
+        if not self.container.exists():
+            raise ResourceNotFoundError
+        self.encoding = encoding
+        self.async_container = AsyncContainerClient.from_connection_string(
+            conn_str=connection_string, container_name=container_name
+        )
+
+    def location(self, image_id: int) -> str:
+        return f"Azure Storage Blob: {self.container.container_name}/{self._tile_prefix(image_id=image_id)}"
+
+    def _read_bytes(self, name: str) -> bytes | None:
+        try:
+            return self.container.download_blob(name).readall()
+        except ResourceNotFoundError:
+            return None
+
+    def _write_bytes(self, name: str, data: bytes) -> None:
+        self.container.upload_blob(name=name, data=data, overwrite=True)
+
+    def _list_names(self, prefix: str) -> list[str]:
+        return list(self.container.list_blob_names(name_starts_with=prefix))
+
+    async def _read_bytes_async(self, name: str) -> bytes | None:
+        try:
+            downloader = await self.async_container.download_blob(name)
+            return await downloader.readall()
+        except ResourceNotFoundError:
+            return None
+
+    async def _write_bytes_async(self, name: str, data: bytes) -> None:
+        await self.async_container.upload_blob(name=name, data=data, overwrite=True)
+
+    async def list_tiles_async(
+        self, image_id: int, level: int = 0
+    ) -> list[tuple[int, int]]:
+        prefix = self._level_prefix(image_id=image_id, level=level)
+        return sorted(
+            [
+                self._tile_index(name=name)
+                async for name in self.async_container.list_blob_names(
+                    name_starts_with=prefix
+                )
+                if self._is_tile_name(name=name, prefix=prefix)
+            ]
+        )
@@ -0,0 +1,58 @@
+from io import BytesIO
+from zlib import compress, decompress
+
+from numpy import array, load, ndarray, save
+from PIL import Image
+
+from orthomosaics.utils.metrics import stage
+from orthomosaics.utils.schemas import ImageEncoding, ImageFormat
+
+EXTENSIONS: dict[ImageFormat, str] = dict(
+    png=".png", webp=".webp", npy=".npy", npy_zlib=".npy.zlib"
+)
+MEDIA_TYPES: dict[ImageFormat, str] = dict(
+    png="image/png",
+    webp="image/webp",
+    npy="application/octet-stream",
+    npy_zlib="application/octet-stream",
+)
+
+
+def encode_array(image: ndarray, encoding: ImageEncoding = ImageEncoding()) -> bytes:
+    with stage("encode"):
+        return _encode_array(image=image, encoding=encoding)
+
+
+def _encode_array(image: ndarray, encoding: ImageEncoding) -> bytes:
+    buffer = BytesIO()
+    if encoding.format == "png":
+        Image.fromarray(image).save(
+            buffer, format="PNG", compress_level=encoding.png_compression_level
+        )
+    elif encoding.format == "webp":
+        Image.fromarray(image).save(
+            buffer,
+            format="WEBP",
+            lossless=True,
+            exact=True,
+            method=encoding.webp_method,
+        )
+    else:
+        save(buffer, image, allow_pickle=False)
+        if encoding.format == "npy_zlib":
+            return compress(buffer.getbuffer(), encoding.zlib_level)
+    return buffer.getvalue()
+
+
+def decode_array(image_bytes: bytes) -> ndarray:
+    """Decode any of the encodings, recognised from their first bytes"""
+    with stage("decode_tile"):
+        return _decode_array(image_bytes=image_bytes)
+
+
+def _decode_array(image_bytes: bytes) -> ndarray:
+    if image_bytes.startswith(b"\x93NUMPY"):
+        return load(BytesIO(image_bytes), allow_pickle=False)
+    if image_bytes.startswith(b"x"):
+        return load(BytesIO(decompress(image_bytes)), allow_pickle=False)
+    return array(Image.open(BytesIO(image_bytes)))
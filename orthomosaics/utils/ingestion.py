@@ -0,0 +1,84 @@
+from asyncio import Event, Task, create_task
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, TypeVar
+from uuid import uuid4
+
+from orthomosaics.utils.rest_api import Job, Results
+
+Update = TypeVar("Update")
+
+
+class IngestionQueueFull(Exception):
+    pass
+
+
+class IngestionQueue(Generic[Update]):
+    """Serialises the updates of each orthomosaic
+
+    Updates submitted while an orthomosaic is being flushed are queued and
+    then coalesced into a single call of `flush` (so one composite and persist
+    cycle), which removes lost updates from concurrent requests."""
+
+    def __init__(
+        self,
+        flush: Callable[[int, list[Update]], Awaitable[Results]],
+        max_queued_updates: int,
+        max_finished_jobs: int = 10_000,
+    ) -> None:
+        self.flush = flush
+        self.max_queued_updates = max_queued_updates
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+        self._finished: dict[str, Event] = {}
+        self._queued: dict[int, list[tuple[Job, Update]]] = {}
+        self._flushing: dict[int, Task] = {}
+
+    def queued_updates(self) -> int:
+        return sum(len(updates) for updates in self._queued.values())
+
+    def submit(self, orthomosaic_id: int, update: Update) -> Job:
+        if self.queued_updates() >= self.max_queued_updates:
+            raise IngestionQueueFull(
+                f"{self.queued_updates()} updates are already queued, try again later"
+            )
+        job = Job(id=uuid4().hex, orthomosaic_id=orthomosaic_id, status="queued")
+        self.jobs[job.id] = job
+        self._finished[job.id] = Event()
+        self._queued.setdefault(orthomosaic_id, []).append((job, update))
+        if orthomosaic_id not in self._flushing:
+            self._flushing[orthomosaic_id] = create_task(
+                self._flush_queued(orthomosaic_id=orthomosaic_id)
+            )
+        return job
+
+    async def wait(self, job_id: str) -> Job:
+        finished = self._finished.get(job_id)
+        if finished is not None:
+            await finished.wait()
+        return self.jobs[job_id]
+
+    async def _flush_queued(self, orthomosaic_id: int) -> None:
+        try:
+            while self._queued.get(orthomosaic_id):
+                queued = self._queued.pop(orthomosaic_id)
+                for job, _ in queued:
+                    job.status = "processing"
+                try:
+                    results = await self.flush(
+                        orthomosaic_id, [update for _, update in queued]
+                    )
+                    for job, _ in queued:
+                        job.status, job.results = "done", results
+                except Exception as error_details:
+                    for job, _ in queued:
+                        job.status, job.detail = "failed", str(error_details)
+                for job, _ in queued:
+                    self._finished.pop(job.id).set()
+                self._forget_finished_jobs()
+        finally:
+            del self._flushing[orthomosaic_id]
+
+    def _forget_finished_jobs(self) -> None:
+        finished_jobs = [job_id for job_id in self.jobs if job_id not in self._finished]
+        for job_id in finished_jobs[: -self.max_finished_jobs or None]:
+            del self.jobs[job_id]
@@ -0,0 +1,207 @@
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os.path import basename
+from sys import _current_frames
+from threading import Event, Lock, Thread, get_ident
+from time import perf_counter
+from typing import Iterator
+
+LATENCY_BUCKETS_S = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+SIZE_BUCKETS_BYTES = tuple(4**power for power in range(5, 17))
+IDLE_FUNCTIONS = {"select", "wait", "_worker", "get", "_wait_for_tstate_lock"}
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        position = bisect_left(self.buckets, value)
+        if position < len(self.buckets):
+            self.counts[position] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics:
+    """Counters and histograms with labels, rendered in the Prometheus text format
+
+    Recording takes a lock and a few additions, so it can be called from the
+    hot path of every thread."""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.counters: dict[str, dict[Labels, float]] = {}
+        self.histograms: dict[str, dict[Labels, Histogram]] = {}
+
+    def increment(self, name: str, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counters = self.counters.setdefault(name, {})
+            counters[key] = counters.get(key, 0.0) + amount
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS_S,
+        **labels: str,
+    ) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histograms = self.histograms.setdefault(name, {})
+            if key not in histograms:
+                histograms[key] = Histogram(buckets=buckets)
+            histograms[key].observe(value=value)
+
+    def render(self, gauges: dict[str, dict[Labels, float]] | None = None) -> str:
+        """Every metric in the Prometheus text exposition format, with `gauges`
+        (such as the state of caches) read at the time of the scrape"""
+        lines = []
+        with self._lock:
+            for name, counters in sorted(self.counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                lines.extend(
+                    f"{name}{_labels(key)} {value}"
+                    for key, value in sorted(counters.items())
+                )
+            for name, histograms in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    for bucket, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(
+                            f"{name}_bucket{_labels(key + (('le', str(bucket)),))} {cumulative}"
+                        )
+                    lines.append(
+                        f"{name}_bucket{_labels(key + (('le', '+Inf'),))} {histogram.count}"
+                    )
+                    lines.append(f"{name}_sum{_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_labels(key)} {histogram.count}")
+        for name, values in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(
+                f"{name}{_labels(key)} {value}" for key, value in sorted(values.items())
+            )
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key: Labels) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+
+metrics = Metrics()
+
+
+class StageTimings:
+    """Seconds spent in each stage while collecting, summed over threads"""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.seconds: dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+
+_stage_timings: ContextVar[StageTimings | None] = ContextVar(
+    "stage_timings", default=None
+)
+
+
+@contextmanager
+def collect_timings() -> Iterator[StageTimings]:
+    """Also add up the stages run in this context (and the threads started from it)"""
+    timings = StageTimings()
+    token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _stage_timings.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a stage of the pipeline into the `orthomosaic_stage_seconds` histogram"""
+    begin = perf_counter()
+    try:
+        yield
+    finally:
+        seconds = perf_counter() - begin
+        metrics.observe("orthomosaic_stage_seconds", seconds, stage=name)
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings.add(name=name, seconds=seconds)
+
+
+def record_bytes(direction: str, nbytes: int) -> None:
+    metrics.increment("orthomosaic_storage_bytes_total", nbytes, direction=direction)
+
+
+def record_allocation(nbytes: int) -> None:
+    metrics.observe("orthomosaic_allocation_bytes", nbytes, buckets=SIZE_BUCKETS_BYTES)
+
+
+class SamplingProfiler:
+    """Samples the Python stacks of every thread every `interval_s` while running
+
+    The stacks are collapsed (one `outermost;...;innermost count` line per
+    stack, as read by flame graph tools), leaving out threads that are idle."""
+
+    def __init__(self, interval_s: float = 0.005) -> None:
+        self.interval_s = interval_s
+        self.stacks: Counter[str] = Counter()
+        self._stop = Event()
+        self._thread = Thread(target=self._sample, daemon=True)
+
+    def __enter__(self) -> "SamplingProfiler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "\n".join(
+            f"{stack} {count}" for stack, count in self.stacks.most_common()
+        )
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            for thread_id, frame in _current_frames().items():
+                if thread_id == get_ident() or frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(
+                        f"{frame.f_code.co_name} ({basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+                    )
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
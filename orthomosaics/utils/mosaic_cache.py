@@ -0,0 +1,232 @@
+from asyncio import Lock, gather, sleep, to_thread
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from orthomosaics.coverage import CoverageMap
+from orthomosaics.footprints import FrameIndex
+from orthomosaics.tiles import TiledCanvas, TileIndex, update_overview
+from orthomosaics.utils.metrics import stage
+from orthomosaics.utils.schemas import OrthomosaicMetadata
+from orthomosaics.utils.tile_storage import TileStorage
+
+
+@dataclass
+class CachedMosaic:
+    canvas: TiledCanvas
+    metadata: OrthomosaicMetadata
+    coverage: CoverageMap
+    overviews: list[TiledCanvas] = field(default_factory=list)
+    frames: FrameIndex = field(default_factory=FrameIndex)
+    lock: Lock = field(default_factory=Lock)
+    flushing: Lock = field(default_factory=Lock)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            tile.nbytes
+            for canvas in (self.canvas, *self.overviews)
+            for tile in canvas.tiles.values()
+        )
+
+
+class MosaicCache:
+    """Canvases of the orthomosaics being added to, kept in memory between requests
+
+    Updated tiles are written to storage later (write-behind): every
+    `flush_interval_s` by `flush_periodically`, when the least recently used
+    mosaics are evicted to stay under `max_bytes`, and when a mosaic is
+    finalised. When the remaining mosaics, such as a single long survey, still
+    take more than `max_bytes`, their clean overview tiles and then their
+    earliest added clean tiles are dropped after a flush, to be read back by
+    `load_tiles` when they are needed again. The overview levels of a mosaic
+    are brought up to date from the updated tiles as they are written, along
+    with its metadata and frame records. The backdown images of the frames are
+    not cached, they are written to storage as the frames are added.
+    Hold `CachedMosaic.lock` while changing the tiles of a canvas.
+    """
+
+    def __init__(
+        self, storage: TileStorage, max_bytes: int, flush_interval_s: float = 30.0
+    ) -> None:
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self.flush_interval_s = flush_interval_s
+        self.mosaics: OrderedDict[int, CachedMosaic] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushed_tiles = 0
+        self.dropped_tiles = 0
+
+    def get(self, orthomosaic_id: int) -> CachedMosaic | None:
+        mosaic = self.mosaics.get(orthomosaic_id)
+        if mosaic is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.mosaics.move_to_end(orthomosaic_id)
+        return mosaic
+
+    async def load_tiles(
+        self, orthomosaic_id: int, mosaic: CachedMosaic, indices: Iterable[TileIndex]
+    ) -> None:
+        """Read the stored tiles among `indices` that are not in memory, either not
+        loaded yet or dropped to stay under `max_bytes` (hold `mosaic.lock`)"""
+        mosaic.canvas.tiles.update(
+            await self.storage.read_tiles_async(
+                image_id=orthomosaic_id,
+                indices=sorted(
+                    set(indices)
+                    & (set(mosaic.metadata.tile_indices) - set(mosaic.canvas.tiles))
+                ),
+            )
+        )
+
+    async def put(self, orthomosaic_id: int, mosaic: CachedMosaic) -> None:
+        self.mosaics[orthomosaic_id] = mosaic
+        self.mosaics.move_to_end(orthomosaic_id)
+        await self._evict()
+
+    def nbytes(self) -> int:
+        return sum(mosaic.nbytes for mosaic in self.mosaics.values())
+
+    async def flush(self, orthomosaic_id: int) -> int:
+        """Write the tiles updated since the last flush, returning how many were written"""
+        mosaic = self.mosaics.get(orthomosaic_id)
+        if mosaic is None:
+            return 0
+        async with mosaic.flushing:
+            async with mosaic.lock:
+                tiles = {
+                    index: tile.copy()
+                    for index, tile in mosaic.canvas.dirty_tiles().items()
+                }
+                mosaic.canvas.dirty.clear()
+                metadata = mosaic.metadata
+                frames = list(mosaic.frames.frames.values())
+            if not tiles:
+                return 0
+            try:
+                levels = [tiles]
+                for level, overview in enumerate(mosaic.overviews, start=1):
+                    overview.tiles.update(
+                        await self.storage.read_tiles_async(
+                            image_id=orthomosaic_id,
+                            indices=sorted(
+                                {(row // 2, column // 2) for row, column in levels[-1]}
+                                - set(overview.tiles)
+                            ),
+                            level=level,
+                        )
+                    )
+                    with stage("overview"):
+                        levels.append(
+                            await to_thread(
+                                update_overview, overview=overview, tiles=levels[-1]
+                            )
+                        )
+                await gather(
+                    *(
+                        self.storage.write_tiles_async(
+                            image_id=orthomosaic_id, tiles=level_tiles, level=level
+                        )
+                        for level, level_tiles in enumerate(levels)
+                    ),
+                    self.storage.write_metadata_async(metadata=metadata),
+                    self.storage.write_frame_records_async(
+                        image_id=orthomosaic_id, frames=frames
+                    ),
+                )
+            except Exception:
+                mosaic.canvas.dirty.update(tiles)
+                raise
+        self.flushed_tiles += len(tiles)
+        return len(tiles)
+
+    async def flush_all(self) -> int:
+        return sum(
+            [
+                await self.flush(orthomosaic_id=orthomosaic_id)
+                for orthomosaic_id in list(self.mosaics)
+            ]
+        )
+
+    async def flush_periodically(self) -> None:
+        while True:
+            await sleep(self.flush_interval_s)
+            for orthomosaic_id in list(self.mosaics):
+                try:
+                    await self.flush(orthomosaic_id=orthomosaic_id)
+                except Exception:
+                    # the tiles stay dirty and are written at the next flush
+                    continue
+
+    async def finalise(self, orthomosaic_id: int) -> OrthomosaicMetadata | None:
+        """Write the remaining updated tiles and drop the mosaic from memory"""
+        await self.flush(orthomosaic_id=orthomosaic_id)
+        mosaic = self.mosaics.pop(orthomosaic_id, None)
+        return None if mosaic is None else mosaic.metadata
+
+    async def _evict(self) -> None:
+        for _ in range(len(self.mosaics) - 1):
+            if self.nbytes() <= self.max_bytes or len(self.mosaics) <= 1:
+                return
+            orthomosaic_id = next(iter(self.mosaics))
+            await self.flush(orthomosaic_id=orthomosaic_id)
+            mosaic = self.mosaics.get(orthomosaic_id)
+            if mosaic is None:
+                continue
+            if mosaic.canvas.dirty or mosaic.lock.locked():
+                # updated while being flushed, so keep it for now
+                self.mosaics.move_to_end(orthomosaic_id)
+                continue
+            del self.mosaics[orthomosaic_id]
+            self.evictions += 1
+        for orthomosaic_id in list(self.mosaics):
+            if self.nbytes() <= self.max_bytes:
+                return
+            await self.flush(orthomosaic_id=orthomosaic_id)
+            mosaic = self.mosaics.get(orthomosaic_id)
+            if mosaic is not None:
+                await self._drop_clean_tiles(
+                    orthomosaic_id=orthomosaic_id, mosaic=mosaic
+                )
+
+    async def _drop_clean_tiles(
+        self, orthomosaic_id: int, mosaic: CachedMosaic
+    ) -> None:
+        """Drop written tiles of the mosaic until the cache is under `max_bytes`,
+        overview tiles first as they are only read again by the next flush"""
+        async with mosaic.flushing, mosaic.lock:
+            excess = self.nbytes() - self.max_bytes
+            for overview in mosaic.overviews:
+                for index in list(overview.tiles):
+                    if excess <= 0:
+                        return
+                    excess -= overview.tiles.pop(index).nbytes
+                    self.dropped_tiles += 1
+            for index in list(mosaic.canvas.tiles):
+                if excess <= 0:
+                    return
+                if index in mosaic.canvas.dirty:
+                    continue
+                excess -= mosaic.canvas.tiles.pop(index).nbytes
+                self.dropped_tiles += 1
+
+    def statistics(self) -> dict[str, float]:
+        requests = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / requests if requests else 0.0,
+            mosaics=len(self.mosaics),
+            bytes=self.nbytes(),
+            max_bytes=self.max_bytes,
+            dirty_tiles=sum(
+                len(mosaic.canvas.dirty) for mosaic in self.mosaics.values()
+            ),
+            flushed_tiles=self.flushed_tiles,
+            evictions=self.evictions,
+            dropped_tiles=self.dropped_tiles,
+        )
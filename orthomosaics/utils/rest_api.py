@@ -1,12 +1,20 @@
 from base64 import b64decode, b64encode
 from io import BytesIO
+from typing import Literal
 
-from cv2 import imread
-from numpy import array, ndarray
+from cv2 import IMREAD_COLOR, imdecode, imread
+from numpy import array, frombuffer, ndarray, prod
 from PIL import Image
 from pydantic import BaseModel
 
-from orthomosaics.utils.schemas import GPS, Camera, ImageMetadata, OrthomosaicMetadata
+from orthomosaics.utils.metrics import stage
+from orthomosaics.utils.schemas import (
+    GPS,
+    Camera,
+    CompositingPolicy,
+    ImageMetadata,
+    OrthomosaicMetadata,
+)
 
 Image.MAX_IMAGE_PIXELS = None
 
@@ -27,18 +35,60 @@ class NullImage(Exception):
 class Results(BaseModel):
     message: str
     orthomosaic_metadata: OrthomosaicMetadata | None
+    skipped_frames: int = 0
+    timings: dict[str, float] | None = None
+    profile: str | None = None
 
 
-class Payload(BaseModel):
-    backdown_image_b64: str
+class Diagnostics(BaseModel):
+    """Whether to return the seconds spent in each stage, and a sampled profile"""
+
+    timings: bool = False
+    profile: bool = False
+
+
+class Job(BaseModel):
+    id: str
+    orthomosaic_id: int
+    status: Literal["queued", "processing", "done", "failed"]
+    results: Results | None = None
+    detail: str | None = None
+
+
+class FrameMetadata(BaseModel):
     backdown_image_metadata: ImageMetadata
     gps: GPS
+
+
+class Frame(FrameMetadata):
+    backdown_image_b64: str
+
+
+class MosaicSettings(BaseModel):
     camera_settings: Camera = mx9_camera
     side_crop_pixels: int = 1000
     bottom_crop_pixels: int = 0
+    tile_size_pixels: int = 1024
+    overview_levels: int = 5
+    fused_warp: bool = False
+    compositing_policy: CompositingPolicy = "dominant_alpha"
+    metres_per_pixel: float | None = None
+    min_changed_fraction: float = 0.0
     orthomosaic_metadata: OrthomosaicMetadata | None = None
 
 
+class Payload(Frame, MosaicSettings):
+    pass
+
+
+class BatchPayload(MosaicSettings):
+    frames: list[Frame]
+
+
+class BinaryPayload(FrameMetadata, MosaicSettings):
+    """Payload for a backdown image uploaded as a binary file rather than base64"""
+
+
 def read_image(image_path: str) -> ndarray:
     image = imread(image_path)
     if image is None:
@@ -46,6 +96,11 @@ def read_image(image_path: str) -> ndarray:
     return image
 
 
+def save_image(image: ndarray, image_path: str) -> None:
+    """Encode straight to disk (memory mapped images are read page by page rather than copied)"""
+    Image.fromarray(image).save(image_path)
+
+
 def array_to_bytes(image: ndarray) -> bytes:
     image_temp = Image.fromarray(image)
     buffer = BytesIO()
@@ -64,5 +119,30 @@ def encode_image(image_path: str) -> str:
 
 
 def decode_image(image_b64: str) -> ndarray:
-    image_bytes = BytesIO(b64decode(image_b64))
-    return bytes_to_array(image_bytes=image_bytes)
+    with stage("decode"):
+        image_bytes = BytesIO(b64decode(image_b64))
+        return bytes_to_array(image_bytes=image_bytes)
+
+
+def decode_image_buffer(
+    image_buffer: bytes, image_shape: tuple[int, ...] | None = None
+) -> ndarray:
+    """Decode an encoded (e.g. jpeg/png straight from the camera) image, or view a
+    raw uint8 buffer of the given (height, width, 3) shape, without copying the buffer
+    """
+    buffer = frombuffer(memoryview(image_buffer), dtype="uint8")
+    if image_shape is not None:
+        if len(image_shape) != 3 or image_shape[2] != 3 or min(image_shape) <= 0:
+            raise NullImage(
+                f"The shape of a raw backdown image must be height,width,3, not {','.join(map(str, image_shape))}"
+            )
+        if prod(image_shape) != len(buffer):
+            raise NullImage(
+                f"The uploaded backdown image has {len(buffer)} bytes, not the {prod(image_shape)} of its shape {','.join(map(str, image_shape))}"
+            )
+        return buffer.reshape(image_shape)
+    with stage("decode"):
+        image = imdecode(buffer, IMREAD_COLOR)
+    if image is None:
+        raise NullImage("The uploaded backdown image could not be decoded")
+    return image
@@ -1,5 +1,10 @@
+from typing import Literal
+
 from pydantic import BaseModel
 
+CompositingPolicy = Literal["dominant_alpha", "max_alpha", "first_wins"]
+ImageFormat = Literal["png", "webp", "npy", "npy_zlib"]
+
 
 class GPS(BaseModel):
     x: float
@@ -20,13 +25,48 @@ class ImageMetadata(BaseModel):
     pitch_deg: float
 
 
+class ImageEncoding(BaseModel):
+    """How images are encoded: PNG (compression level 0 to 9), lossless WebP
+    (method 0, fastest, to 6, smallest), raw .npy or zlib compressed .npy"""
+
+    format: ImageFormat = "png"
+    png_compression_level: int = 6
+    webp_method: int = 4
+    zlib_level: int = 1
+
+
 class OrthorectificationMetadata(BaseModel):
     metres_per_pixel: float
+    scale: float = 1.0
 
 
 class OrthomosaicMetadata(BaseModel):
+    """Grid of an orthomosaic, with pixel (0, 0) at `x_m`, `y_m`
+
+    With a `corridor_heading` the grid is in a corridor frame rotated from the
+    projected coordinates (see `orthomosaics.coordinates.corridor_to_metres`)."""
+
     id: int
     x_m: float
     y_m: float
     x_m_per_pixel: float
     y_m_per_pixel: float
+    tile_size_pixels: int | None = None
+    tile_indices: list[tuple[int, int]] = []
+    overview_levels: int = 0
+    corridor_heading: float = 0.0
+
+
+class FrameRecord(BaseModel):
+    """A frame added to an orthomosaic, with what is needed to add it again"""
+
+    id: int
+    gps: GPS
+    backdown_image_metadata: ImageMetadata
+    camera_settings: Camera
+    bottom_crop: int
+    side_crop: int
+    fused_warp: bool = False
+    compositing_policy: CompositingPolicy = "dominant_alpha"
+    metres_per_pixel: float | None = None
+    footprint: list[tuple[float, float]]
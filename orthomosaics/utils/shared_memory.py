@@ -0,0 +1,31 @@
+from multiprocessing.shared_memory import SharedMemory
+from typing import NamedTuple
+
+from numpy import ndarray
+
+
+class SharedArray(NamedTuple):
+    """Picklable reference to an array held in shared memory"""
+
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+def array_to_shared_memory(array: ndarray) -> tuple[SharedMemory, SharedArray]:
+    memory = SharedMemory(create=True, size=max(array.nbytes, 1))
+    ndarray(shape=array.shape, dtype=array.dtype, buffer=memory.buf)[:] = array
+    return memory, SharedArray(
+        name=memory.name, shape=array.shape, dtype=array.dtype.str
+    )
+
+
+def array_from_shared_memory(shared_array: SharedArray) -> ndarray:
+    """Copy an array out of shared memory and release the shared memory block"""
+    memory = SharedMemory(name=shared_array.name)
+    array = ndarray(
+        shape=shared_array.shape, dtype=shared_array.dtype, buffer=memory.buf
+    ).copy()
+    memory.close()
+    memory.unlink()
+    return array
@@ -0,0 +1,319 @@
+from abc import ABC, abstractmethod
+from asyncio import gather, to_thread
+from pathlib import Path
+from typing import Callable
+
+from numpy import ndarray
+from pydantic import TypeAdapter
+
+from orthomosaics.utils.encoding import EXTENSIONS, decode_array, encode_array
+from orthomosaics.utils.metrics import record_bytes, stage
+from orthomosaics.utils.schemas import FrameRecord, ImageEncoding, OrthomosaicMetadata
+
+frame_records = TypeAdapter(list[FrameRecord])
+
+
+class TileStorage(ABC):
+    """Stores each orthomosaic as independently addressable tiles, encoded with `encoding`
+
+    Level 0 holds the full resolution tiles and each overview level `level`
+    holds tiles downsampled 2**level times (see `orthomosaics.tiles.update_overview`).
+    The orthomosaic metadata is stored alongside as json, as are the records
+    of the frames added to it and their backdown images (to re-render tiles).
+    Tiles are only found with the encoding they were written with.
+    """
+
+    encoding: ImageEncoding = ImageEncoding()
+
+    def read_tile(
+        self, image_id: int, index: tuple[int, int], level: int = 0
+    ) -> ndarray | None:
+        tile_bytes = self._read_bytes(
+            name=self._tile_name(image_id=image_id, index=index, level=level)
+        )
+        if tile_bytes is None:
+            return None
+        return decode_array(image_bytes=tile_bytes)
+
+    def read_tiles(
+        self, image_id: int, level: int = 0
+    ) -> dict[tuple[int, int], ndarray]:
+        return {
+            index: self.read_tile(image_id=image_id, index=index, level=level)
+            for index in self.list_tiles(image_id=image_id, level=level)
+        }
+
+    def write_tiles(
+        self, image_id: int, tiles: dict[tuple[int, int], ndarray], level: int = 0
+    ) -> None:
+        for index, tile in tiles.items():
+            self._write_bytes(
+                name=self._tile_name(image_id=image_id, index=index, level=level),
+                data=encode_array(image=tile, encoding=self.encoding),
+            )
+
+    def list_tiles(self, image_id: int, level: int = 0) -> list[tuple[int, int]]:
+        prefix = self._level_prefix(image_id=image_id, level=level)
+        return sorted(
+            self._tile_index(name=name)
+            for name in self._list_names(prefix=prefix)
+            if self._is_tile_name(name=name, prefix=prefix)
+        )
+
+    def read_metadata(self, image_id: int) -> OrthomosaicMetadata | None:
+        metadata_bytes = self._read_bytes(name=self._metadata_name(image_id=image_id))
+        if metadata_bytes is None:
+            return None
+        return OrthomosaicMetadata.model_validate_json(metadata_bytes)
+
+    def write_metadata(self, metadata: OrthomosaicMetadata) -> None:
+        self._write_bytes(
+            name=self._metadata_name(image_id=metadata.id),
+            data=metadata.model_dump_json().encode(),
+        )
+
+    async def read_tile_bytes_async(
+        self, image_id: int, index: tuple[int, int], level: int = 0
+    ) -> bytes | None:
+        """The encoded tile, as stored"""
+        return await self._download(
+            name=self._tile_name(image_id=image_id, index=index, level=level)
+        )
+
+    async def read_tiles_async(
+        self, image_id: int, indices: list[tuple[int, int]], level: int = 0
+    ) -> dict[tuple[int, int], ndarray]:
+        """Fetch (and decode) tiles concurrently, leaving out tiles that do not exist"""
+        tiles_bytes = await gather(
+            *(
+                self.read_tile_bytes_async(image_id=image_id, index=index, level=level)
+                for index in indices
+            )
+        )
+        existing_tiles = [
+            (index, tile_bytes)
+            for index, tile_bytes in zip(indices, tiles_bytes)
+            if tile_bytes is not None
+        ]
+        tiles = await gather(
+            *(
+                to_thread(decode_array, image_bytes=tile_bytes)
+                for _, tile_bytes in existing_tiles
+            )
+        )
+        return {index: tile for (index, _), tile in zip(existing_tiles, tiles)}
+
+    async def write_tiles_async(
+        self, image_id: int, tiles: dict[tuple[int, int], ndarray], level: int = 0
+    ) -> None:
+        """Encode and upload tiles concurrently"""
+        tiles_bytes = await gather(
+            *(
+                to_thread(encode_array, image=tile, encoding=self.encoding)
+                for tile in tiles.values()
+            )
+        )
+        await gather(
+            *(
+                self._upload(
+                    name=self._tile_name(image_id=image_id, index=index, level=level),
+                    data=data,
+                )
+                for index, data in zip(tiles, tiles_bytes)
+            )
+        )
+
+    async def list_tiles_async(
+        self, image_id: int, level: int = 0
+    ) -> list[tuple[int, int]]:
+        return await to_thread(self.list_tiles, image_id=image_id, level=level)
+
+    async def read_metadata_async(self, image_id: int) -> OrthomosaicMetadata | None:
+        metadata_bytes = await self._download(
+            name=self._metadata_name(image_id=image_id)
+        )
+        if metadata_bytes is None:
+            return None
+        return OrthomosaicMetadata.model_validate_json(metadata_bytes)
+
+    async def write_metadata_async(self, metadata: OrthomosaicMetadata) -> None:
+        await self._upload(
+            name=self._metadata_name(image_id=metadata.id),
+            data=metadata.model_dump_json().encode(),
+        )
+
+    async def read_frame_records_async(self, image_id: int) -> list[FrameRecord]:
+        records_bytes = await self._download(
+            name=self._frame_records_name(image_id=image_id)
+        )
+        return (
+            [] if records_bytes is None else frame_records.validate_json(records_bytes)
+        )
+
+    async def write_frame_records_async(
+        self, image_id: int, frames: list[FrameRecord]
+    ) -> None:
+        await self._upload(
+            name=self._frame_records_name(image_id=image_id),
+            data=frame_records.dump_json(frames),
+        )
+
+    async def read_frames_async(
+        self, image_id: int, frame_ids: list[int]
+    ) -> dict[int, ndarray]:
+        """Fetch (and decode) backdown images concurrently, leaving out missing ones"""
+        frames_bytes = await gather(
+            *(
+                self._download(
+                    name=self._frame_name(image_id=image_id, frame_id=frame_id)
+                )
+                for frame_id in frame_ids
+            )
+        )
+        existing_frames = [
+            (frame_id, frame_bytes)
+            for frame_id, frame_bytes in zip(frame_ids, frames_bytes)
+            if frame_bytes is not None
+        ]
+        frames = await gather(
+            *(
+                to_thread(decode_array, image_bytes=frame_bytes)
+                for _, frame_bytes in existing_frames
+            )
+        )
+        return {
+            frame_id: frame for (frame_id, _), frame in zip(existing_frames, frames)
+        }
+
+    async def write_frames_async(
+        self, image_id: int, frames: dict[int, ndarray]
+    ) -> None:
+        frames_bytes = await gather(
+            *(
+                to_thread(encode_array, image=frame, encoding=self.encoding)
+                for frame in frames.values()
+            )
+        )
+        await gather(
+            *(
+                self._upload(
+                    name=self._frame_name(image_id=image_id, frame_id=frame_id),
+                    data=data,
+                )
+                for frame_id, data in zip(frames, frames_bytes)
+            )
+        )
+
+    def tile_loader(
+        self, metadata: OrthomosaicMetadata
+    ) -> Callable[[tuple[int, int]], ndarray | None]:
+        """Lazily fetch only the tiles the orthomosaic metadata says exist"""
+        existing_tiles = set(metadata.tile_indices)
+        return lambda index: (
+            self.read_tile(image_id=metadata.id, index=index)
+            if index in existing_tiles
+            else None
+        )
+
+    @staticmethod
+    def _tile_prefix(image_id: int) -> str:
+        return f"orthomosaic_{image_id}/"
+
+    def _level_prefix(self, image_id: int, level: int) -> str:
+        if level == 0:
+            return self._tile_prefix(image_id=image_id)
+        return f"{self._tile_prefix(image_id=image_id)}level_{level}/"
+
+    def _tile_name(self, image_id: int, index: tuple[int, int], level: int = 0) -> str:
+        row, column = index
+        return f"{self._level_prefix(image_id=image_id, level=level)}tile_{row}_{column}{self._extension}"
+
+    def _metadata_name(self, image_id: int) -> str:
+        return f"{self._tile_prefix(image_id=image_id)}metadata.json"
+
+    def _frame_records_name(self, image_id: int) -> str:
+        return f"{self._tile_prefix(image_id=image_id)}frames.json"
+
+    def _frame_name(self, image_id: int, frame_id: int) -> str:
+        return f"{self._tile_prefix(image_id=image_id)}frames/frame_{frame_id}{self._extension}"
+
+    @property
+    def _extension(self) -> str:
+        return EXTENSIONS[self.encoding.format]
+
+    def _is_tile_name(self, name: str, prefix: str) -> bool:
+        """Whether a name listed under a level prefix is a tile of that level
+        (rather than metadata, frames or a tile of an overview level)"""
+        stem = name.removeprefix(prefix)
+        return (
+            stem.startswith("tile_")
+            and stem.endswith(self._extension)
+            and "/" not in stem
+        )
+
+    def _tile_index(self, name: str) -> tuple[int, int]:
+        _, row, column = (
+            name.rsplit("/", 1)[-1].removesuffix(self._extension).split("_")
+        )
+        return int(row), int(column)
+
+    @abstractmethod
+    def location(self, image_id: int) -> str:
+        pass
+
+    @abstractmethod
+    def _read_bytes(self, name: str) -> bytes | None:
+        pass
+
+    @abstractmethod
+    def _write_bytes(self, name: str, data: bytes) -> None:
+        pass
+
+    @abstractmethod
+    def _list_names(self, prefix: str) -> list[str]:
+        pass
+
+    async def _download(self, name: str) -> bytes | None:
+        with stage("download"):
+            data = await self._read_bytes_async(name=name)
+        if data is not None:
+            record_bytes(direction="download", nbytes=len(data))
+        return data
+
+    async def _upload(self, name: str, data: bytes) -> None:
+        with stage("upload"):
+            await self._write_bytes_async(name=name, data=data)
+        record_bytes(direction="upload", nbytes=len(data))
+
+    async def _read_bytes_async(self, name: str) -> bytes | None:
+        return await to_thread(self._read_bytes, name=name)
+
+    async def _write_bytes_async(self, name: str, data: bytes) -> None:
+        await to_thread(self._write_bytes, name=name, data=data)
+
+
+class LocalTileStorage(TileStorage):
+    def __init__(
+        self, directory: str, encoding: ImageEncoding = ImageEncoding()
+    ) -> None:
+        self.directory = Path(directory)
+        self.encoding = encoding
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def location(self, image_id: int) -> str:
+        return str(self.directory / self._tile_prefix(image_id=image_id))
+
+    def _read_bytes(self, name: str) -> bytes | None:
+        path = self.directory / name
+        return path.read_bytes() if path.exists() else None
+
+    def _write_bytes(self, name: str, data: bytes) -> None:
+        path = self.directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    def _list_names(self, prefix: str) -> list[str]:
+        return [
+            path.relative_to(self.directory).as_posix()
+            for path in (self.directory / prefix).glob(f"*{self._extension}")
+        ]
@@ -0,0 +1,40 @@
+from asyncio import get_running_loop
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import copy_context
+from functools import partial
+from typing import AsyncIterator, Callable, TypeVar
+
+Result = TypeVar("Result")
+
+
+class WorkerPoolFull(Exception):
+    pass
+
+
+class WorkerPool:
+    """Bounded pool of threads for the CPU heavy (numpy/OpenCV, which release the GIL)
+    work of the server, with a limit on the number of requests admitted at once"""
+
+    def __init__(self, workers: int, max_requests: int) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_requests = max_requests
+        self.requests = 0
+
+    @asynccontextmanager
+    async def admission(self) -> AsyncIterator[None]:
+        if self.requests >= self.max_requests:
+            raise WorkerPoolFull(
+                f"{self.requests} requests are already being processed, try again later"
+            )
+        self.requests += 1
+        try:
+            yield
+        finally:
+            self.requests -= 1
+
+    async def run(self, function: Callable[..., Result], **kwargs) -> Result:
+        # in the context of the caller, as asyncio.to_thread does
+        return await get_running_loop().run_in_executor(
+            self.executor, partial(copy_context().run, function, **kwargs)
+        )
@@ -0,0 +1,18 @@
+from importlib import import_module
+from os import environ
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """The app, with tiles in a temporary directory instead of Azure"""
+    environ["ORTHOMOSAICS_TILE_DIRECTORY"] = str(tmp_path_factory.mktemp("tiles"))
+    return import_module("app")
+
+
+@pytest.fixture
+def client(app_module):
+    with TestClient(app_module.app) as client:
+        yield client
@@ -0,0 +1,39 @@
+from argparse import Namespace
+
+from pytest import raises
+
+from orthomosaics.cli import build_orthomosaic
+
+COLUMNS = "image_path,roll[deg],pitch[deg],heading[deg],projectedX[m],projectedY[m]\n"
+
+
+def arguments(csv_path: str, canvas_directory: str | None = None) -> Namespace:
+    return Namespace(
+        csv_path=csv_path,
+        canvas_directory=canvas_directory,
+        tile_size=256,
+        corridor=False,
+        prefetch=1,
+        metres_per_pixel=None,
+    )
+
+
+def test_an_empty_survey_exits_with_a_message(tmp_path):
+    csv_path = tmp_path / "survey.csv"
+    csv_path.write_text(COLUMNS)
+    with raises(SystemExit, match="has no frames"):
+        build_orthomosaic(arguments=arguments(csv_path=str(csv_path)))
+
+
+def test_a_canvas_directory_holding_tiles_is_refused(tmp_path):
+    csv_path = tmp_path / "survey.csv"
+    csv_path.write_text(COLUMNS + "frame.jpg,-1.0,-47.0,30.0,572731.0,273978.0\n")
+    canvas_directory = tmp_path / "canvas"
+    canvas_directory.mkdir()
+    (canvas_directory / "tile_0_0.npy").write_bytes(b"")
+    with raises(SystemExit, match="is not empty"):
+        build_orthomosaic(
+            arguments=arguments(
+                csv_path=str(csv_path), canvas_directory=str(canvas_directory)
+            )
+        )
@@ -0,0 +1,89 @@
+from numpy import array
+from pyproj import Transformer
+from pytest import approx
+from shapely.geometry import Point
+
+from orthomosaics.coordinates import (
+    coordinates_to_metres,
+    gps_coordinates,
+    metres_to_pixels,
+)
+from orthomosaics.mosaics import (
+    convert_coordinates_to_pixels,
+    convert_gps_degrees_to_metres,
+    convert_m_to_pixels,
+)
+from orthomosaics.utils.schemas import GPS, OrthorectificationMetadata
+
+GPS_DATA = [
+    GPS(x=572_731.0, y=273_978.0, heading=30.0),
+    GPS(x=572_731.37, y=273_977.25, heading=31.0),
+    GPS(x=572_729.994, y=273_980.006, heading=29.0),
+]
+
+
+def test_coordinates_without_a_crs_pass_through_like_the_geodataframe():
+    points = [Point((gps.x, gps.y)) for gps in GPS_DATA]
+    assert convert_gps_degrees_to_metres(coordinates=points) == [
+        (point.x, point.y) for point in points
+    ]
+    assert coordinates_to_metres(
+        coordinates=gps_coordinates(gps_data=GPS_DATA)
+    ).tolist() == [[gps.x, gps.y] for gps in GPS_DATA]
+
+
+def test_reprojection_matches_transforming_each_point():
+    coordinates = [(-1.5, 52.1), (-1.499, 52.1004), (0.25, 51.5)]
+    transformer = Transformer.from_crs("EPSG:4326", "EPSG:27700", always_xy=True)
+    projected = coordinates_to_metres(
+        coordinates=array(coordinates),
+        source_crs="EPSG:4326",
+        target_crs="EPSG:27700",
+    )
+    for (x, y), (x_m, y_m) in zip(coordinates, projected.tolist()):
+        assert (x_m, y_m) == approx(transformer.transform(x, y), abs=1e-6)
+
+
+def test_pixels_are_floored_like_each_point_was():
+    # either side of the origin, and on and just off pixel edges
+    origin_m = (572_730.0, 273_978.0)
+    m_per_pixel = (0.01, 0.02)
+    coordinates_m = [
+        (572_731.0, 273_978.0),
+        (572_729.995, 273_977.97),
+        (572_730.0, 273_977.99),
+        (572_729.0, 273_979.01),
+        (572_730.0049, 273_977.9999),
+    ]
+    assert metres_to_pixels(
+        coordinates_m=coordinates_m, origin_m=origin_m, m_per_pixel=m_per_pixel
+    ).tolist() == [
+        [
+            convert_m_to_pixels(m=x_m - origin_m[0], m_per_pixel=m_per_pixel[0]),
+            convert_m_to_pixels(m=y_m - origin_m[1], m_per_pixel=m_per_pixel[1]),
+        ]
+        for x_m, y_m in coordinates_m
+    ]
+    assert metres_to_pixels(
+        coordinates_m=[(572_729.995, 273_977.97)],
+        origin_m=origin_m,
+        m_per_pixel=m_per_pixel,
+    ).tolist() == [[-1, -2]]
+
+
+def test_frame_pixels_are_truncated_like_each_point_was():
+    coordinates = [(1.005, 2.0), (-1.005, -0.019), (-0.004, 0.0), (3.3, -7.77)]
+    metadata = [
+        OrthorectificationMetadata(metres_per_pixel=metres_per_pixel)
+        for metres_per_pixel in (0.01, 0.01, 0.02, 0.5)
+    ]
+    assert convert_coordinates_to_pixels(
+        coordinates=coordinates, metadata=metadata
+    ) == [
+        (int(x / meta.metres_per_pixel), int(y / meta.metres_per_pixel))
+        for (x, y), meta in zip(coordinates, metadata)
+    ]
+    # towards zero rather than down, as int() did
+    assert convert_coordinates_to_pixels(
+        coordinates=[(-1.005, -0.019)], metadata=metadata[:1]
+    ) == [(-100, -1)]
@@ -0,0 +1,77 @@
+from numpy import allclose, zeros
+from pytest import approx
+
+from orthomosaics.coordinates import corridor_to_metres, metres_to_corridor
+from orthomosaics.corridors import corridor_segments, dominant_heading
+from orthomosaics.tiles import TiledCanvas, tiled_orthomosaic_to_array
+from orthomosaics.utils.schemas import GPS, OrthomosaicMetadata
+
+CORRIDOR_METADATA = OrthomosaicMetadata(
+    id=7,
+    x_m=211_634.39,
+    y_m=598_516.27,
+    x_m_per_pixel=0.01,
+    y_m_per_pixel=0.01,
+    tile_size_pixels=4,
+    corridor_heading=45.0,
+)
+
+
+def test_corridor_coordinates_round_trip():
+    coordinates_m = [(572_700.0, 273_900.0), (572_731.5, 273_978.25)]
+    assert allclose(
+        corridor_to_metres(
+            coordinates=metres_to_corridor(
+                coordinates_m=coordinates_m, corridor_heading=45.0
+            ),
+            corridor_heading=45.0,
+        ),
+        coordinates_m,
+    )
+
+
+def test_tiled_orthomosaic_to_array_keeps_corridor_heading():
+    canvas = TiledCanvas(tile_size=4)
+    canvas.add_image(image=zeros((2, 2, 4), dtype="uint8") + 255, x=5, y=6)
+    _, orthomosaic_metadata = tiled_orthomosaic_to_array(
+        canvas=canvas, orthomosaic_metadata=CORRIDOR_METADATA
+    )
+    assert orthomosaic_metadata.corridor_heading == 45.0
+    assert orthomosaic_metadata.x_m == CORRIDOR_METADATA.x_m + 4 * 0.01
+    assert orthomosaic_metadata.y_m == CORRIDOR_METADATA.y_m + 4 * 0.01
+    restored = OrthomosaicMetadata.model_validate_json(
+        orthomosaic_metadata.model_dump_json()
+    )
+    assert restored == orthomosaic_metadata
+
+
+def test_projected_queries_on_corridor_orthomosaic_are_refused(app_module, client):
+    app_module.storage.write_metadata(metadata=CORRIDOR_METADATA)
+    box = dict(x_min_m=0, y_min_m=0, x_max_m=1, y_max_m=1)
+    for url, params in (
+        ("/orthomosaic/region", box),
+        ("/orthomosaic/frames/box", box),
+        ("/orthomosaic/frames", dict(x_m=0, y_m=0)),
+    ):
+        response = client.get(url=url, params=dict(orthomosaic_id=7, **params))
+        assert response.status_code == 400
+        assert "corridor" in response.json()["detail"]
+
+
+def test_dominant_heading_straddling_north():
+    assert dominant_heading([350, 10]) == 0.0
+    assert dominant_heading([359, 1, 179, 181]) == 0.0
+    assert dominant_heading([355, 5, 175, 185]) == 0.0
+    assert dominant_heading([40, 50, 225]) == 45.0
+
+
+def test_corridor_segments_straddling_north():
+    segments = corridor_segments(
+        gps_data=[
+            GPS(x=0, y=index, heading=heading)
+            for index, heading in enumerate([350, 10, 355, 90, 95])
+        ]
+    )
+    assert [(segment.start, segment.stop) for segment in segments] == [(0, 3), (3, 5)]
+    assert segments[0].heading == approx(178.3, abs=0.1)
+    assert segments[1].heading == approx(92.5)
@@ -0,0 +1,69 @@
+from numpy import full
+
+from orthomosaics.coverage import (
+    CoverageMap,
+    FrameProjection,
+    changed_fraction,
+    redundant_frames,
+)
+
+TILE_SIZE = 8
+CELL_SIZE = 2
+
+
+def covered(*indices: tuple[int, int]) -> CoverageMap:
+    """Coverage of opaque tiles, 4 by 4 cells each"""
+    coverage = CoverageMap(tile_size=TILE_SIZE, cell_size=CELL_SIZE)
+    coverage.update(
+        tiles={
+            index: full((TILE_SIZE, TILE_SIZE, 4), 255, "uint8") for index in indices
+        }
+    )
+    return coverage
+
+
+def projection(row: int, column: int, rows: int, columns: int) -> FrameProjection:
+    return FrameProjection(
+        row=row, column=column, alpha=full((rows, columns), 200, "uint8")
+    )
+
+
+def is_redundant(
+    coverage: CoverageMap, projections: list[FrameProjection], fraction: float
+) -> list[bool]:
+    return redundant_frames(
+        coverage=coverage,
+        projections=projections,
+        compositing_policies=["dominant_alpha"] * len(projections),
+        min_changed_fractions=[fraction] * len(projections),
+    )
+
+
+def test_a_frame_inside_the_coverage_is_skipped():
+    coverage = covered((0, 0), (0, 1))
+    inside = projection(row=1, column=2, rows=2, columns=4)
+    assert changed_fraction(coverage=coverage, projection=inside) == 0.0
+    assert is_redundant(coverage=coverage, projections=[inside], fraction=0.05) == [
+        True
+    ]
+
+
+def test_a_frame_adding_area_is_kept_and_covers_for_the_next_frames():
+    coverage = covered((0, 0))
+    # half of its cells are in the uncovered tile (0, 1)
+    frame = projection(row=0, column=2, rows=4, columns=4)
+    assert changed_fraction(coverage=coverage, projection=frame) == 0.5
+    assert is_redundant(
+        coverage=coverage, projections=[frame, frame], fraction=0.05
+    ) == [False, True]
+    # the coverage itself is left as it was
+    assert sorted(coverage.cells) == [(0, 0)]
+
+
+def test_the_changed_fraction_threshold_is_respected():
+    coverage = covered((0, 0))
+    frame = projection(row=0, column=2, rows=4, columns=4)
+    assert is_redundant(coverage=coverage, projections=[frame], fraction=0.4) == [False]
+    assert is_redundant(coverage=coverage, projections=[frame], fraction=0.5) == [False]
+    assert is_redundant(coverage=coverage, projections=[frame], fraction=0.6) == [True]
+    assert is_redundant(coverage=coverage, projections=[frame], fraction=0.0) == [False]
@@ -0,0 +1,142 @@
+from numpy import array_equal, full
+
+from orthomosaics.footprints import (
+    FrameIndex,
+    footprint_tile_indices,
+    frame_footprint,
+    recomposite_tiles,
+    tiles_outline,
+)
+from orthomosaics.mosaics import orthorectify_and_rotate
+from orthomosaics.tiles import add_rotated_image_to_tiled_orthomosaic
+from orthomosaics.utils.rest_api import mx9_camera
+from orthomosaics.utils.schemas import GPS, FrameRecord, ImageMetadata
+
+TILE_SIZE = 32
+METRES_PER_PIXEL = 0.01
+
+
+def frame_record(frame_id: int, footprint: list[tuple[float, float]]) -> FrameRecord:
+    return FrameRecord(
+        id=frame_id,
+        gps=GPS(x=0.0, y=0.0, heading=0.0),
+        backdown_image_metadata=ImageMetadata(roll_deg=0.0, pitch_deg=-47.0),
+        camera_settings=mx9_camera,
+        bottom_crop=0,
+        side_crop=0,
+        footprint=footprint,
+    )
+
+
+def square(x_m: float, y_m: float, size_m: float = 2.0) -> list[tuple[float, float]]:
+    return [
+        (x_m, y_m),
+        (x_m + size_m, y_m),
+        (x_m + size_m, y_m + size_m),
+        (x_m, y_m + size_m),
+    ]
+
+
+def ids(records: list[FrameRecord]) -> list[int]:
+    return [record.id for record in records]
+
+
+def test_point_and_box_queries_follow_added_replaced_and_removed_frames():
+    frames = FrameIndex(
+        frames=[
+            frame_record(frame_id=0, footprint=square(x_m=0.0, y_m=0.0)),
+            frame_record(frame_id=1, footprint=square(x_m=1.0, y_m=1.0)),
+            frame_record(frame_id=2, footprint=square(x_m=5.0, y_m=5.0)),
+        ]
+    )
+    assert ids(frames.covering_point(x_m=1.5, y_m=1.5)) == [0, 1]
+    assert ids(frames.covering_point(x_m=4.0, y_m=4.0)) == []
+    assert ids(frames.overlapping_box(2.5, 2.5, 5.5, 5.5)) == [1, 2]
+    frames.add(frame=frame_record(frame_id=0, footprint=square(x_m=4.0, y_m=4.0)))
+    assert ids(frames.covering_point(x_m=4.5, y_m=4.5)) == [0]
+    assert ids(frames.overlapping_box(2.5, 2.5, 5.5, 5.5)) == [0, 1, 2]
+    frames.remove(frame_id=1)
+    assert ids(frames.overlapping_box(2.5, 2.5, 5.5, 5.5)) == [0, 2]
+    assert frames.next_id() == 3
+
+
+def prepared_frames(frames: list[tuple[GPS, ImageMetadata]]) -> list:
+    return [
+        orthorectify_and_rotate(
+            backdown_image=full((150, 200, 3), 50 + 60 * index, dtype="uint8"),
+            gps_data=gps_data,
+            backdown_image_metadata=backdown_image_metadata,
+            camera_settings=mx9_camera,
+            bottom_crop=0,
+            side_crop=2,
+            metres_per_pixel=METRES_PER_PIXEL,
+        )
+        for index, (gps_data, backdown_image_metadata) in enumerate(frames)
+    ]
+
+
+def tiled_build(prepared: list) -> tuple:
+    canvas = orthomosaic_metadata = None
+    for rotated_orthorectified_image, rotated_orthorectified_image_metadata in prepared:
+        canvas, orthomosaic_metadata = add_rotated_image_to_tiled_orthomosaic(
+            canvas=canvas,
+            orthomosaic_metadata=orthomosaic_metadata,
+            rotated_orthorectified_image=rotated_orthorectified_image,
+            rotated_orthorectified_image_metadata=rotated_orthorectified_image_metadata,
+            tile_size=TILE_SIZE,
+        )
+    return canvas, orthomosaic_metadata
+
+
+def test_recompositing_without_a_frame_matches_building_without_it():
+    frames = [
+        (
+            GPS(x=572_731.0 + 0.3 * index, y=273_978.0 + 0.4 * index, heading=30.0),
+            ImageMetadata(roll_deg=-1.0, pitch_deg=-47.0 + index),
+        )
+        for index in range(3)
+    ]
+    prepared = prepared_frames(frames=frames)
+    canvas, orthomosaic_metadata = tiled_build(prepared=prepared)
+    frame_index = FrameIndex(
+        frames=[
+            frame_record(
+                frame_id=frame_id,
+                footprint=frame_footprint(
+                    orthomosaic_metadata=orthomosaic_metadata,
+                    rotated_orthorectified_image=rotated_orthorectified_image,
+                    rotated_orthorectified_image_metadata=rotated_orthorectified_image_metadata,
+                ),
+            )
+            for frame_id, (
+                rotated_orthorectified_image,
+                rotated_orthorectified_image_metadata,
+            ) in enumerate(prepared)
+        ]
+    )
+    indices = footprint_tile_indices(
+        orthomosaic_metadata=orthomosaic_metadata,
+        footprint=frame_index.remove(frame_id=1).footprint,
+    )
+    overlapping_frames = frame_index.overlapping(
+        geometry=tiles_outline(
+            orthomosaic_metadata=orthomosaic_metadata, indices=indices
+        )
+    )
+    tiles = recomposite_tiles(
+        orthomosaic_metadata=orthomosaic_metadata,
+        indices=indices,
+        prepared_frames=[
+            (*prepared[frame.id], "dominant_alpha") for frame in overlapping_frames
+        ],
+    )
+    expected_canvas, _ = tiled_build(prepared=[prepared[0], prepared[2]])
+    assert any(
+        not array_equal(canvas.tiles[index], tile) for index, tile in tiles.items()
+    )
+    canvas.tiles.update(tiles)
+    assert sorted(
+        index for index, tile in canvas.tiles.items() if tile.any()
+    ) == sorted(expected_canvas.tiles)
+    for index, tile in expected_canvas.tiles.items():
+        assert array_equal(canvas.tiles[index], tile)
@@ -0,0 +1,93 @@
+from asyncio import gather, run, sleep
+
+import pytest
+
+from orthomosaics.utils.ingestion import IngestionQueue, IngestionQueueFull
+from orthomosaics.utils.rest_api import Results
+
+
+class RecordingFlush:
+    """Flush that records its calls and how many run at once for each orthomosaic"""
+
+    def __init__(self) -> None:
+        self.calls: list[tuple[int, list[str]]] = []
+        self.running: dict[int, int] = {}
+        self.max_running: dict[int, int] = {}
+
+    async def __call__(self, orthomosaic_id: int, updates: list[str]) -> Results:
+        self.running[orthomosaic_id] = self.running.get(orthomosaic_id, 0) + 1
+        self.max_running[orthomosaic_id] = max(
+            self.max_running.get(orthomosaic_id, 0), self.running[orthomosaic_id]
+        )
+        await sleep(0.01)
+        self.calls.append((orthomosaic_id, updates))
+        self.running[orthomosaic_id] -= 1
+        return Results(message=f"{len(updates)} updates", orthomosaic_metadata=None)
+
+
+def test_updates_to_one_orthomosaic_never_run_concurrently():
+    flush = RecordingFlush()
+
+    async def submit_all() -> None:
+        queue = IngestionQueue(flush=flush, max_queued_updates=100)
+        jobs = []
+        for round in range(3):
+            jobs += [queue.submit(orthomosaic_id=1, update=f"{round}a")]
+            jobs += [queue.submit(orthomosaic_id=2, update=f"{round}b")]
+            await sleep(0.004)
+        await gather(*(queue.wait(job_id=job.id) for job in jobs))
+
+    run(submit_all())
+    assert flush.max_running == {1: 1, 2: 1}
+    assert [
+        update for _, updates in flush.calls for update in updates if "a" in update
+    ] == [
+        "0a",
+        "1a",
+        "2a",
+    ]
+
+
+def test_queued_updates_are_coalesced_and_all_their_jobs_finish():
+    flush = RecordingFlush()
+
+    async def submit_all() -> list:
+        queue = IngestionQueue(flush=flush, max_queued_updates=100)
+        first = queue.submit(orthomosaic_id=1, update="first")
+        await sleep(0)
+        queued = [
+            queue.submit(orthomosaic_id=1, update=update)
+            for update in ("second", "third", "fourth")
+        ]
+        return await gather(*(queue.wait(job_id=job.id) for job in [first, *queued]))
+
+    jobs = run(submit_all())
+    assert flush.calls == [(1, ["first"]), (1, ["second", "third", "fourth"])]
+    assert [job.status for job in jobs] == ["done"] * 4
+    assert [job.results.message for job in jobs] == ["1 updates"] + ["3 updates"] * 3
+
+
+def test_failed_flush_fails_every_coalesced_job():
+    async def failing_flush(orthomosaic_id: int, updates: list[str]) -> Results:
+        raise ValueError(f"{len(updates)} updates failed")
+
+    async def submit_all() -> list:
+        queue = IngestionQueue(flush=failing_flush, max_queued_updates=100)
+        jobs = [queue.submit(orthomosaic_id=1, update=update) for update in "ab"]
+        return await gather(*(queue.wait(job_id=job.id) for job in jobs))
+
+    assert [(job.status, job.detail) for job in run(submit_all())] == [
+        ("failed", "2 updates failed")
+    ] * 2
+
+
+def test_queue_full_at_the_limit():
+    async def submit_all() -> None:
+        queue = IngestionQueue(flush=RecordingFlush(), max_queued_updates=2)
+        jobs = [queue.submit(orthomosaic_id=index, update="a") for index in range(2)]
+        with pytest.raises(IngestionQueueFull):
+            queue.submit(orthomosaic_id=3, update="a")
+        await gather(*(queue.wait(job_id=job.id) for job in jobs))
+        queue.submit(orthomosaic_id=3, update="a")
+
+    run(submit_all())
@@ -0,0 +1,82 @@
+from asyncio import run
+
+from numpy import array_equal, full
+
+from orthomosaics.coverage import CoverageMap
+from orthomosaics.tiles import TiledCanvas
+from orthomosaics.utils.encoding import decode_array
+from orthomosaics.utils.mosaic_cache import CachedMosaic, MosaicCache
+from orthomosaics.utils.schemas import OrthomosaicMetadata
+from orthomosaics.utils.tile_storage import LocalTileStorage
+
+TILE_SIZE = 8
+TILE_BYTES = TILE_SIZE * TILE_SIZE * 4
+
+
+def orthomosaic_metadata(orthomosaic_id: int) -> OrthomosaicMetadata:
+    return OrthomosaicMetadata(
+        id=orthomosaic_id,
+        x_m=0.0,
+        y_m=0.0,
+        x_m_per_pixel=0.01,
+        y_m_per_pixel=0.01,
+        tile_size_pixels=TILE_SIZE,
+    )
+
+
+def test_single_mosaic_stays_under_budget_and_reloads_dropped_tiles(tmp_path):
+    cache = MosaicCache(
+        storage=LocalTileStorage(directory=str(tmp_path)),
+        max_bytes=3 * TILE_BYTES,
+    )
+    mosaic = CachedMosaic(
+        canvas=TiledCanvas(tile_size=TILE_SIZE),
+        metadata=orthomosaic_metadata(orthomosaic_id=1),
+        coverage=CoverageMap(tile_size=TILE_SIZE, cell_size=2),
+    )
+    images = {}
+    for column in range(6):
+        images[0, column] = full((TILE_SIZE, TILE_SIZE, 4), column + 1, dtype="uint8")
+        mosaic.canvas.add_image(image=images[0, column], x=column * TILE_SIZE, y=0)
+        mosaic.metadata = mosaic.metadata.model_copy(
+            update=dict(tile_indices=sorted(images))
+        )
+        run(cache.put(orthomosaic_id=1, mosaic=mosaic))
+        assert cache.nbytes() <= cache.max_bytes
+    assert cache.mosaics[1] is mosaic
+    assert cache.statistics()["dropped_tiles"] == 3
+    assert sorted(mosaic.canvas.tiles) == [(0, 3), (0, 4), (0, 5)]
+    run(cache.load_tiles(orthomosaic_id=1, mosaic=mosaic, indices=[(0, 0), (0, 4)]))
+    assert sorted(mosaic.canvas.tiles) == [(0, 0), (0, 3), (0, 4), (0, 5)]
+    run(cache.load_tiles(orthomosaic_id=1, mosaic=mosaic, indices=images))
+    for index, image in images.items():
+        assert array_equal(mosaic.canvas.tiles[index], image)
+
+
+def test_tiles_and_regions_include_tiles_waiting_to_be_written(app_module, client):
+    mosaic = app_module.cached_mosaic(
+        orthomosaic_metadata=orthomosaic_metadata(orthomosaic_id=11), frames=[]
+    )
+    image = full((TILE_SIZE, 2 * TILE_SIZE, 4), 200, dtype="uint8")
+    mosaic.canvas.add_image(image=image, x=0, y=0)
+    mosaic.metadata = mosaic.metadata.model_copy(
+        update=dict(tile_indices=sorted(mosaic.canvas.tiles))
+    )
+    run(app_module.mosaic_cache.put(orthomosaic_id=11, mosaic=mosaic))
+    assert mosaic.canvas.dirty
+    tile = client.get(url="/orthomosaic/tiles/11/0/1/0")
+    assert tile.status_code == 200
+    assert array_equal(decode_array(image_bytes=tile.content), image[:, TILE_SIZE:])
+    region = client.get(
+        url="/orthomosaic/region",
+        params=dict(
+            orthomosaic_id=11,
+            x_min_m=0.0,
+            y_min_m=0.0,
+            x_max_m=0.16,
+            y_max_m=0.08,
+            format="npy",
+        ),
+    )
+    assert region.status_code == 200
+    assert array_equal(decode_array(image_bytes=region.content), image)
@@ -0,0 +1,353 @@
+from base64 import b64encode
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+from numpy import array, array_equal, broadcast_arrays, full, ogrid, stack
+from numpy.random import default_rng
+
+from orthomosaics.coverage import project_frame
+from orthomosaics.mosaics import (
+    MosaicSession,
+    add_batch_to_orthomosaic,
+    add_to_orthomosaic,
+    alpha_channel,
+    frame_preparation_pool,
+    orthorectify_and_rotate,
+    orthorectify_and_rotate_all,
+    scaled_crop,
+    update_roi,
+)
+from orthomosaics.utils.rest_api import array_to_bytes, mx9_camera
+from orthomosaics.utils.schemas import GPS, ImageMetadata, OrthomosaicMetadata
+
+GPS_DATA = GPS(x=572_731.0, y=273_978.0, heading=30.0)
+IMAGE_METADATA = ImageMetadata(roll_deg=-1.0, pitch_deg=-47.0)
+
+
+def pixels(*pixels: tuple[int, int, int, int]):
+    """A one row RGBA image"""
+    return array([pixels], dtype="uint8")
+
+
+# old, equal alpha, newer more opaque, new transparent, old transparent
+OLD = pixels((1, 1, 1, 200), (2, 2, 2, 100), (3, 3, 3, 50), (4, 4, 4, 90), (0, 0, 0, 0))
+NEW = pixels((9, 9, 9, 100), (8, 8, 8, 100), (7, 7, 7, 60), (6, 6, 6, 0), (5, 5, 5, 1))
+
+
+def composited(policy: str):
+    tile = OLD.copy()
+    update_roi(tile=tile, x=0, y=0, image=NEW, policy=policy)
+    return tile
+
+
+def test_dominant_alpha_keeps_the_old_pixel_on_ties():
+    assert array_equal(
+        composited(policy="dominant_alpha"),
+        pixels(
+            (1, 1, 1, 200), (2, 2, 2, 100), (7, 7, 7, 60), (4, 4, 4, 90), (5, 5, 5, 1)
+        ),
+    )
+
+
+def test_dominant_alpha_matches_the_sum_of_products_kernel():
+    random = default_rng(seed=0)
+    tile, image = random.integers(0, 256, size=(2, 16, 16, 4), dtype="uint8")
+    image[:, :, 3] = (image[:, :, 3] // 64) * 64
+    tile[:, :, 3] = (tile[:, :, 3] // 64) * 64
+    newer = (image[:, :, 3] > tile[:, :, 3])[:, :, None]
+    expected = tile * ~newer + image * newer
+    update_roi(tile=tile, x=0, y=0, image=image)
+    assert array_equal(tile, expected)
+
+
+def test_max_alpha_gives_ties_to_the_newer_pixel():
+    assert array_equal(
+        composited(policy="max_alpha"),
+        pixels(
+            (1, 1, 1, 200), (8, 8, 8, 100), (7, 7, 7, 60), (4, 4, 4, 90), (5, 5, 5, 1)
+        ),
+    )
+
+
+def test_first_wins_only_fills_transparent_pixels():
+    assert array_equal(
+        composited(policy="first_wins"),
+        pixels(
+            (1, 1, 1, 200), (2, 2, 2, 100), (3, 3, 3, 50), (4, 4, 4, 90), (5, 5, 5, 1)
+        ),
+    )
+
+
+def test_update_roi_writes_in_place_at_an_offset():
+    tile = full((3, 4, 4), 0, dtype="uint8")
+    update_roi(tile=tile, x=2, y=1, image=NEW[:, :2])
+    assert array_equal(tile[1, 2:], NEW[0, :2])
+    tile[1, 2:] = 0
+    assert not tile.any()
+
+
+def test_scaled_crop_keeps_small_crops():
+    assert scaled_crop(crop=2, scale=0.03) == 1
+    assert scaled_crop(crop=0, scale=0.03) == 0
+    assert scaled_crop(crop=1000, scale=0.5) == 500
+
+
+def test_alpha_channel_without_side_crop_is_not_blank():
+    alpha = alpha_channel(image_height=8, image_width=8, bottom_crop=0, side_crop=0)
+    assert alpha[:, 1:-1].all()
+
+
+def test_small_crops_at_a_coarse_target_resolution_stay_opaque():
+    backdown_image = full((300, 400, 3), 128, dtype="uint8")
+    for fused_warp in (False, True):
+        rotated_orthorectified_image, _ = orthorectify_and_rotate(
+            backdown_image=backdown_image,
+            gps_data=GPS_DATA,
+            backdown_image_metadata=IMAGE_METADATA,
+            camera_settings=mx9_camera,
+            bottom_crop=0,
+            side_crop=2,
+            fused_warp=fused_warp,
+            metres_per_pixel=0.05,
+        )
+        assert (rotated_orthorectified_image[:, :, 3] > 0).mean() > 0.1
+    projection = project_frame(
+        orthomosaic_metadata=OrthomosaicMetadata(
+            id=1,
+            x_m=572_730.0,
+            y_m=273_977.0,
+            x_m_per_pixel=0.05,
+            y_m_per_pixel=0.05,
+        ),
+        image_width=400,
+        image_height=300,
+        gps_data=GPS_DATA,
+        image_metadata=IMAGE_METADATA,
+        camera_settings=mx9_camera,
+        bottom_crop=0,
+        side_crop=2,
+        cell_size=4,
+        metres_per_pixel=0.05,
+    )
+    assert projection.alpha.any()
+
+
+def prepare_frames(
+    backdown_images: list, workers: int, pool: ProcessPoolExecutor | None = None
+) -> list:
+    return list(
+        orthorectify_and_rotate_all(
+            backdown_images=backdown_images,
+            gps_data=[GPS_DATA] * len(backdown_images),
+            backdown_images_metadata=[IMAGE_METADATA] * len(backdown_images),
+            camera_settings=mx9_camera,
+            bottom_crop=0,
+            side_crop=2,
+            workers=workers,
+            metres_per_pixel=0.05,
+            pool=pool,
+        )
+    )
+
+
+def test_frames_prepared_in_a_given_pool_match_and_leave_it_running():
+    backdown_images = [full((300, 400, 3), value, dtype="uint8") for value in (64, 192)]
+    expected = prepare_frames(backdown_images=backdown_images, workers=1)
+    with frame_preparation_pool(workers=2, start_method="spawn") as pool:
+        for _ in range(2):
+            prepared = prepare_frames(
+                backdown_images=backdown_images, workers=2, pool=pool
+            )
+            for (image, metadata), (expected_image, expected_metadata) in zip(
+                prepared, expected, strict=True
+            ):
+                assert array_equal(image, expected_image)
+                assert metadata.model_dump(
+                    exclude={"id"}
+                ) == expected_metadata.model_dump(exclude={"id"})
+
+
+def test_lifespan_starts_and_shuts_down_one_preparation_pool(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "FRAME_PREPARATION_WORKERS", 2)
+    with TestClient(app_module.app):
+        pool = app_module.preparation_pool
+        assert isinstance(pool, ProcessPoolExecutor)
+    assert app_module.preparation_pool is None
+    with pytest.raises(RuntimeError):
+        pool.submit(int)
+
+
+def test_frames_at_mismatched_resolutions_are_warped_onto_the_orthomosaic_grid():
+    backdown_image = full((300, 400, 3), 128, dtype="uint8")
+    second_gps_data = GPS(x=572_732.0, y=273_979.0, heading=40.0)
+    orthomosaic_image, orthomosaic_metadata = add_to_orthomosaic(
+        orthomosaic_image=None,
+        orthomosaic_metadata=None,
+        backdown_image=backdown_image,
+        gps_data=GPS_DATA,
+        backdown_image_metadata=IMAGE_METADATA,
+        camera_settings=mx9_camera,
+        bottom_crop=0,
+        side_crop=2,
+        metres_per_pixel=0.05,
+    )
+    added = [
+        add_to_orthomosaic(
+            orthomosaic_image=orthomosaic_image,
+            orthomosaic_metadata=orthomosaic_metadata,
+            backdown_image=backdown_image,
+            gps_data=second_gps_data,
+            backdown_image_metadata=IMAGE_METADATA,
+            camera_settings=mx9_camera,
+            bottom_crop=0,
+            side_crop=2,
+            metres_per_pixel=metres_per_pixel,
+        )
+        for metres_per_pixel in (None, 0.05)
+    ]
+    (image, metadata), (expected_image, expected_metadata) = added
+    assert metadata.x_m_per_pixel == metadata.y_m_per_pixel == 0.05
+    assert metadata == expected_metadata
+    assert array_equal(image, expected_image)
+    with pytest.raises(ValueError, match="0.05 m/pixel"):
+        add_to_orthomosaic(
+            orthomosaic_image=orthomosaic_image,
+            orthomosaic_metadata=orthomosaic_metadata,
+            backdown_image=backdown_image,
+            gps_data=second_gps_data,
+            backdown_image_metadata=IMAGE_METADATA,
+            camera_settings=mx9_camera,
+            bottom_crop=0,
+            side_crop=2,
+            metres_per_pixel=0.02,
+        )
+
+
+def test_server_refuses_frames_at_another_resolution(client):
+    frame = dict(
+        backdown_image_b64=b64encode(
+            array_to_bytes(full((300, 400, 3), 128, dtype="uint8"))
+        ).decode(),
+        gps=GPS_DATA.model_dump(),
+        backdown_image_metadata=IMAGE_METADATA.model_dump(),
+        side_crop_pixels=2,
+        tile_size_pixels=64,
+    )
+    response = client.post(url="/orthomosaic/", json=dict(frame, metres_per_pixel=0.05))
+    assert response.status_code == 200
+    orthomosaic_metadata = response.json()["orthomosaic_metadata"]
+    refused = client.post(
+        url="/orthomosaic/",
+        json=dict(
+            frame, metres_per_pixel=0.02, orthomosaic_metadata=orthomosaic_metadata
+        ),
+    )
+    assert refused.status_code == 400
+    assert "0.05 m/pixel" in refused.json()["detail"]
+    added = client.post(
+        url="/orthomosaic/",
+        json=dict(frame, orthomosaic_metadata=orthomosaic_metadata),
+    )
+    assert added.status_code == 200
+    assert added.json()["orthomosaic_metadata"]["x_m_per_pixel"] == 0.05
+
+
+def test_batch_matches_adding_frames_one_at_a_time():
+    # a vehicle driving away from the first frame, so the origin stays put
+    backdown_images = [
+        full((300, 400, 3), value, dtype="uint8") for value in (60, 120, 180, 240)
+    ]
+    gps_data = [
+        GPS(x=572_731.0 + x, y=273_978.0 + y, heading=heading)
+        for x, y, heading in (
+            (0.0, 0.0, 30.0),
+            (0.5, 0.7, 34.0),
+            (0.8, 1.1, 28.0),
+            (1.3, 1.6, 31.0),
+        )
+    ]
+    backdown_images_metadata = [
+        ImageMetadata(roll_deg=-1.0, pitch_deg=pitch_deg)
+        for pitch_deg in (-47.0, -46.0, -48.0, -47.5)
+    ]
+    settings = dict(camera_settings=mx9_camera, bottom_crop=0, side_crop=2)
+    orthomosaic_image = orthomosaic_metadata = None
+    for backdown_image, gps, backdown_image_metadata in zip(
+        backdown_images, gps_data, backdown_images_metadata
+    ):
+        orthomosaic_image, orthomosaic_metadata = add_to_orthomosaic(
+            orthomosaic_image=orthomosaic_image,
+            orthomosaic_metadata=orthomosaic_metadata,
+            backdown_image=backdown_image,
+            gps_data=gps,
+            backdown_image_metadata=backdown_image_metadata,
+            **settings,
+        )
+    batch_image, batch_metadata = add_batch_to_orthomosaic(
+        orthomosaic_image=None,
+        orthomosaic_metadata=None,
+        backdown_images=backdown_images,
+        gps_data=gps_data,
+        backdown_images_metadata=backdown_images_metadata,
+        **settings,
+    )
+    assert batch_metadata.model_dump(exclude={"id"}) == orthomosaic_metadata.model_dump(
+        exclude={"id"}
+    )
+    assert array_equal(batch_image, orthomosaic_image)
+
+
+def test_session_on_a_straight_track_only_grows_along_the_track():
+    session = MosaicSession(camera_settings=mx9_camera, bottom_crop=0, side_crop=0)
+    frame = full((20, 10, 4), 255, dtype="uint8")
+    for step in range(40):
+        session.add_rotated_image(
+            rotated_orthorectified_image=frame,
+            rotated_orthorectified_image_metadata=OrthomosaicMetadata(
+                id=0, x_m=0.0, y_m=step * 0.05, x_m_per_pixel=0.01, y_m_per_pixel=0.01
+            ),
+            heading=0.0,
+        )
+        if step == 0:
+            assert session.canvas.shape[:2] == (40, 10)
+    # 40 rows for the first frame, then 90, 190 and 390 for a 215 row track
+    assert session.allocations == 4
+    assert session.canvas.shape[:2] == (390, 10)
+    orthomosaic_image, _ = session.finalise()
+    assert orthomosaic_image.shape[:2] == (215, 10)
+
+
+@pytest.mark.parametrize("heading", [0.0, 30.0, 117.0])
+def test_fused_warp_matches_warping_then_rotating(heading):
+    rows, columns = ogrid[:300, :400]
+    backdown_image = stack(
+        broadcast_arrays(
+            columns * 255 // 400, rows * 255 // 300, (rows + columns) // 3
+        ),
+        axis=-1,
+    ).astype("uint8")
+    (two_pass_image, two_pass_metadata), (fused_image, fused_metadata) = (
+        orthorectify_and_rotate(
+            backdown_image=backdown_image,
+            gps_data=GPS_DATA.model_copy(update=dict(heading=heading)),
+            backdown_image_metadata=IMAGE_METADATA,
+            camera_settings=mx9_camera,
+            bottom_crop=0,
+            side_crop=20,
+            fused_warp=fused_warp,
+        )
+        for fused_warp in (False, True)
+    )
+    assert fused_metadata.model_dump(exclude={"id"}) == two_pass_metadata.model_dump(
+        exclude={"id"}
+    )
+    assert fused_image.shape == two_pass_image.shape
+    # resampled once rather than twice, so only the edges and rounding differ
+    two_pass_footprint = two_pass_image[:, :, 3] > 0
+    fused_footprint = fused_image[:, :, 3] > 0
+    both = two_pass_footprint & fused_footprint
+    assert both.sum() / (two_pass_footprint | fused_footprint).sum() > 0.99
+    difference = abs(fused_image[both].astype(int) - two_pass_image[both])
+    assert difference[:, :3].mean() < 1
+    assert difference[:, 3].mean() < 2
@@ -0,0 +1,76 @@
+from numpy import array_equal
+
+from orthomosaics.ortho import (
+    GeometryCache,
+    cached_orthorectification_geometry,
+    orthorectification_geometry,
+)
+from orthomosaics.utils.rest_api import mx9_camera
+from orthomosaics.utils.schemas import ImageMetadata
+
+IMAGE_METADATA = ImageMetadata(roll_deg=-1.0, pitch_deg=-47.0)
+
+
+def geometry(geometry_cache: GeometryCache, **settings):
+    return cached_orthorectification_geometry(
+        **(
+            dict(
+                image_width=400,
+                image_height=300,
+                image_metadata=IMAGE_METADATA,
+                camera_settings=mx9_camera,
+            )
+            | settings
+        ),
+        geometry_cache=geometry_cache,
+    )
+
+
+def test_cache_hit_matches_uncached_geometry():
+    geometry_cache = GeometryCache()
+    uncached = orthorectification_geometry(
+        image_width=400,
+        image_height=300,
+        image_metadata=IMAGE_METADATA,
+        camera_settings=mx9_camera,
+    )
+    first = geometry(geometry_cache=geometry_cache)
+    second = geometry(geometry_cache=geometry_cache)
+    assert second is first
+    assert geometry_cache.statistics()["hits"] == 1
+    assert array_equal(second.homography, uncached.homography)
+    assert second.new_size == uncached.new_size
+    assert second.metres_per_pixel == uncached.metres_per_pixel
+
+
+def test_quantised_attitudes_share_an_entry_but_shapes_and_cameras_do_not():
+    geometry_cache = GeometryCache(attitude_tolerance_deg=0.01)
+    first = geometry(geometry_cache=geometry_cache)
+    assert (
+        geometry(
+            geometry_cache=geometry_cache,
+            image_metadata=ImageMetadata(roll_deg=-1.002, pitch_deg=-46.997),
+        )
+        is first
+    )
+    assert geometry(geometry_cache=geometry_cache, image_width=401) is not first
+    assert (
+        geometry(
+            geometry_cache=geometry_cache,
+            camera_settings=mx9_camera.model_copy(update=dict(vertical_fov=60)),
+        )
+        is not first
+    )
+    assert geometry(geometry_cache=geometry_cache, metres_per_pixel=0.01) is not first
+    assert geometry_cache.statistics() == dict(hits=1, misses=4, size=4, hit_rate=0.2)
+
+
+def test_least_recently_used_geometry_is_evicted_at_max_size():
+    geometry_cache = GeometryCache(max_size=2)
+    first = geometry(geometry_cache=geometry_cache, image_width=400)
+    second = geometry(geometry_cache=geometry_cache, image_width=401)
+    assert geometry(geometry_cache=geometry_cache, image_width=400) is first
+    geometry(geometry_cache=geometry_cache, image_width=402)
+    assert geometry_cache.statistics()["size"] == 2
+    assert geometry(geometry_cache=geometry_cache, image_width=400) is first
+    assert geometry(geometry_cache=geometry_cache, image_width=401) is not second
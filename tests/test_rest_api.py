@@ -0,0 +1,44 @@
+from json import dumps
+
+import pytest
+from numpy import full
+
+from orthomosaics.utils.rest_api import NullImage, decode_image_buffer
+from orthomosaics.utils.schemas import GPS, ImageMetadata
+
+BACKDOWN_IMAGE = full((30, 40, 3), 128, dtype="uint8")
+
+
+def test_raw_buffer_is_viewed_with_its_shape():
+    image = decode_image_buffer(
+        image_buffer=BACKDOWN_IMAGE.tobytes(), image_shape=(30, 40, 3)
+    )
+    assert image.shape == (30, 40, 3)
+
+
+@pytest.mark.parametrize("image_shape", [(30, 40, 4), (30, 120), (31, 40, 3)])
+def test_raw_buffer_with_a_wrong_shape_is_refused(image_shape):
+    with pytest.raises(NullImage):
+        decode_image_buffer(
+            image_buffer=BACKDOWN_IMAGE.tobytes(), image_shape=image_shape
+        )
+
+
+def test_truncated_raw_upload_is_a_bad_request(client):
+    response = client.post(
+        url="/orthomosaic/upload",
+        files=dict(backdown_image=BACKDOWN_IMAGE.tobytes()[:-1]),
+        data=dict(
+            payload=dumps(
+                dict(
+                    gps=GPS(x=572_731.0, y=273_978.0, heading=30.0).model_dump(),
+                    backdown_image_metadata=ImageMetadata(
+                        roll_deg=-1.0, pitch_deg=-47.0
+                    ).model_dump(),
+                )
+            ),
+            image_shape="30,40,3",
+        ),
+    )
+    assert response.status_code == 400
+    assert "3599 bytes" in response.json()["detail"]
@@ -0,0 +1,53 @@
+from asyncio import run
+
+from numpy import zeros
+
+from orthomosaics.utils.azure_blob_storage import AzureTileStorage
+from orthomosaics.utils.schemas import ImageEncoding, OrthomosaicMetadata
+from orthomosaics.utils.tile_storage import LocalTileStorage
+
+BLOB_NAMES = [
+    "orthomosaic_1/metadata.json",
+    "orthomosaic_1/frames.json",
+    "orthomosaic_1/frames/frame_0.png",
+    "orthomosaic_1/tile_0_0.png",
+    "orthomosaic_1/tile_0_1.png",
+    "orthomosaic_1/level_1/tile_0_0.png",
+]
+
+
+class FakeAsyncContainer:
+    def __init__(self, names: list[str]) -> None:
+        self.names = names
+
+    async def list_blob_names(self, name_starts_with: str):
+        for name in self.names:
+            if name.startswith(name_starts_with):
+                yield name
+
+
+def azure_tile_storage(names: list[str]) -> AzureTileStorage:
+    storage = AzureTileStorage.__new__(AzureTileStorage)
+    storage.encoding = ImageEncoding()
+    storage.async_container = FakeAsyncContainer(names=names)
+    return storage
+
+
+def test_azure_list_tiles_async_skips_metadata_frames_and_other_levels():
+    storage = azure_tile_storage(names=BLOB_NAMES)
+    assert run(storage.list_tiles_async(image_id=1)) == [(0, 0), (0, 1)]
+    assert run(storage.list_tiles_async(image_id=1, level=1)) == [(0, 0)]
+
+
+def test_local_list_tiles_matches_levels(tmp_path):
+    storage = LocalTileStorage(directory=str(tmp_path))
+    tiles = {(0, 0): zeros((4, 4, 4), dtype="uint8")}
+    storage.write_tiles(image_id=1, tiles=tiles)
+    storage.write_tiles(image_id=1, tiles={(2, 3): tiles[0, 0]}, level=1)
+    storage.write_metadata(
+        metadata=OrthomosaicMetadata(
+            id=1, x_m=0.0, y_m=0.0, x_m_per_pixel=0.01, y_m_per_pixel=0.01
+        )
+    )
+    assert storage.list_tiles(image_id=1) == [(0, 0)]
+    assert run(storage.list_tiles_async(image_id=1, level=1)) == [(2, 3)]
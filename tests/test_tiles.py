@@ -0,0 +1,91 @@
+from numpy import array_equal, full, zeros
+
+from orthomosaics.mosaics import add_to_orthomosaic
+from orthomosaics.tiles import TiledCanvas, add_to_tiled_orthomosaic, assemble_region
+from orthomosaics.utils.rest_api import mx9_camera
+from orthomosaics.utils.schemas import GPS, ImageMetadata
+
+FRAMES = [
+    (
+        full((300, 400, 3), 60 + 40 * index, dtype="uint8"),
+        GPS(x=572_731.0 + 0.4 * index, y=273_978.0 + 0.6 * index, heading=30.0),
+        ImageMetadata(roll_deg=-1.0 + 0.1 * index, pitch_deg=-47.0),
+    )
+    for index in range(3)
+]
+
+
+def rgba(value: int, alpha: int = 255, height: int = 4, width: int = 4):
+    image = full((height, width, 4), value, dtype="uint8")
+    image[:, :, 3] = alpha
+    return image
+
+
+def test_tiled_build_matches_the_single_image_orthomosaic():
+    orthomosaic_image = orthomosaic_metadata = None
+    canvas = tiled_metadata = None
+    for backdown_image, gps_data, backdown_image_metadata in FRAMES:
+        settings = dict(
+            backdown_image=backdown_image,
+            gps_data=gps_data,
+            backdown_image_metadata=backdown_image_metadata,
+            camera_settings=mx9_camera,
+            bottom_crop=0,
+            side_crop=2,
+            metres_per_pixel=0.01,
+        )
+        orthomosaic_image, orthomosaic_metadata = add_to_orthomosaic(
+            orthomosaic_image=orthomosaic_image,
+            orthomosaic_metadata=orthomosaic_metadata,
+            **settings,
+        )
+        canvas, tiled_metadata = add_to_tiled_orthomosaic(
+            canvas=canvas, orthomosaic_metadata=tiled_metadata, tile_size=64, **settings
+        )
+    assert (tiled_metadata.x_m, tiled_metadata.y_m) == (
+        orthomosaic_metadata.x_m,
+        orthomosaic_metadata.y_m,
+    )
+    assert tiled_metadata.tile_indices == sorted(canvas.tiles)
+    height, width, _ = orthomosaic_image.shape
+    assert array_equal(
+        assemble_region(
+            tiles=canvas.tiles, tile_size=64, x=0, y=0, width=width, height=height
+        ),
+        orthomosaic_image,
+    )
+    x_min, y_min, x_max, y_max = canvas.bounds()
+    assert 0 <= x_min and 0 <= y_min and width <= x_max and height <= y_max
+    tiled_image = canvas.to_array()
+    assert tiled_image.shape == (y_max - y_min, x_max - x_min, 4)
+    assert (
+        tiled_image[:, :, 3].astype(bool).sum()
+        == orthomosaic_image[:, :, 3].astype(bool).sum()
+    )
+
+
+def test_negative_tile_indices_bounds_and_to_array():
+    canvas = TiledCanvas(tile_size=4)
+    assert canvas.add_image(image=rgba(value=9, height=6, width=2), x=-3, y=-5) == [
+        (-2, -1),
+        (-1, -1),
+        (0, -1),
+    ]
+    assert canvas.bounds() == (-4, -8, 0, 4)
+    image = canvas.to_array()
+    assert image.shape == (12, 4, 4)
+    expected = zeros((12, 4, 4), dtype="uint8")
+    expected[3:9, 1:3] = 9
+    expected[3:9, 1:3, 3] = 255
+    assert array_equal(image, expected)
+
+
+def test_transparent_sections_are_skipped():
+    canvas = TiledCanvas(tile_size=4)
+    image = rgba(value=7, height=4, width=8)
+    image[:, 4:, 3] = 0
+    assert canvas.add_image(image=image, x=0, y=0) == [(0, 0)]
+    assert list(canvas.tiles) == [(0, 0)]
+    assert canvas.dirty == {(0, 0)}
+    assert canvas.add_image(image=rgba(value=7, alpha=0), x=8, y=8) == []
+    assert list(canvas.tiles) == [(0, 0)]